@@ -0,0 +1,242 @@
+#Batched version of simulation_game.Game that advances many independent games in lockstep.
+#Every piece of per-player state is stored as a (n_games, n_players, ...) NumPy array.
+import numpy as np
+from game2_vectorized import VECTORIZED_RULES, COOPERATE, Sim5Rule, play_turn_sim5_vec
+from rules import batch_rule
+from strategies import Population, StrategyInputs
+
+'''
+#Class holding n_games independent copies of simulation_game.Game.
+    It follows the same rules as Game.play_round: a random target on an empty history or with 10%
+    chance, otherwise the target with the most recorded betrayals, an action drawn from the Q-values,
+    vectorized rule resolution and a Q-learning update.
+
+    Game.resources never changes during a game, so each player only ever reads and writes the Q-values
+    of a single state. Those are stored as q_cooperate (n_games, n_players) and
+    q_betray (n_games, n_players, n_players). The Q-values of new_state are the defaults unless the
+    total points happen to equal the starting resources, in which case it is that same state.
+'''
+class BatchGame:
+    '''
+    #Constructor to initialize the state of all games.
+        n_games: Number of independent games advanced together.
+        n_players: Total number of players in each game.
+        n_resources: Number of resources each player starts with.
+        betray_probabilities: List of betrayal probabilities for each player (shared by all games),
+            or a (n_games, n_players) array with one profile per game.
+        play_turn_func: A rule name registered in rules.RULE_SPECS, a game2 rule function, its vectorized
+            counterpart from game2_vectorized, or a Sim5Rule with shape (n_games, n_players).
+        alpha: Learning rate for Q-learning (default 1.0).
+        gamma: Discount factor for future rewards in Q-learning (default 0.01).
+        seed: Seed or numpy Generator used for all random draws.
+        strategies: Optional strategies of the players (see strategies.Population), shared by all games.
+            By default the actions follow Player.choose_action.
+    '''
+    def __init__(self, n_games, n_players, n_resources, betray_probabilities, play_turn_func,
+                 alpha=1.0, gamma=0.01, seed=None, strategies=None):
+        self.n_games = n_games
+        self.n_players = n_players
+        self.n_resources = n_resources
+        self.alpha = alpha
+        self.gamma = gamma
+        self.rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+        #Accept registered rule names, the dictionary based rules and their vectorized counterparts.
+        if isinstance(play_turn_func, str):
+            rule = batch_rule(play_turn_func, n_games, n_players)
+        else:
+            rule = VECTORIZED_RULES.get(play_turn_func, play_turn_func)
+
+        #play_turn_sim5 keeps a betrayer history, which gets its own Sim5Rule for this batch.
+        if rule is play_turn_sim5_vec:
+            rule = Sim5Rule((n_games, n_players))
+        self.rule = rule
+        self.play_turn_func = rule.resolve if isinstance(rule, Sim5Rule) else rule
+
+        shape = (n_games, n_players)
+        self.betray_probabilities = np.broadcast_to(
+            np.asarray(betray_probabilities, dtype=np.float64), shape
+        ).copy()
+
+        #Q-values of the single state, initialized like the Player.q_table defaults.
+        self.q_cooperate = np.full(shape, 0.5)
+        self.q_betray = np.repeat(self.betray_probabilities[:, :, None], n_players, axis=2)
+
+        #Highest default Q-value, used when the new state has never been updated.
+        self.default_max_q = np.maximum(0.5, self.betray_probabilities)
+
+        #Betrayals recorded against each target and the order in which targets entered the history.
+        self.history_betrayals = np.zeros((n_games, n_players, n_players), dtype=np.int64)
+        self.history_order = np.full((n_games, n_players, n_players), -1, dtype=np.int64)
+        self.history_size = np.zeros(shape, dtype=np.int64)
+
+        #Total points, collapse count and collapse contributions of every game.
+        self.total_points = np.zeros(shape, dtype=np.int64)
+        self.collapse_count = np.zeros(n_games, dtype=np.int64)
+        self.collapse_contributions = np.zeros(shape, dtype=np.int64)
+
+        #Strategies of the players, with the last move and grudge of every target towards every player.
+        self.population = None if strategies is None else Population(strategies, n_players)
+        if self.population is not None:
+            self.last_moves = np.full((n_games, n_players, n_players), -1, dtype=np.int8)
+            self.grudges = np.zeros((n_games, n_players, n_players), dtype=bool)
+
+        self.round_num = 0
+
+    '''
+    #Method to select a target for every player of every game.
+        Mirrors Game.choose_target, breaking ties in favor of the target that entered the history first.
+    '''
+    def choose_targets(self):
+        n_games, n_players = self.n_games, self.n_players
+        player_ids = np.arange(n_players)
+
+        #Random target different from the player itself.
+        random_targets = self.rng.integers(0, n_players - 1, size=(n_games, n_players))
+        random_targets += random_targets >= player_ids
+
+        #Target with the most betrayals, earlier history entries winning ties.
+        known = self.history_order >= 0
+        score = np.where(
+            known,
+            self.history_betrayals * n_players + (n_players - 1 - self.history_order),
+            -1,
+        )
+        best_targets = np.argmax(score, axis=2)
+
+        use_random = (self.history_size == 0) | (self.rng.random((n_games, n_players)) < 0.1)
+        return np.where(use_random, random_targets, best_targets)
+
+    '''
+    #Method to decide between betrayal and cooperation for every player of every game.
+        target_players: The (n_games, n_players) targets returned by choose_targets.
+        Returns the target array with -1 for cooperation.
+    '''
+    def choose_actions(self, target_players):
+        draws = self.rng.random((self.n_games, self.n_players))
+        if self.population is not None:
+            betray = self.population.choose(self.strategy_inputs(target_players), draws)
+            return np.where(betray, target_players, COOPERATE)
+
+        if self.round_num == 1:
+            betrayal_chance = self.betray_probabilities
+        else:
+            q_value_betray = np.take_along_axis(self.q_betray, target_players[:, :, None], axis=2)[:, :, 0]
+            betrayal_chance = self.betray_probabilities * (q_value_betray - self.q_cooperate)
+            betrayal_chance = np.maximum(betrayal_chance, 0.1)
+        return np.where(draws < betrayal_chance, target_players, COOPERATE)
+
+    '''
+    #Method to build the strategy inputs of every player of every game.
+        target_players: The (n_games, n_players) targets returned by choose_targets.
+    '''
+    def strategy_inputs(self, target_players):
+        columns = target_players[:, :, None]
+        inputs = StrategyInputs(
+            self.round_num,
+            self.betray_probabilities,
+            last_moves=np.take_along_axis(self.last_moves, columns, axis=2)[:, :, 0],
+            grudges=np.take_along_axis(self.grudges, columns, axis=2)[:, :, 0],
+        )
+        if self.population.needs_q_values:
+            inputs.q_cooperate = self.q_cooperate
+            inputs.q_betray = np.take_along_axis(self.q_betray, columns, axis=2)[:, :, 0]
+            #The diagonal of q_betray is the player itself, not a betrayal action.
+            players = np.arange(self.n_players)
+            q_betray = np.where(players[:, None] == players, -np.inf, self.q_betray)
+            inputs.q_betray_max = q_betray.max(axis=2)
+        return inputs
+
+    '''
+    #Method to record the chosen targets in the interaction history.
+        target_players: The chosen targets.
+        actions: The target array with -1 for cooperation.
+    '''
+    def update_history(self, target_players, actions):
+        games = np.arange(self.n_games)[:, None]
+        players = np.arange(self.n_players)[None, :]
+
+        #Targets seen for the first time enter the history after the existing ones.
+        new_entry = self.history_order[games, players, target_players] < 0
+        self.history_order[games, players, target_players] = np.where(
+            new_entry, self.history_size, self.history_order[games, players, target_players]
+        )
+        self.history_size += new_entry
+        self.history_betrayals[games, players, target_players] += actions != COOPERATE
+
+        #The targets remember the move of each player towards them, for the reciprocating strategies.
+        if self.population is not None:
+            self.last_moves[games, target_players, players] = actions != COOPERATE
+            self.grudges[games, target_players, players] |= actions != COOPERATE
+
+    '''
+    #Method to update the Q-values after the round.
+        actions: The target array with -1 for cooperation.
+        rewards: The turn points of each player.
+    '''
+    def update_q_values(self, actions, rewards):
+        betrayed = actions != COOPERATE
+        targets = np.maximum(actions, 0)[:, :, None]
+        current_betray = np.take_along_axis(self.q_betray, targets, axis=2)[:, :, 0]
+        current_q = np.where(betrayed, current_betray, self.q_cooperate)
+
+        #The new state is the current one only when every total equals the starting resources.
+        max_future_q = self.default_max_q
+        same_state = (self.total_points == self.n_resources).all(axis=1)
+        if same_state.any():
+            q_betray = self.q_betray.copy()
+            q_betray[:, np.arange(self.n_players), np.arange(self.n_players)] = -np.inf
+            current_max = np.maximum(self.q_cooperate, q_betray.max(axis=2))
+            max_future_q = np.where(same_state[:, None], current_max, max_future_q)
+
+        new_q = (1 - self.alpha) * current_q + self.alpha * (rewards + self.gamma * max_future_q)
+
+        self.q_cooperate = np.where(betrayed, self.q_cooperate, new_q)
+        np.put_along_axis(
+            self.q_betray,
+            targets,
+            np.where(betrayed, new_q, current_betray)[:, :, None],
+            axis=2,
+        )
+
+    '''
+    #Method to play one round of every game.
+        Returns the actions (-1 for cooperation), the updated total points, the turn points
+        and the collapse flag of each game.
+    '''
+    def play_round(self):
+        self.round_num += 1
+
+        #Each player chooses a target and decides whether to betray or cooperate.
+        target_players = self.choose_targets()
+        actions = self.choose_actions(target_players)
+        self.update_history(target_players, actions)
+
+        #Resolve the turn of all games at once.
+        turn_points, self.total_points, counts, collapse_occurred = self.play_turn_func(
+            actions, self.total_points, self.n_resources
+        )
+
+        self.update_q_values(actions, turn_points)
+
+        #Betrayers of a target betrayed more than twice contribute to the collapse.
+        self.collapse_count += collapse_occurred
+        betrayed = actions != COOPERATE
+        crowded = np.take_along_axis(counts, np.maximum(actions, 0), axis=1) > 2
+        self.collapse_contributions += collapse_occurred[:, None] & betrayed & crowded
+
+        return {
+            "actions": actions,
+            "resources": self.total_points.copy(),
+            "turn_points": turn_points,
+            "collapse": collapse_occurred,
+        }
+
+    '''
+    #Method to play n_rounds rounds of every game.
+        Returns the final total points of each game.
+    '''
+    def run(self, n_rounds):
+        for _ in range(n_rounds):
+            self.play_round()
+        return self.total_points
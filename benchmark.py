@@ -0,0 +1,263 @@
+#Benchmark suite of the hot paths: the game2 turn rules, Game.play_round, the metrics and the figures.
+#Results are written as JSON and can be compared with a saved baseline to catch regressions:
+#    python benchmark.py --output baseline.json
+#    python benchmark.py --output current.json --baseline baseline.json
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import timeit
+import warnings
+
+import numpy as np
+
+import game2
+from rules import RULE_SPECS
+from round_recorder import RoundRecorder
+from simulation_game import Game
+
+#Version of the results layout.
+BENCHMARK_VERSION = 1
+
+#Suites run by default, in order.
+SUITES = ("turn_rules", "play_round", "metrics", "plots")
+
+#Sizes of each suite: the default ones and the smaller --quick ones.
+DEFAULT_SIZES = {
+    "turn_players": [4, 10, 100, 1000, 10000],
+    "round_players": 6,
+    "round_checkpoints": [1000, 2000, 5000, 10000, 20000],
+    "metrics_rounds": [100, 1000, 10000, 100000],
+    "plot_rounds": 1000,
+}
+QUICK_SIZES = {
+    "turn_players": [4, 100, 1000],
+    "round_players": 6,
+    "round_checkpoints": [100, 200, 400],
+    "metrics_rounds": [100, 1000],
+    "plot_rounds": 200,
+}
+
+'''
+#Function to time a function with timeit.
+    Each measure runs the function enough times to last about 0.2 seconds (see timeit.Timer.autorange).
+    Returns the best time per call in seconds over `repeat` measures.
+'''
+def _best_time(function, repeat):
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+#Function to build a benchmark result.
+def _result(suite, name, params, seconds):
+    return {"suite": suite, "name": name, "params": params, "seconds": seconds}
+
+#Function to draw the actions of a turn: every player betrays a random other player with the given probability.
+def _random_actions(n_players, betray_probability, rng):
+    targets = (np.arange(n_players) + rng.integers(1, n_players, n_players)) % n_players
+    betray = rng.random(n_players) < betray_probability
+    return {
+        str(player): str(target) if betrays else None
+        for player, (target, betrays) in enumerate(zip(targets.tolist(), betray.tolist()))
+    }
+
+'''
+#Function to benchmark every game2.play_turn* rule on a single turn.
+    players_list: Numbers of players of the turns.
+    repeat: Number of timeit measures (the best one is kept).
+'''
+def bench_turn_rules(players_list, repeat=5, betray_probability=0.3, seed=0):
+    results = []
+    rng = np.random.default_rng(seed)
+    for n_players in players_list:
+        actions = _random_actions(n_players, betray_probability, rng)
+        for name in RULE_SPECS:
+            play_turn_func = getattr(game2, name)
+            resources = RULE_SPECS[name].default_resources
+
+            #Every call starts from the same totals and (for play_turn_sim5) betrayer history.
+            def run():
+                game2.times_betrayers.clear()
+                play_turn_func(actions, {player: 0 for player in actions}, resources)
+
+            results.append(_result("turn_rules", name, {"n_players": n_players}, _best_time(run, repeat)))
+    game2.times_betrayers.clear()
+    return results
+
+'''
+#Function to benchmark Game.play_round as the game goes on.
+    The rounds between two checkpoints are timed together, and each checkpoint reports the time per round
+    of its block, so a cost growing with the number of played rounds (choose_target, Q-table) shows up.
+'''
+def bench_play_round(n_players, checkpoints, rule="play_turn_v2", betray_probability=0.3, seed=0):
+    random.seed(seed)
+    game = Game(n_players, RULE_SPECS[rule].default_resources, [betray_probability] * n_players, getattr(game2, rule))
+
+    results = []
+    round_num = 1
+    for checkpoint in checkpoints:
+        first_round = round_num
+        start = time.perf_counter()
+        while round_num <= checkpoint:
+            game.play_round(round_num)
+            round_num += 1
+        seconds = (time.perf_counter() - start) / max(1, round_num - first_round)
+        results.append(_result("play_round", rule, {"n_players": n_players, "round": checkpoint}, seconds))
+    return results
+
+'''
+#Function to build synthetic recorded rounds for the metrics and plot benchmarks.
+    Every player betrays a random other player with the given probability, and points grow by the resources
+    minus the betrayals received plus the betrayals made, with a collapse on about 1% of the rounds.
+'''
+def synthetic_rounds(n_rounds, n_players, betray_probability=0.3, resources=1, seed=0):
+    rng = np.random.default_rng(seed)
+    targets = (np.arange(n_players) + rng.integers(1, n_players, (n_rounds, n_players))) % n_players
+    betray = rng.random((n_rounds, n_players)) < betray_probability
+    targets = np.where(betray, targets, -1).astype(np.int16)
+
+    turn_points = np.full((n_rounds, n_players), resources, dtype=np.int64) + betray
+    received = np.zeros((n_rounds, n_players), dtype=np.int64)
+    rows = np.nonzero(betray)
+    np.add.at(received, (rows[0], targets[rows]), 1)
+    turn_points -= received
+
+    collapses = rng.random(n_rounds) < 0.01
+    return RoundRecorder.from_columns(targets, np.cumsum(turn_points, axis=0), turn_points, collapses)
+
+'''
+#Function to benchmark evaluation.calculate_metrics (and the vectorized metrics) against the number of rounds.
+'''
+def bench_metrics(rounds_list, n_players=6, repeat=3, seed=0):
+    from evaluation import calculate_metrics
+    from evaluation_vectorized import calculate_metrics_from_arrays
+
+    results = []
+    for n_rounds in rounds_list:
+        game_data = synthetic_rounds(n_rounds, n_players, seed=seed)
+        benchmarks = {
+            "calculate_metrics": lambda: calculate_metrics(game_data),
+            "calculate_metrics_from_arrays": lambda: calculate_metrics_from_arrays(game_data.targets, game_data.points),
+        }
+        for name, function in benchmarks.items():
+            #calculate_metrics warns on rounds without betrayals after a collapse, which is not part of the benchmark.
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                seconds = _best_time(function, repeat)
+            results.append(_result("metrics", name, {"n_rounds": n_rounds, "n_players": n_players}, seconds))
+    return results
+
+'''
+#Function to benchmark the time to build each figure of graphic_generation.generate_plots.
+    The figures are built with the Agg backend and closed, without being saved.
+'''
+def bench_plots(n_rounds, n_players=6, repeat=3, seed=0):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    from evaluation_vectorized import calculate_metrics_from_arrays
+    from graphic_generation import plot_specs
+    import graphic_generation
+
+    game_data = synthetic_rounds(n_rounds, n_players, seed=seed)
+    metrics = calculate_metrics_from_arrays(game_data.targets, game_data.points)
+    metrics["resources_over_time"] = game_data.resources_over_time()
+
+    results = []
+    for name, (function_name, args) in plot_specs(metrics, n_rounds, game_data).items():
+        function = getattr(graphic_generation, function_name)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fig = function(*args)
+            times.append(time.perf_counter() - start)
+            plt.close(fig)
+        results.append(_result("plots", name, {"n_rounds": n_rounds, "n_players": n_players}, min(times)))
+    return results
+
+'''
+#Function to run the selected suites.
+    suites: Names of the suites to run (see SUITES).
+    quick: Use the smaller QUICK_SIZES.
+    Returns a JSON serializable dictionary with the environment and the list of results.
+'''
+def run_benchmarks(suites=SUITES, quick=False, repeat=5):
+    sizes = QUICK_SIZES if quick else DEFAULT_SIZES
+    results = []
+    for suite in suites:
+        if suite == "turn_rules":
+            results += bench_turn_rules(sizes["turn_players"], repeat)
+        elif suite == "play_round":
+            results += bench_play_round(sizes["round_players"], sizes["round_checkpoints"])
+        elif suite == "metrics":
+            results += bench_metrics(sizes["metrics_rounds"], repeat=repeat)
+        elif suite == "plots":
+            results += bench_plots(sizes["plot_rounds"], repeat=repeat)
+        else:
+            raise ValueError(f"Unknown suite: {suite}")
+
+    return {
+        "version": BENCHMARK_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "quick": quick,
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+#Function to build the key identifying a result across runs.
+def result_key(result):
+    params = ",".join(f"{key}={value}" for key, value in sorted(result["params"].items()))
+    return f"{result['suite']}/{result['name']}[{params}]"
+
+'''
+#Function to compare results with a baseline.
+    tolerance: Allowed slowdown, as a fraction of the baseline time (0.25 allows 25% slower).
+    Returns a list of (key, baseline seconds, current seconds, ratio, regressed) for the results in both.
+'''
+def compare(current, baseline, tolerance=0.25):
+    baseline_times = {result_key(result): result["seconds"] for result in baseline["results"]}
+    comparison = []
+    for result in current["results"]:
+        key = result_key(result)
+        if key not in baseline_times:
+            continue
+        ratio = result["seconds"] / baseline_times[key] if baseline_times[key] > 0 else float("inf")
+        comparison.append((key, baseline_times[key], result["seconds"], ratio, ratio > 1 + tolerance))
+    return comparison
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of the dilemma game.")
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--quick", action="store_true", help="Use smaller sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of measures per benchmark (the best is kept)")
+    parser.add_argument("--output", default=None, help="JSON file where the results are saved")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.suites, args.quick, args.repeat)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(current, file, indent=2)
+
+    if args.baseline is None:
+        for result in current["results"]:
+            print(f"{result_key(result)}: {result['seconds'] * 1e6:.1f} us")
+        sys.exit(0)
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    comparison = compare(current, baseline, args.tolerance)
+    for key, baseline_seconds, seconds, ratio, regressed in comparison:
+        flag = " REGRESSION" if regressed else ""
+        print(f"{key}: {baseline_seconds * 1e6:.1f} us -> {seconds * 1e6:.1f} us ({ratio:.2f}x){flag}")
+
+    #A non-zero exit status lets scripts fail on a regression.
+    sys.exit(1 if any(regressed for *_, regressed in comparison) else 0)
@@ -0,0 +1,115 @@
+#Sparse betrayal graph of a round: an edge from each betrayer to its target.
+#The edges are kept as two arrays in betrayal (player) order, with the in-degree of every player for collapse
+#detection, and a CSR index (rows = targets) built only when the betrayers of a given target are needed.
+#The cost of a round scales with the number of betrayals instead of per-target lists of player strings.
+from collections.abc import Mapping
+
+import numpy as np
+
+'''
+#Class storing the betrayals of a round.
+    betrayers, targets: int arrays with one edge per betrayal, in the order the players acted.
+    in_degree: int array with the number of betrayers of each player (the collapse counters).
+    The graph is a read-only Mapping with the same content as the betrayals dictionary of
+    simulation_game.Game.play_round ({str(target): [str(betrayer), ...]}, targets in increasing order),
+    so code written for that dictionary keeps working.
+'''
+class BetrayalGraph(Mapping):
+    '''
+    #Constructor from the edges of the round.
+        betrayers, targets: Sequences of player IDs (ints), one entry per betrayal, in player order.
+        n_players: Total number of players in the game.
+    '''
+    def __init__(self, betrayers, targets, n_players):
+        self.n_players = n_players
+        self.betrayers = np.asarray(betrayers, dtype=np.intp)
+        self.targets = np.asarray(targets, dtype=np.intp)
+        self.in_degree = np.bincount(self.targets, minlength=n_players)
+        self._order = None
+        self._indptr = None
+
+    '''
+    #Function to build the graph of a round from its target array.
+        targets: int array with the betrayed player of each player (-1 for cooperation).
+    '''
+    @classmethod
+    def from_targets(cls, targets):
+        targets = np.asarray(targets)
+        betrayers = np.flatnonzero(targets >= 0)
+        return cls(betrayers, targets[betrayers], len(targets))
+
+    '''
+    #Function to build the graph of a round from the actions dictionary of game2 ({player: target or None}).
+    '''
+    @classmethod
+    def from_actions(cls, player_actions):
+        edges = [(int(player), int(action)) for player, action in player_actions.items() if action is not None]
+        betrayers = [betrayer for betrayer, _ in edges]
+        targets = [target for _, target in edges]
+        return cls(betrayers, targets, len(player_actions))
+
+    #Method to build the CSR index: the edges sorted by target (stable) and the offsets of each target.
+    def _index(self):
+        if self._indptr is None:
+            self._order = np.argsort(self.targets, kind="stable")
+            self._indptr = np.zeros(self.n_players + 1, dtype=np.intp)
+            np.cumsum(self.in_degree, out=self._indptr[1:])
+        return self._order, self._indptr
+
+    #Number of betrayals of the round.
+    @property
+    def n_betrayals(self):
+        return len(self.targets)
+
+    #Method returning the betrayers of a target (player ID), in player order.
+    def betrayers_of(self, target):
+        order, indptr = self._index()
+        return self.betrayers[order[indptr[target]:indptr[target + 1]]]
+
+    #Method returning a mask of the players betrayed more than threshold times.
+    def collapsed(self, threshold):
+        return self.in_degree > threshold
+
+    #Method counting the players betrayed more than threshold times.
+    def count_collapsed(self, threshold):
+        return int(np.count_nonzero(self.in_degree > threshold))
+
+    '''
+    #Method returning the first player betrayed more than threshold times, or -1 if there is none.
+        The order is the one of the betrayals dictionaries of game2, where targets appear in the order
+        of their first betrayer: it is the target of the first edge whose target collapsed.
+    '''
+    def first_collapsed(self, threshold):
+        edges = np.flatnonzero(self.in_degree[self.targets] > threshold)
+        return int(self.targets[edges[0]]) if len(edges) else -1
+
+    #Method returning the betrayers of the players betrayed more than threshold times, in player order.
+    def collapse_betrayers(self, threshold):
+        return self.betrayers[self.in_degree[self.targets] > threshold]
+
+    def __getitem__(self, key):
+        try:
+            target = int(key)
+        except (TypeError, ValueError):
+            raise KeyError(key) from None
+        if not 0 <= target < self.n_players or not self.in_degree[target]:
+            raise KeyError(key)
+        return [str(betrayer) for betrayer in self.betrayers_of(target).tolist()]
+
+    def __iter__(self):
+        return (str(target) for target in np.flatnonzero(self.in_degree).tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.in_degree))
+
+    def __repr__(self):
+        return f"BetrayalGraph(n_players={self.n_players}, n_betrayals={self.n_betrayals})"
+
+'''
+#Function to count the targets betrayed more than threshold times in the betrayals of a round.
+    betrayals: A BetrayalGraph (read from its in-degree counters) or a betrayals dictionary.
+'''
+def count_collapsed(betrayals, threshold):
+    if isinstance(betrayals, BetrayalGraph):
+        return betrayals.count_collapsed(threshold)
+    return sum(1 for betrayers in betrayals.values() if len(betrayers) > threshold)
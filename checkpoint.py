@@ -0,0 +1,302 @@
+#Checkpoints of a running simulation_game.Game as NumPy .npz archives.
+#The game state (Q-tables, histories, points, collapse counters, rule state) and the state of the random module
+#are flattened into arrays, so a run can be stopped and resumed, even in another process, with the same results.
+#The Game itself (rule, Q-table stores, history_length) is rebuilt by the caller with the same parameters,
+#and the saved state is loaded into it, like Sim5Rule.state_dict / load_state_dict.
+#The recorded rounds are kept next to the checkpoint in a file of fixed-width records
+#(round_recorder.record_dtype), which every checkpoint only extends with the rounds played since the previous one.
+import os
+import random
+from collections import OrderedDict
+
+import numpy as np
+
+from q_table import ArrayQTable, BoundedQTable
+from round_recorder import record_dtype
+
+#Version of the checkpoint layout.
+CHECKPOINT_VERSION = 1
+
+#Function to get the file holding the recorded rounds of a checkpoint.
+def rounds_path(path):
+    return f"{path}.rounds"
+
+#Function to convert a dictionary Q-table row ({None: cooperate, str(target): betray}) into an array row.
+def _dict_row(values, player_id, n_players):
+    return [values[None] if target == player_id else values[str(target)] for target in range(n_players)]
+
+'''
+#Function to flatten the Q-tables of the players.
+    Returns the stored keys (one int row per state), their values (column player_id holds cooperation),
+    the number of states per player, and for array Q-tables the row of each state, the LFU use counts
+    and the lookup statistics.
+'''
+def _q_table_state(players, n_players):
+    keys, values, rows, frequency, counts, stats = [], [], [], [], [], []
+    for player in players:
+        q_table = player.q_table
+        if isinstance(q_table, ArrayQTable):
+            for key, row in q_table.index.items():
+                keys.append(key)
+                values.append(q_table.values[row].astype(np.float64))
+                rows.append(row)
+                frequency.append(q_table.frequency[row] if isinstance(q_table, BoundedQTable) else 0)
+            counts.append(len(q_table.index))
+            stats.append([q_table.hits, q_table.misses, q_table.evictions])
+        else:
+            for key, row_values in q_table.items():
+                keys.append(key)
+                values.append(_dict_row(row_values, player.id, n_players))
+                rows.append(len(rows))
+                frequency.append(0)
+            counts.append(len(q_table))
+            stats.append([0, 0, 0])
+
+    return {
+        "q_keys": np.array(keys, dtype=np.int64).reshape(len(keys), n_players),
+        "q_values": np.array(values, dtype=np.float64).reshape(len(values), n_players),
+        "q_rows": np.array(rows, dtype=np.int64),
+        "q_frequency": np.array(frequency, dtype=np.int64),
+        "q_counts": np.array(counts, dtype=np.int64),
+        "q_stats": np.array(stats, dtype=np.int64),
+    }
+
+#Function to restore the Q-table of a player from its slice of the flattened arrays.
+def _load_q_table(player, keys, values, rows, frequency, stats):
+    q_table = player.q_table
+    keys = [tuple(key) for key in keys.tolist()]
+
+    if not isinstance(q_table, ArrayQTable):
+        q_table.clear()
+        for key, row_values in zip(keys, values.tolist()):
+            q_table[key] = {
+                None if target == player.id else str(target): value for target, value in enumerate(row_values)
+            }
+        return
+
+    capacity = len(q_table.values)
+    while capacity < len(keys) or (len(rows) and capacity <= rows.max()):
+        capacity *= 2
+    q_table.values = np.empty((capacity, q_table.n_players), dtype=q_table.values.dtype)
+    q_table.index = OrderedDict() if isinstance(q_table, BoundedQTable) else {}
+    for key, row, row_values, uses in zip(keys, rows.tolist(), values, frequency.tolist()):
+        q_table.index[key] = row
+        q_table.values[row] = row_values
+        if isinstance(q_table, BoundedQTable):
+            q_table.row_keys[row] = key
+            q_table.frequency[row] = uses
+    q_table.hits, q_table.misses, q_table.evictions = stats.tolist()
+
+'''
+#Function to flatten the state of a Game into a dictionary of arrays.
+    The histories are stored as the targets of each player (in history order), the length of each
+    target's history and the concatenated betrayal flags.
+'''
+def game_state(game):
+    n_players = game.n_players
+    players = game.players
+
+    history_targets, history_lengths, history_values, history_counts = [], [], [], []
+    for player in players:
+        history_counts.append(len(player.history))
+        for target, history in player.history.items():
+            history_targets.append(int(target))
+            history_lengths.append(len(history))
+            history_values.extend(history)
+
+    state = {
+        "version": np.int64(CHECKPOINT_VERSION),
+        "n_players": np.int64(n_players),
+        "n_resources": np.int64(game.n_resources),
+        "resources": np.asarray(game.resources, dtype=np.int64),
+        "betray_probabilities": np.array([player.betray_probability for player in players], dtype=np.float64),
+        "total_points": np.array([game.total_points[str(i)] for i in range(n_players)], dtype=np.int64),
+        "collapse_count": np.int64(game.collapse_count),
+        "collapse_contributions": np.array(
+            [game.collapse_contributions[str(i)] for i in range(n_players)], dtype=np.int64
+        ),
+        "betray_count": np.array([player.betray_count for player in players], dtype=np.int64),
+        "most_betrayed": np.array(
+            [-1 if player.most_betrayed_target is None else int(player.most_betrayed_target) for player in players],
+            dtype=np.int64,
+        ),
+        "history_counts": np.array(history_counts, dtype=np.int64),
+        "history_targets": np.array(history_targets, dtype=np.int64),
+        "history_lengths": np.array(history_lengths, dtype=np.int64),
+        "history_values": np.array(history_values, dtype=np.int8),
+    }
+    state.update(_q_table_state(players, n_players))
+
+    #Betrayer history of the rule, if it has one.
+    try:
+        spec, times_betrayers, _ = game.rule_state()
+    except ValueError:
+        spec = None
+    if spec is not None and spec.betrayer_penalty is not None:
+        state["rule_times_betrayers"] = np.array(times_betrayers, dtype=np.int64)
+
+    #Moves remembered for the population strategies, if the game has them.
+    if game.population is not None:
+        state["strategy_last_moves"] = game.last_moves
+        state["strategy_grudges"] = game.grudges
+
+    return state
+
+'''
+#Function to load a state created by game_state into a Game.
+    game: A Game built with the same number of players, rule and Q-table stores as the saved one.
+'''
+def load_game_state(game, state):
+    n_players = game.n_players
+    if int(state["n_players"]) != n_players:
+        raise ValueError(f"The checkpoint has {int(state['n_players'])} players, the game has {n_players}")
+
+    game.resources = np.array(state["resources"], dtype=np.int64)
+    game.total_points = {str(i): points for i, points in enumerate(state["total_points"].tolist())}
+    game.collapse_count = int(state["collapse_count"])
+    game.collapse_contributions = {
+        str(i): contributions for i, contributions in enumerate(state["collapse_contributions"].tolist())
+    }
+
+    history_offsets = np.concatenate(([0], np.cumsum(state["history_counts"])))
+    value_offsets = np.concatenate(([0], np.cumsum(state["history_lengths"])))
+    q_offsets = np.concatenate(([0], np.cumsum(state["q_counts"])))
+    history_values = state["history_values"].tolist()
+
+    for i, player in enumerate(game.players):
+        player.betray_probability = float(state["betray_probabilities"][i])
+        player.betray_count = int(state["betray_count"][i])
+
+        #Histories and the running totals derived from them.
+        player.history.clear()
+        player.history_betrayals = {}
+        player.history_order = {}
+        for entry in range(history_offsets[i], history_offsets[i + 1]):
+            target = str(int(state["history_targets"][entry]))
+            values = history_values[value_offsets[entry]:value_offsets[entry + 1]]
+            player.history[target].extend(values)
+            player.history_order[target] = len(player.history_order)
+            player.history_betrayals[target] = sum(values)
+        best = int(state["most_betrayed"][i])
+        player.most_betrayed_target = None if best < 0 else str(best)
+
+        block = slice(q_offsets[i], q_offsets[i + 1])
+        _load_q_table(
+            player, state["q_keys"][block], state["q_values"][block], state["q_rows"][block],
+            state["q_frequency"][block], state["q_stats"][i],
+        )
+
+    if "rule_times_betrayers" in state:
+        _, times_betrayers, store_times = game.rule_state()
+        times_betrayers[...] = state["rule_times_betrayers"]
+        store_times(times_betrayers)
+
+    if "strategy_last_moves" in state and game.population is not None:
+        game.last_moves = np.array(state["strategy_last_moves"], dtype=np.int8)
+        game.grudges = np.array(state["strategy_grudges"], dtype=bool)
+
+#Function to flatten the state of the random module.
+def _random_state():
+    version, internal_state, gauss_next = random.getstate()
+    return {
+        "random_version": np.int64(version),
+        "random_state": np.array(internal_state, dtype=np.int64),
+        "random_gauss": np.array([] if gauss_next is None else [gauss_next], dtype=np.float64),
+    }
+
+#Function to restore the state of the random module saved by _random_state.
+def _load_random_state(state):
+    gauss = state["random_gauss"].tolist()
+    random.setstate((
+        int(state["random_version"]),
+        tuple(state["random_state"].tolist()),
+        gauss[0] if gauss else None,
+    ))
+
+'''
+#Function to append the rounds recorded since the previous checkpoint to the rounds file of a checkpoint.
+    The previous checkpoint (if any) tells how many rounds of the file are already saved. Those rounds
+    are not rewritten, so the previous checkpoint stays valid until the new one replaces it.
+    Returns the number of rounds saved in the file.
+'''
+def _save_rounds(path, recorder):
+    n_recorded = len(recorder)
+    rounds_file = rounds_path(path)
+    dtype = record_dtype(recorder.n_players)
+    n_saved = 0
+    if os.path.exists(path) and os.path.exists(rounds_file):
+        with np.load(path) as archive:
+            if "recorder_rounds" in archive:
+                n_saved = min(int(archive["recorder_rounds"]), n_recorded)
+        n_saved = min(n_saved, os.path.getsize(rounds_file) // dtype.itemsize)
+
+    #The saved rounds must be the first rounds of the recorder (not those of another run)
+    if n_saved:
+        last = np.fromfile(rounds_file, dtype=dtype, count=1, offset=(n_saved - 1) * dtype.itemsize)[0]
+        if not (
+            np.array_equal(last["targets"], recorder.targets[n_saved - 1])
+            and np.array_equal(last["points"], recorder.points[n_saved - 1])
+        ):
+            n_saved = 0
+
+    block = slice(n_saved, n_recorded)
+    records = np.empty(n_recorded - n_saved, dtype=dtype)
+    records["targets"] = recorder.targets[block]
+    records["points"] = recorder.points[block]
+    records["turn_points"] = recorder.turn_points[block]
+    records["collapse"] = recorder.collapses[block]
+    with open(rounds_file, "r+b" if n_saved else "wb") as file:
+        file.seek(n_saved * dtype.itemsize)
+        file.write(records.tobytes())
+        file.truncate()
+    return n_recorded
+
+'''
+#Function to save a checkpoint of a running game.
+    path: The .npz file to write. It is written to a temporary file first and then renamed, so an
+        interrupted save never leaves a truncated checkpoint.
+    game: The Game to save.
+    next_round: Number of the next round to play when the run is resumed.
+    recorder: Optional round_recorder.RoundRecorder whose recorded rounds are saved too, in the file
+        rounds_path(path). Only the rounds recorded since the previous checkpoint of `path` are written.
+'''
+def save_checkpoint(path, game, next_round, recorder=None):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    arrays = game_state(game)
+    arrays.update(_random_state())
+    arrays["next_round"] = np.int64(next_round)
+    if recorder is not None:
+        arrays["recorder_rounds"] = np.int64(_save_rounds(path, recorder))
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        np.savez_compressed(file, **arrays)
+    os.replace(temporary_path, path)
+
+'''
+#Function to resume a game from a checkpoint.
+    path: The .npz file written by save_checkpoint.
+    game: A Game built with the same parameters as the saved one, which receives the saved state.
+    recorder: Optional empty RoundRecorder which receives the saved rounds.
+    The random module continues from the saved state. Returns the number of the next round to play.
+'''
+def load_checkpoint(path, game, recorder=None):
+    with np.load(path) as archive:
+        state = dict(archive)
+
+    if int(state["version"]) != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version: {int(state['version'])}")
+
+    load_game_state(game, state)
+    _load_random_state(state)
+    if recorder is not None and "recorder_rounds" in state:
+        n_rounds = int(state["recorder_rounds"])
+        dtype = record_dtype(game.n_players)
+        n_stored = os.path.getsize(rounds_path(path)) // dtype.itemsize
+        if n_stored < n_rounds:
+            raise ValueError(f"{rounds_path(path)} has {n_stored} rounds, the checkpoint needs {n_rounds}")
+        records = np.fromfile(rounds_path(path), dtype=dtype, count=n_rounds)
+        recorder.record_rounds(records["targets"], records["points"], records["turn_points"], records["collapse"])
+    return int(state["next_round"])
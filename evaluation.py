@@ -1,6 +1,8 @@
 #defaultdict: A dictionary that provides a default value for nonexistent keys.
 import numpy as np
 from collections import defaultdict
+import profiling
+from betrayal_graph import count_collapsed
 
 '''
 #Function to calculate various metrics based on the game data.
@@ -10,17 +12,24 @@ def calculate_metrics(game_data):
     #Initialize an empty dictionary to store the calculated metrics.
     metrics = {}
 
+    #Each metric is timed as a phase of the active profiler (see profiling.py).
+    profiler = profiling.current()
+    start = profiler.clock()
+
     #Calculate overall cooperation rate across all players and rounds.
     metrics['overall_cooperation_rate'] = calculate_overall_cooperation_rate(game_data)
+    start = profiler.lap("metrics.overall_cooperation_rate", start)
     
     #Calculate overall betrayal rate across all players and rounds.
     metrics['overall_betrayal_rate'] = calculate_overall_betrayal_rate(game_data)
+    start = profiler.lap("metrics.overall_betrayal_rate", start)
 
     #Calculate player-specific statistics (cooperation, betrayal, resources).
     cooperation_per_player, betrayal_per_player, resources_per_player = calculate_player_stats(game_data)
     metrics['cooperation_per_player'] = cooperation_per_player
     metrics['betrayal_per_player'] = betrayal_per_player
     metrics['resources_per_player'] = resources_per_player
+    start = profiler.lap("metrics.player_stats", start)
 
     #Identify the best and worst players based on resources and cooperation/betrayal behavior.
     best_player, worst_player, best_player_data, worst_player_data = calculate_best_worst_players(
@@ -30,28 +39,225 @@ def calculate_metrics(game_data):
     metrics['worst_player'] = worst_player
     metrics['best_player_data'] = best_player_data
     metrics['worst_player_data'] = worst_player_data
+    start = profiler.lap("metrics.best_worst_players", start)
 
     #Calculate error metric based on deviation from average resources.
     metrics['error_metric'] = calculate_error_metric(resources_per_player)
+    start = profiler.lap("metrics.error_metric", start)
 
     #Calculate the rate of trust decay for players after betrayals.
     metrics['trust_decay_rate'] = calculate_trust_decay_rate(game_data)
+    start = profiler.lap("metrics.trust_decay_rate", start)
 
     #Calculate the impact of system collapses in terms of total collapses.
     metrics['impact_of_system_collapse'] = calculate_impact_of_system_collapse(game_data)
+    start = profiler.lap("metrics.impact_of_system_collapse", start)
 
     #Calculate cooperation rates before and after system collapses.
     metrics['pre_collapse_cooperation'], metrics['post_collapse_cooperation'] = calculate_pre_post_collapse_cooperation(game_data)
+    start = profiler.lap("metrics.pre_post_collapse_cooperation", start)
 
     #Calculate an index representing collaboration between players.
     metrics['collaboration_index'] = calculate_collaboration_index(game_data)
+    start = profiler.lap("metrics.collaboration_index", start)
 
     #Calculate a reciprocity index to track cooperative behavior reciprocity.
     metrics['reciprocity_index'] = calculate_reciprocity_index(game_data)
+    start = profiler.lap("metrics.reciprocity_index", start)
     
     #Return the final dictionary of metrics.
     return metrics
 
+'''
+#Function to calculate the metrics of a range of rounds stored in a trajectory file.
+    path: A file written by trajectory_store.TrajectoryStore.
+    start, stop: Range of rounds, like a slice (default: the whole run). Only those rounds are read from disk.
+    Returns the same dictionary as calculate_metrics, plus 'resources_over_time'.
+'''
+def calculate_metrics_from_trajectory(path, start=None, stop=None):
+    #Imported here because evaluation_vectorized imports this module.
+    from evaluation_vectorized import calculate_metrics_from_arrays
+    from trajectory_store import open_trajectory
+
+    with open_trajectory(path) as store:
+        rounds = store.window(start, stop)
+        metrics = calculate_metrics_from_arrays(rounds.targets, rounds.points)
+        metrics['resources_over_time'] = rounds.resources_over_time()
+    return metrics
+
+'''
+#Class computing every metric of calculate_metrics in a single pass over the rounds.
+    Call update() with each round (a dictionary with 'actions', 'resources' and 'betrayals', such as the
+    result of Game.play_round) as it is played, and finalize() to get the metrics dictionary.
+    Only running counters and the per-round rate series are kept, not the rounds themselves.
+    Both methods are timed with the phases of calculate_metrics (see profiling.py).
+'''
+class MetricsAccumulator:
+    def __init__(self):
+        #Number of rounds seen so far.
+        self.n_rounds = 0
+
+        #Per-round cooperation and betrayal rates (percentages).
+        self.cooperation_rates = []
+        self.betrayal_rates = []
+
+        #Player-specific statistics, filled in the same order as calculate_player_stats.
+        self.cooperation_per_player = defaultdict(int)
+        self.betrayal_per_player = defaultdict(int)
+        self.resources_per_player = defaultdict(int)
+
+        #Trust decay: last betrayal round of each player and the running sum and count of decays.
+        self.last_betrayal = {}
+        self.trust_decay_sum = {}
+        self.trust_decay_count = {}
+
+        #System collapses: total count and the sums of cooperation rates before the first and after the last.
+        self.total_collapses = 0
+        self.collapse_seen = False
+        self.pre_collapse_sum = 0.0
+        self.pre_collapse_rounds = 0
+        self.post_collapse_sum = 0.0
+        self.post_collapse_rounds = 0
+
+        #Reciprocity: previous action of each player and the running count of reciprocal cooperation.
+        self.previous_actions = {}
+        self.reciprocal_sum = {}
+        self.reciprocal_count = {}
+
+    '''
+    #Method to add one round to the running metrics.
+        round_data: The round dictionary containing 'actions', 'resources' and 'betrayals'.
+    '''
+    def update(self, round_data):
+        #Called once per round, so the profiler is only used when profiling is enabled.
+        profiler = profiling.active
+        if profiler is not None:
+            start = profiler.clock()
+
+        round_num = self.n_rounds
+        actions = round_data['actions']
+        n_actions = len(actions)
+        cooperation_count = 0
+
+        for player, action in actions.items():
+            if action is None:
+                cooperation_count += 1
+                self.cooperation_per_player[player] += 1
+
+                #Trust decay is measured on cooperation after the player's last betrayal.
+                if player in self.last_betrayal:
+                    self.trust_decay_sum[player] = self.trust_decay_sum.get(player, 0) + round_num - self.last_betrayal[player]
+                    self.trust_decay_count[player] = self.trust_decay_count.get(player, 0) + 1
+            else:
+                self.betrayal_per_player[player] += 1
+                self.last_betrayal[player] = round_num
+
+            #Reciprocal cooperation compares the action with the player's previous one.
+            if player in self.previous_actions:
+                reciprocal = 1 if self.previous_actions[player] is None and action is None else 0
+                self.reciprocal_sum[player] = self.reciprocal_sum.get(player, 0) + reciprocal
+                self.reciprocal_count[player] = self.reciprocal_count.get(player, 0) + 1
+            self.previous_actions[player] = action
+
+        for player_id, resources in round_data['resources'].items():
+            self.resources_per_player[player_id] = resources
+        #The loop over the actions also counts the trust decays and the reciprocal cooperation.
+        if profiler is not None:
+            start = profiler.lap("metrics.player_stats", start)
+
+        self.cooperation_rates.append((cooperation_count / n_actions) * 100)
+        if profiler is not None:
+            start = profiler.lap("metrics.overall_cooperation_rate", start)
+        self.betrayal_rates.append(((n_actions - cooperation_count) / n_actions) * 100)
+        if profiler is not None:
+            start = profiler.lap("metrics.overall_betrayal_rate", start)
+
+        #A round collapses when more than one player betrays the same target.
+        round_collapses = count_collapsed(round_data['betrayals'], 1)
+        self.total_collapses += round_collapses
+        if profiler is not None:
+            start = profiler.lap("metrics.impact_of_system_collapse", start)
+
+        cooperation_rate = cooperation_count / n_actions
+        if round_collapses:
+            self.collapse_seen = True
+            self.post_collapse_sum = 0.0
+            self.post_collapse_rounds = 0
+        else:
+            if not self.collapse_seen:
+                self.pre_collapse_sum += cooperation_rate
+                self.pre_collapse_rounds += 1
+            self.post_collapse_sum += cooperation_rate
+            self.post_collapse_rounds += 1
+        if profiler is not None:
+            profiler.lap("metrics.pre_post_collapse_cooperation", start)
+
+        self.n_rounds += 1
+
+    '''
+    #Method to build the metrics dictionary, with the same keys and values as calculate_metrics.
+    '''
+    def finalize(self):
+        profiler = profiling.current()
+        start = profiler.clock()
+
+        metrics = {}
+        metrics['overall_cooperation_rate'] = list(self.cooperation_rates)
+        start = profiler.lap("metrics.overall_cooperation_rate", start)
+        metrics['overall_betrayal_rate'] = list(self.betrayal_rates)
+        start = profiler.lap("metrics.overall_betrayal_rate", start)
+        metrics['cooperation_per_player'] = self.cooperation_per_player
+        metrics['betrayal_per_player'] = self.betrayal_per_player
+        metrics['resources_per_player'] = self.resources_per_player
+        start = profiler.lap("metrics.player_stats", start)
+
+        best_player, worst_player, best_player_data, worst_player_data = calculate_best_worst_players(
+            self.resources_per_player, self.cooperation_per_player, self.betrayal_per_player
+        )
+        metrics['best_player'] = best_player
+        metrics['worst_player'] = worst_player
+        metrics['best_player_data'] = best_player_data
+        metrics['worst_player_data'] = worst_player_data
+        start = profiler.lap("metrics.best_worst_players", start)
+
+        metrics['error_metric'] = calculate_error_metric(self.resources_per_player)
+        start = profiler.lap("metrics.error_metric", start)
+
+        metrics['trust_decay_rate'] = {
+            player: np.float64(total) / self.trust_decay_count[player]
+            for player, total in self.trust_decay_sum.items()
+        }
+        start = profiler.lap("metrics.trust_decay_rate", start)
+
+        metrics['impact_of_system_collapse'] = {'total_collapses': self.total_collapses}
+        start = profiler.lap("metrics.impact_of_system_collapse", start)
+
+        #Without a collapse, both rates are the average over the whole game.
+        if self.collapse_seen:
+            pre_collapse = _running_mean(self.pre_collapse_sum, self.pre_collapse_rounds)
+            post_collapse = _running_mean(self.post_collapse_sum, self.post_collapse_rounds)
+        else:
+            pre_collapse = post_collapse = _running_mean(self.pre_collapse_sum, self.pre_collapse_rounds)
+        metrics['pre_collapse_cooperation'] = pre_collapse * 100
+        metrics['post_collapse_cooperation'] = post_collapse * 100
+        start = profiler.lap("metrics.pre_post_collapse_cooperation", start)
+
+        metrics['collaboration_index'] = list(self.cooperation_rates)
+        start = profiler.lap("metrics.collaboration_index", start)
+
+        avg_reciprocity = {
+            player: np.float64(total) / self.reciprocal_count[player]
+            for player, total in self.reciprocal_sum.items()
+        }
+        metrics['reciprocity_index'] = np.mean(list(avg_reciprocity.values())) * 100
+        profiler.lap("metrics.reciprocity_index", start)
+
+        return metrics
+
+#Function to divide a running sum by its count, giving NaN for an empty count like np.mean([]).
+def _running_mean(total, count):
+    return np.float64(total) / count if count else np.float64(np.nan)
+
 '''
 #Function to calculate the overall cooperation rate for the game.
     game_data: The list of round data containing actions of all players.
@@ -148,10 +354,6 @@ def calculate_best_worst_players(resources_per_player, cooperation_per_player, b
         'betrayal_rate': (betrayal_per_player[worst_player_id] / total_rounds_worst) * 100
     }
 
-    #Debug print statements for best and worst player data.
-    print(f"Debug: Best Player Data: {best_player_data}")
-    print(f"Debug: Worst Player Data: {worst_player_data}")
-
     #Return the best and worst player IDs and their respective data.
     return best_player_id, worst_player_id, best_player_data, worst_player_data
 
@@ -207,12 +409,9 @@ def calculate_impact_of_system_collapse(game_data):
 
     #Loop through each round in the game data.
     for round_data in game_data:
-        betrayals = round_data['betrayals']
-
-        #Increment collapse count if more than one player betrays the same target.
-        for target, betrayers in betrayals.items():
-            if len(betrayers) > 1:
-                collapse_count += 1
+        #Increment collapse count for every target betrayed by more than one player (read from the
+        #in-degree counters of the betrayal graph).
+        collapse_count += count_collapsed(round_data['betrayals'], 1)
 
     #Return the total number of collapses.
     impact_of_system_collapse = {
@@ -237,7 +436,7 @@ def calculate_pre_post_collapse_cooperation(game_data):
         cooperation_rates.append(cooperation_rate)
 
         #Check if a collapse occurred in this round.
-        if any(len(betrayers) > 1 for betrayers in round_data['betrayals'].values()):
+        if count_collapsed(round_data['betrayals'], 1):
             collapse_rounds.append(round_num)
 
     #Calculate the average cooperation rate before and after the first collapse.
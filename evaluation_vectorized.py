@@ -0,0 +1,139 @@
+#Vectorized versions of the evaluation metrics.
+#They work on a (rounds, players) target matrix (-1 for cooperation) and a (rounds, players) points matrix,
+#such as the columns of round_recorder.RoundRecorder, instead of lists of round dictionaries.
+from collections import defaultdict
+
+import numpy as np
+
+from evaluation import calculate_best_worst_players, calculate_error_metric
+from game2_vectorized import betrayal_counts
+
+'''
+#Function to calculate every metric of evaluation.calculate_metrics from arrays.
+    targets: (rounds, players) matrix with the betrayed player of each player (-1 for cooperation).
+    points: (rounds, players) matrix with the total points of each player after each round.
+    Returns a dictionary with the same keys and values as calculate_metrics.
+'''
+def calculate_metrics_from_arrays(targets, points):
+    targets = np.asarray(targets, dtype=np.int64)
+    points = np.asarray(points)
+    metrics = {}
+
+    metrics['overall_cooperation_rate'] = overall_cooperation_rate(targets).tolist()
+    metrics['overall_betrayal_rate'] = overall_betrayal_rate(targets).tolist()
+
+    cooperation_per_player, betrayal_per_player, resources_per_player = player_stats(targets, points)
+    metrics['cooperation_per_player'] = cooperation_per_player
+    metrics['betrayal_per_player'] = betrayal_per_player
+    metrics['resources_per_player'] = resources_per_player
+
+    best_player, worst_player, best_player_data, worst_player_data = calculate_best_worst_players(
+        resources_per_player, cooperation_per_player, betrayal_per_player
+    )
+    metrics['best_player'] = best_player
+    metrics['worst_player'] = worst_player
+    metrics['best_player_data'] = best_player_data
+    metrics['worst_player_data'] = worst_player_data
+
+    metrics['error_metric'] = calculate_error_metric(resources_per_player)
+    metrics['trust_decay_rate'] = trust_decay_rate(targets)
+    metrics['impact_of_system_collapse'] = {'total_collapses': int(collapses_per_round(targets).sum())}
+    metrics['pre_collapse_cooperation'], metrics['post_collapse_cooperation'] = pre_post_collapse_cooperation(targets)
+    metrics['collaboration_index'] = list(metrics['overall_cooperation_rate'])
+    metrics['reciprocity_index'] = reciprocity_index(targets)
+
+    return metrics
+
+#Function to calculate the cooperation rate (%) of each round.
+def overall_cooperation_rate(targets):
+    return (targets < 0).sum(axis=1) / targets.shape[1] * 100
+
+#Function to calculate the betrayal rate (%) of each round.
+def overall_betrayal_rate(targets):
+    return (targets >= 0).sum(axis=1) / targets.shape[1] * 100
+
+'''
+#Function to order the players by their first event (round, then player ID).
+    Only players with at least one event are returned, matching the insertion order of the
+    dictionaries filled round by round in evaluation.py.
+'''
+def _players_by_first_event(events):
+    first_round = np.argmax(events, axis=0)
+    players = np.flatnonzero(events.any(axis=0))
+    return players[np.argsort(first_round[players], kind='stable')].tolist()
+
+#Function to build a defaultdict(int) of per-player counts, in order of first event.
+def _player_counts(events):
+    counts = events.sum(axis=0).tolist()
+    result = defaultdict(int)
+    for player in _players_by_first_event(events):
+        result[str(player)] = counts[player]
+    return result
+
+'''
+#Function to calculate the cooperation and betrayal counts and the final resources of each player.
+    Returns the same dictionaries as evaluation.calculate_player_stats.
+'''
+def player_stats(targets, points):
+    cooperates = targets < 0
+    betrays = ~cooperates
+
+    cooperation_per_player = _player_counts(cooperates)
+    betrayal_per_player = _player_counts(betrays)
+
+    resources_per_player = defaultdict(int)
+    if len(points):
+        for player, resources in enumerate(points[-1].tolist()):
+            resources_per_player[str(player)] = resources
+
+    return cooperation_per_player, betrayal_per_player, resources_per_player
+
+'''
+#Function to calculate the average trust decay of each player.
+    For every cooperation after a betrayal, the decay is the distance to the player's last betrayal.
+    The last betrayal round is carried forward with a running maximum over the betrayal indices.
+'''
+def trust_decay_rate(targets):
+    rounds = np.arange(len(targets))[:, None]
+    betrays = targets >= 0
+    last_betrayal = np.maximum.accumulate(np.where(betrays, rounds, -1), axis=0)
+
+    decays = ~betrays & (last_betrayal >= 0)
+    decay_sum = np.where(decays, rounds - last_betrayal, 0).sum(axis=0)
+    decay_count = decays.sum(axis=0)
+
+    return {
+        str(player): np.float64(decay_sum[player]) / decay_count[player]
+        for player in _players_by_first_event(decays)
+    }
+
+#Function to count, in each round, the targets betrayed by more than one player.
+def collapses_per_round(targets):
+    return (betrayal_counts(targets) > 1).sum(axis=1)
+
+'''
+#Function to calculate cooperation rates before the first and after the last system collapse.
+    Returns the pre-collapse and post-collapse cooperation rates as percentages.
+'''
+def pre_post_collapse_cooperation(targets):
+    cooperation_rates = (targets < 0).sum(axis=1) / targets.shape[1]
+    collapse_rounds = np.flatnonzero(collapses_per_round(targets))
+
+    if collapse_rounds.size:
+        pre_collapse = np.mean(cooperation_rates[:collapse_rounds[0]])
+        post_collapse = np.mean(cooperation_rates[collapse_rounds[-1] + 1:])
+    else:
+        pre_collapse = post_collapse = np.mean(cooperation_rates)
+
+    return pre_collapse * 100, post_collapse * 100
+
+'''
+#Function to calculate the reciprocity index as a percentage.
+    A player reciprocates when it cooperates in two consecutive rounds.
+'''
+def reciprocity_index(targets):
+    cooperates = targets < 0
+    reciprocal = cooperates[1:] & cooperates[:-1]
+    if not len(reciprocal):
+        return np.mean([]) * 100
+    return np.mean(reciprocal.sum(axis=0) / len(reciprocal)) * 100
@@ -1,9 +1,18 @@
+from collections import Counter
+
+import numpy as np
+
+from game2_vectorized import COOPERATE, _as_flag, _gather, betrayal_counts
+
 def play_turn(player_actions, total_points=None, resources=2):
     if total_points == None:
         total_points = {player: 0 for player in player_actions.keys()}
     turn_points = {player: 2 for player in player_actions.keys()}
     lost_players = set()
 
+    # Times each player is betrayed, counted once for the turn
+    times_betrayed = Counter(player_actions.values())
+
     # Calculate points for each player
     for player, action in player_actions.items():
         # If player is lost, skip
@@ -11,9 +20,8 @@ def play_turn(player_actions, total_points=None, resources=2):
             continue
 
         # If player is betrayed too many times, nullify points and end turn
-        times_betrayed = list(player_actions.values()).count(player)
-        if times_betrayed > resources:
-            turn_points = {player: 0 for player in player_actions.keys()}
+        if times_betrayed[player] > resources:
+            turn_points = dict.fromkeys(turn_points, 0)
             break
 
         # If cooperates, skip
@@ -47,6 +55,44 @@ def play_turn(player_actions, total_points=None, resources=2):
 
     return result, total_points
 
+'''
+#Array version of play_turn, with the game2_vectorized interface.
+    targets: int array with the betrayed player of each player (-1 for cooperation).
+        A (n_games, n_players) array resolves one turn of every game at once.
+    total_points: int64 array of total points, updated in place (zeros if not provided).
+    resources: A player betrayed more than resources times collapses the turn.
+    Returns the turn points, total points, betrayal counts and collapse flag (one per game for a batch).
+    play_turn visits the players in order and skips a player already lost in a mutual betrayal with an
+    earlier player, so only the other players can collapse the turn. On a collapse every player gets 0,
+    except the mutual betrayers lost before it, which get -1 like every mutual betrayer without a collapse.
+'''
+def play_turn_vec(targets, total_points=None, resources=2):
+    if total_points is None:
+        total_points = np.zeros(targets.shape, dtype=np.int64)
+
+    players = np.arange(targets.shape[-1])
+    counts = betrayal_counts(targets)
+    betray = targets != COOPERATE
+    mutual = betray & (_gather(targets, targets) == players)
+
+    # First player reaching the collapse check while betrayed too many times (n_players if none)
+    checked = ~(mutual & (targets < players))
+    collapsing = checked & (counts > resources)
+    collapse_occurred = collapsing.any(axis=-1)
+    collapse_index = np.where(collapse_occurred, np.argmax(collapsing, axis=-1), targets.shape[-1])
+
+    # Mutual betrayals seen before the collapse, by the first player of the pair
+    lost = mutual & (np.minimum(players, targets) < collapse_index[..., None])
+
+    # Without a collapse, the other betrayers steal a point from their target
+    steal = betray & ~mutual
+    turn_points = 2 + steal - betrayal_counts(np.where(steal, targets, COOPERATE))
+    turn_points = np.where(collapse_occurred[..., None], 0, turn_points)
+    turn_points[lost] = -1
+
+    total_points += turn_points
+    return turn_points, total_points, counts, _as_flag(collapse_occurred)
+
 
 if __name__ == "__main__":
 
@@ -197,15 +197,20 @@ def play_turn_sim4(player_actions, total_points=None, resources=2):
 #A global dictionary to keep track of the number of times each player betrays.
 times_betrayers = {}
 
+'''
 #Simulation that includes tracking betrayer history and a multiplier effect on their resources.
-def play_turn_sim5(player_actions, total_points=None, resources=10, multiplier=5):
-    global times_betrayers
+    betrayer_counts: Optional dictionary with the betrayer history of one game. Without it the global
+    times_betrayers is used, which is shared by every game in the process (see game2_vectorized.Sim5Rule).
+'''
+def play_turn_sim5(player_actions, total_points=None, resources=10, multiplier=5, betrayer_counts=None):
+    if betrayer_counts is None:
+        betrayer_counts = times_betrayers
 
     if total_points is None:
         total_points = {player: 0 for player in player_actions.keys()}
 
     turn_points = {
-        player: max(resources - times_betrayers.get(player, 0) * multiplier, 0)
+        player: max(resources - betrayer_counts.get(player, 0) * multiplier, 0)
         for player in player_actions.keys()
     }
     betrayals = defaultdict(list)
@@ -220,7 +225,7 @@ def play_turn_sim5(player_actions, total_points=None, resources=10, multiplier=5
         if len(betrayers) > 2:
             collapse_occurred = True
             for betrayer in betrayers:
-                times_betrayers[betrayer] = times_betrayers.get(betrayer, 0) + 1
+                betrayer_counts[betrayer] = betrayer_counts.get(betrayer, 0) + 1
             betrayed_player = player
             break
 
@@ -0,0 +1,331 @@
+#Vectorized versions of the game2 rule functions.
+#Players are identified by their position in the arrays, a target of -1 means cooperation
+#and points are stored as int64 arrays instead of string-keyed dictionaries.
+from collections import defaultdict
+
+import numpy as np
+from game2 import (
+    play_turn,
+    play_turn_sim2,
+    play_turn_sim3,
+    play_turn_sim4,
+    play_turn_sim5,
+    play_turn_v2,
+    play_turn_sim2_v2,
+)
+
+#Value used in the target array to represent cooperation (None in game2).
+COOPERATE = -1
+
+'''
+#Function to convert a game2 actions dictionary into a target array.
+    player_actions: A dictionary mapping each player to the player it betrays (None for cooperation).
+    Returns the list of player keys (defining the array positions) and the int64 target array.
+'''
+def encode_actions(player_actions):
+    players = list(player_actions.keys())
+    index = {player: i for i, player in enumerate(players)}
+    targets = np.array(
+        [COOPERATE if action is None else index[action] for action in player_actions.values()],
+        dtype=np.int64,
+    )
+    return players, targets
+
+'''
+#Function to convert a points dictionary into an int64 array following the order of players.
+    players: The list of player keys returned by encode_actions.
+    total_points: A dictionary of total points per player (zeros if not provided).
+'''
+def encode_points(players, total_points=None):
+    if total_points is None:
+        return np.zeros(len(players), dtype=np.int64)
+    return np.array([total_points[player] for player in players], dtype=np.int64)
+
+'''
+#Function to build the game2 style result dictionary from the vectorized outputs.
+    players: The list of player keys returned by encode_actions.
+    targets: The target array used in the turn.
+    turn_points: The points gained by each player in the turn.
+    total_points: The total points of each player after the turn.
+'''
+def decode_result(players, targets, turn_points, total_points):
+    return {
+        player: (
+            None if targets[i] == COOPERATE else players[targets[i]],
+            int(turn_points[i]),
+            int(total_points[i]),
+        )
+        for i, player in enumerate(players)
+    }
+
+'''
+#Function to count how many times each player was betrayed in the turn.
+    targets: The target array of the turn (-1 for cooperation), either (n_players,) or (n_games, n_players).
+    Each row is counted independently by offsetting its targets before a single bincount.
+'''
+def betrayal_counts(targets):
+    n = targets.shape[-1]
+    rows = targets.reshape(-1, n)
+    offsets = np.arange(rows.shape[0])[:, None] * n
+    flat = (rows + offsets)[rows >= 0]
+    return np.bincount(flat, minlength=rows.size).reshape(targets.shape)
+
+'''
+#Function to find, in each row, the first player betrayed more than threshold times.
+    The order matches the iteration order of the betrayals defaultdict in game2, where
+    targets appear in the order of their first betrayer. Returns -1 where there is no collapse.
+'''
+def first_collapsed_target(targets, counts, threshold):
+    n = targets.shape[-1]
+    rows = targets.reshape(-1, n)
+    offsets = np.arange(rows.shape[0])[:, None] * n
+
+    #Position of the first betrayer of every target, in row-major (player) order.
+    first_seen = np.full(rows.size, rows.size, dtype=np.int64)
+    flat = (rows + offsets)[rows >= 0]
+    unique_targets, first_index = np.unique(flat, return_index=True)
+    first_seen[unique_targets] = first_index
+    first_seen = first_seen.reshape(targets.shape)
+
+    collapsed = counts > threshold
+    first_seen[~collapsed] = rows.size
+    betrayed_player = np.argmin(first_seen, axis=-1)
+    return np.where(collapsed.any(axis=-1), betrayed_player, COOPERATE)
+
+#Function to read, for each player, the value of values at the position of its target.
+def _gather(values, targets):
+    return np.take_along_axis(values, np.maximum(targets, 0), axis=-1)
+
+#Function to return a plain bool for a single game and a bool array for a batch of games.
+def _as_flag(collapse_occurred):
+    return bool(collapse_occurred) if np.ndim(collapse_occurred) == 0 else collapse_occurred
+
+'''
+#Function to build the masks of the first collapse in each row.
+    Returns the betrayed player (-1 without collapse), a mask of its position and a mask of its betrayers.
+'''
+def _first_collapse_masks(targets, counts, threshold):
+    betrayed_player = first_collapsed_target(targets, counts, threshold)
+    betrayed_mask = np.arange(targets.shape[-1]) == betrayed_player[..., None]
+    betrayers = (targets == betrayed_player[..., None]) & (targets >= 0)
+    return betrayed_player, betrayed_mask, betrayers
+
+'''
+#Function to apply the betray/cooperate exchange for players not involved in a collapse.
+    Involved players neither gain nor make their target lose a point, and a betrayal of an
+    involved player does not cost that player anything.
+'''
+def _exchange_points(targets, turn_points, involved):
+    active = (targets >= 0) & ~involved
+    turn_points += active
+    losing = active & ~_gather(involved, targets)
+    turn_points -= betrayal_counts(np.where(losing, targets, COOPERATE))
+    return turn_points
+
+'''
+#Vectorized version of game2.play_turn.
+    targets: int array with the betrayed player of each player (-1 for cooperation).
+        A (n_games, n_players) array resolves one turn of every game at once.
+    total_points: int64 array of total points, updated in place (zeros if not provided).
+    resources: The resources available for each player at the beginning of the turn.
+    Returns the turn points, total points, betrayal counts and collapse flag (one per game for a batch).
+'''
+def play_turn_vec(targets, total_points=None, resources=2):
+    if total_points is None:
+        total_points = np.zeros(targets.shape, dtype=np.int64)
+
+    counts = betrayal_counts(targets)
+    collapse_occurred = (counts > 2).any(axis=-1)
+    collapsed = collapse_occurred[..., None]
+
+    #Where a collapse occurred, halve each player's total points and reset turn points.
+    total_points[...] = np.where(collapsed, np.maximum(total_points // 2, 0), total_points)
+    turn_points = resources + (targets >= 0) - counts
+    turn_points[np.broadcast_to(collapsed, turn_points.shape)] = 0
+
+    total_points += turn_points
+    return turn_points, total_points, counts, _as_flag(collapse_occurred)
+
+#Vectorized version of game2.play_turn_sim2.
+def play_turn_sim2_vec(targets, total_points=None, resources=2):
+    if total_points is None:
+        total_points = np.zeros(targets.shape, dtype=np.int64)
+
+    counts = betrayal_counts(targets)
+    betrayed_player, betrayed_mask, betrayers = _first_collapse_masks(targets, counts, 2)
+
+    #The betrayed player and its betrayers are involved in the collapse.
+    involved = betrayed_mask | betrayers
+
+    turn_points = _exchange_points(targets, np.full(targets.shape, resources, dtype=np.int64), involved)
+    turn_points[involved] = 0
+
+    total_points += turn_points
+    return turn_points, total_points, counts, _as_flag(betrayed_player != COOPERATE)
+
+#Vectorized version of game2.play_turn_sim3.
+def play_turn_sim3_vec(targets, total_points=None, resources=2):
+    if total_points is None:
+        total_points = np.zeros(targets.shape, dtype=np.int64)
+
+    counts = betrayal_counts(targets)
+    betrayed_player, _, involved = _first_collapse_masks(targets, counts, 2)
+
+    #Only the betrayers are involved, and their total points are halved.
+    turn_points = _exchange_points(targets, np.full(targets.shape, resources, dtype=np.int64), involved)
+    turn_points[involved] = 0
+    total_points[involved] = np.maximum(total_points[involved] // 2, 0)
+
+    total_points += turn_points
+    return turn_points, total_points, counts, _as_flag(betrayed_player != COOPERATE)
+
+#Vectorized version of game2.play_turn_sim4.
+def play_turn_sim4_vec(targets, total_points=None, resources=2):
+    if total_points is None:
+        total_points = np.zeros(targets.shape, dtype=np.int64)
+
+    counts = betrayal_counts(targets)
+    betrayed_player, betrayed_mask, betrayers = _first_collapse_masks(targets, counts, 2)
+    involved = betrayed_mask | betrayers
+
+    turn_points = _exchange_points(targets, np.full(targets.shape, resources, dtype=np.int64), involved)
+    turn_points[involved] = 0
+
+    #The betrayed player gains points based on the number of betrayers.
+    turn_points[betrayed_mask] = resources * counts[betrayed_mask]
+
+    total_points += turn_points
+    return turn_points, total_points, counts, _as_flag(betrayed_player != COOPERATE)
+
+'''
+#Vectorized version of game2.play_turn_sim5.
+    times_betrayers: int64 array with the number of collapses each player took part in as a betrayer.
+    It replaces the global times_betrayers dictionary and is updated in place (zeros if not provided).
+'''
+def play_turn_sim5_vec(targets, total_points=None, resources=10, multiplier=5, times_betrayers=None):
+    if total_points is None:
+        total_points = np.zeros(targets.shape, dtype=np.int64)
+    if times_betrayers is None:
+        times_betrayers = np.zeros(targets.shape, dtype=np.int64)
+
+    #Turn points are reduced according to the betrayal history, before it is updated.
+    turn_points = np.maximum(resources - times_betrayers * multiplier, 0).astype(np.int64)
+
+    counts = betrayal_counts(targets)
+    betrayed_player, betrayed_mask, betrayers = _first_collapse_masks(targets, counts, 2)
+    times_betrayers += betrayers
+    involved = betrayed_mask | betrayers
+
+    turn_points = _exchange_points(targets, turn_points, involved)
+    turn_points[involved] = 0
+    turn_points[betrayed_mask] = resources * counts[betrayed_mask]
+
+    total_points += turn_points
+    return turn_points, total_points, counts, _as_flag(betrayed_player != COOPERATE)
+
+#Vectorized version of game2.play_turn_v2 (Tragedy of the Commons).
+def play_turn_v2_vec(targets, total_points=None, resources=1):
+    if total_points is None:
+        total_points = np.zeros(targets.shape, dtype=np.int64)
+
+    counts = betrayal_counts(targets)
+    collapse_occurred = (counts > resources).any(axis=-1)
+    collapsed = np.broadcast_to(collapse_occurred[..., None], targets.shape)
+
+    #Where a collapse occurred, everyone loses all accumulated points.
+    total_points[collapsed] = 0
+    turn_points = resources + (targets >= 0) - counts
+    turn_points[collapsed] = 0
+
+    total_points += turn_points
+    return turn_points, total_points, counts, _as_flag(collapse_occurred)
+
+#Vectorized version of game2.play_turn_sim2_v2, where every collapse (no break) resets its betrayers.
+def play_turn_sim2_v2_vec(targets, total_points=None, resources=1):
+    if total_points is None:
+        total_points = np.zeros(targets.shape, dtype=np.int64)
+
+    counts = betrayal_counts(targets)
+    collapsed = counts > resources
+
+    #Every player that betrayed a collapsed target is involved.
+    involved = _gather(collapsed, targets) & (targets >= 0)
+
+    turn_points = _exchange_points(targets, np.full(targets.shape, resources, dtype=np.int64), involved)
+    turn_points[involved] = 0
+    total_points[involved] = 0
+
+    total_points += turn_points
+    return turn_points, total_points, counts, _as_flag(collapsed.any(axis=-1))
+
+'''
+#Class representing the play_turn_sim5 rule with its betrayer history as explicit per-game state.
+    Unlike the global times_betrayers of game2, each instance belongs to one game (or one batch of
+    games), so several games can run in the same process, in threads or in a BatchGame.
+'''
+class Sim5Rule:
+    '''
+    #Constructor for initializing the rule state.
+        shape: Number of players, or (n_games, n_players) for a batch of games.
+        multiplier: Points lost per past collapse by a betrayer.
+        resolver: Optional array resolver taking a times_betrayers keyword, such as a rule compiled
+            by rules.compile_rule (default: play_turn_sim5_vec).
+    '''
+    def __init__(self, shape, multiplier=5, resolver=None):
+        self.multiplier = multiplier
+        self.resolver = resolver
+        self.times_betrayers = np.zeros(shape, dtype=np.int64)
+
+    '''
+    #Method to play a turn with the game2 dictionary interface, so an instance can be used as
+    #the play_turn_func of simulation_game.Game. Players map to array positions in key order.
+    '''
+    def __call__(self, player_actions, total_points=None, resources=10):
+        players, targets = encode_actions(player_actions)
+        if total_points is None:
+            total_points = {player: 0 for player in players}
+
+        turn_points, points, _, collapse_occurred = self.resolve(
+            targets, encode_points(players, total_points), resources
+        )
+
+        #Update the total points in place, like the dictionary rules.
+        for i, player in enumerate(players):
+            total_points[player] = int(points[i])
+
+        betrayals = defaultdict(list)
+        for player, action in player_actions.items():
+            if action is not None:
+                betrayals[action].append(player)
+
+        return decode_result(players, targets, turn_points, points), total_points, betrayals, collapse_occurred
+
+    #Method to play a turn with target and points arrays (see play_turn_sim5_vec).
+    def resolve(self, targets, total_points=None, resources=10):
+        if self.resolver is not None:
+            return self.resolver(targets, total_points, resources, times_betrayers=self.times_betrayers)
+        return play_turn_sim5_vec(targets, total_points, resources, self.multiplier, self.times_betrayers)
+
+    #Method to forget the betrayer history, e.g. before a new game.
+    def reset(self):
+        self.times_betrayers[...] = 0
+
+    #Method returning the rule state as arrays, for checkpoints.
+    def state_dict(self):
+        return {"multiplier": np.int64(self.multiplier), "times_betrayers": self.times_betrayers.copy()}
+
+    #Method restoring the rule state saved by state_dict.
+    def load_state_dict(self, state):
+        self.multiplier = int(state["multiplier"])
+        self.times_betrayers = np.array(state["times_betrayers"], dtype=np.int64)
+
+#Mapping from each game2 rule function to its vectorized counterpart.
+VECTORIZED_RULES = {
+    play_turn: play_turn_vec,
+    play_turn_sim2: play_turn_sim2_vec,
+    play_turn_sim3: play_turn_sim3_vec,
+    play_turn_sim4: play_turn_sim4_vec,
+    play_turn_sim5: play_turn_sim5_vec,
+    play_turn_v2: play_turn_v2_vec,
+    play_turn_sim2_v2: play_turn_sim2_v2_vec,
+}
@@ -0,0 +1,513 @@
+#Compiled round loop for simulation_game.Game.
+#play_rounds runs many rounds of a Game over flat arrays (Q-values, history totals, points) instead of the
+#per-player Python objects, and writes the final state back into the Game and the random module.
+#The kernel draws its numbers from its own copy of the Mersenne Twister state of the random module, in the
+#same order as Game.play_round, so the results are bit-for-bit identical to the Python engine for a given seed.
+#With numba installed the kernel is JIT compiled, otherwise every round is played with NumPy operations.
+import random
+
+import numpy as np
+
+from rules import compile_rule
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+#Whether the JIT compiled backend is available.
+HAS_NUMBA = njit is not None
+
+#Mersenne Twister constants, as in CPython's _randommodule.c.
+_N = 624
+_M = 397
+_MATRIX_A = 0x9908B0DF
+_UPPER_MASK = 0x80000000
+_LOWER_MASK = 0x7FFFFFFF
+
+#Codes of the RuleSpec options passed to the kernel.
+_INVOLVED_CODES = {"everyone": 0, "betrayers": 1, "target_and_betrayers": 2}
+_EFFECT_CODES = {"keep": 0, "halve": 1, "zero": 2}
+
+#Function decorator compiling a kernel function when numba is available.
+def _jit(function):
+    return njit(cache=True)(function) if HAS_NUMBA else function
+
+#Function to regenerate the 624 words of the Mersenne Twister state in place (mt: int64 array of 32-bit words).
+@_jit
+def _twist(mt):
+    for i in range(_N - 1):
+        y = (mt[i] & _UPPER_MASK) | (mt[i + 1] & _LOWER_MASK)
+        source = i + _M if i < _N - _M else i + _M - _N
+        mt[i] = mt[source] ^ (y >> 1) ^ ((y & 1) * _MATRIX_A)
+    y = (mt[_N - 1] & _UPPER_MASK) | (mt[0] & _LOWER_MASK)
+    mt[_N - 1] = mt[_M - 1] ^ (y >> 1) ^ ((y & 1) * _MATRIX_A)
+
+'''
+#Function to regenerate the Mersenne Twister state with NumPy slices, for the NumPy backend.
+    The recurrence only reads words 397 positions ahead (old values) or 227 behind (new values),
+    so it is applied in three slices that each only read finished words.
+'''
+def _twist_numpy(mt):
+    for start, stop in ((0, _N - _M), (_N - _M, 2 * (_N - _M)), (2 * (_N - _M), _N - 1)):
+        y = (mt[start:stop] & _UPPER_MASK) | (mt[start + 1:stop + 1] & _LOWER_MASK)
+        source = start + _M if start < _N - _M else start + _M - _N
+        mt[start:stop] = mt[source:source + stop - start] ^ (y >> 1) ^ ((y & 1) * _MATRIX_A)
+    y = (mt[_N - 1] & _UPPER_MASK) | (mt[0] & _LOWER_MASK)
+    mt[_N - 1] = mt[_M - 1] ^ (y >> 1) ^ ((y & 1) * _MATRIX_A)
+
+#Function to temper state words into output words (works on a word or an array of words).
+@_jit
+def _temper(y):
+    y = y ^ (y >> 11)
+    y = y ^ ((y << 7) & 0x9D2C5680)
+    y = y ^ ((y << 15) & 0xEFC60000)
+    return y ^ (y >> 18)
+
+'''
+#Function to draw the next 32-bit word, like genrand_uint32.
+    position: Index of the next state word (624 means a twist is due).
+    The position is passed and returned by value so the compiled loop keeps it in a register.
+'''
+@_jit
+def _next_word(mt, position):
+    if position >= _N:
+        _twist(mt)
+        position = 0
+    return _temper(mt[position]), position + 1
+
+#Function to draw a float in [0, 1), like random.random(). Returns the float and the new position.
+@_jit
+def _random(mt, position):
+    a, position = _next_word(mt, position)
+    b, position = _next_word(mt, position)
+    return ((a >> 5) * 67108864.0 + (b >> 6)) * (1.0 / 9007199254740992.0), position
+
+#Function to draw an integer in [0, n), like random.Random._randbelow (n < 2**32).
+@_jit
+def _randbelow(mt, position, n):
+    k = 0
+    while (n >> k) > 0:
+        k += 1
+    word, position = _next_word(mt, position)
+    while (word >> (32 - k)) >= n:
+        word, position = _next_word(mt, position)
+    return word >> (32 - k), position
+
+'''
+#Function to resolve the turn of one round for a rule spec, like the resolvers of rules.compile_rule.
+    actions: The betrayed player of each player (-1 for cooperation).
+    turn_points, involved, collapsed, counts, first_betrayer: Work arrays, overwritten.
+    Returns whether a collapse occurred. The total points and betrayer history are updated in place.
+'''
+@_jit
+def _resolve_turn(actions, total_points, turn_points, times_betrayers, involved, collapsed, counts,
+                  first_betrayer, resources, threshold, involved_code, effect_code, first_collapse_only,
+                  reward_victim, penalty):
+    n_players = len(actions)
+    counts[:] = 0
+    first_betrayer[:] = n_players
+    for player in range(n_players):
+        target = actions[player]
+        if target >= 0:
+            counts[target] += 1
+            if first_betrayer[target] == n_players:
+                first_betrayer[target] = player
+
+    #Collapsed targets, where "first" is the target whose first betrayer played first.
+    collapsed[:] = False
+    first_collapse = -1
+    for target in range(n_players):
+        if counts[target] > threshold:
+            if not first_collapse_only:
+                collapsed[target] = True
+            elif first_collapse < 0 or first_betrayer[target] < first_betrayer[first_collapse]:
+                first_collapse = target
+    if first_collapse >= 0:
+        collapsed[first_collapse] = True
+    collapse_occurred = collapsed.any()
+
+    for player in range(n_players):
+        if penalty < 0:
+            turn_points[player] = resources
+        else:
+            turn_points[player] = max(resources - times_betrayers[player] * penalty, 0)
+
+    #Players involved in the collapse, and the betrayer history of the collapse.
+    for player in range(n_players):
+        target = actions[player]
+        betrayer = target >= 0 and collapsed[target]
+        if involved_code == 0:
+            involved[player] = collapse_occurred
+        else:
+            involved[player] = betrayer or (involved_code == 2 and collapsed[player])
+        if betrayer and penalty >= 0:
+            times_betrayers[player] += 1
+
+    #Involved players gain nothing, the others exchange points as usual.
+    for player in range(n_players):
+        target = actions[player]
+        if involved[player] or target < 0:
+            continue
+        turn_points[player] += 1
+        if not involved[target]:
+            turn_points[target] -= 1
+
+    for player in range(n_players):
+        if involved[player]:
+            turn_points[player] = 0
+            if effect_code == 1:
+                total_points[player] = max(0, total_points[player] // 2)
+            elif effect_code == 2:
+                total_points[player] = 0
+
+    if reward_victim:
+        for target in range(n_players):
+            if collapsed[target]:
+                turn_points[target] = resources * counts[target]
+
+    for player in range(n_players):
+        total_points[player] += turn_points[player]
+    return collapse_occurred
+
+'''
+#Function to play n_rounds rounds of the game over flat arrays (see play_rounds for the arrays).
+    Every step follows Game.play_round: target choice, action, history update, turn resolution,
+    Q-learning update and collapse bookkeeping, with the random draws in the same order.
+'''
+@_jit
+def _play_rounds_kernel(first_round, q_values, betray_probabilities, alpha, gamma, default_max_q,
+                        resources, history_betrayals, history_order, history_size, most_betrayed,
+                        betray_count, total_points, times_betrayers, collapse_state, collapse_contributions,
+                        mt, position, chosen_targets, targets, points, turn_points_out, collapses,
+                        n_resources, threshold, involved_code, effect_code, first_collapse_only,
+                        reward_victim, penalty):
+    n_rounds, n_players = targets.shape
+    turn_points = np.zeros(n_players, dtype=np.int64)
+    involved = np.zeros(n_players, dtype=np.bool_)
+    collapsed = np.zeros(n_players, dtype=np.bool_)
+    counts = np.zeros(n_players, dtype=np.int64)
+    first_betrayer = np.zeros(n_players, dtype=np.int64)
+    word_position = position[0]
+
+    for index in range(n_rounds):
+        round_num = first_round + index
+        for player in range(n_players):
+            #Random target on an empty history or with 10% chance, otherwise the most betrayed target.
+            random_target = history_size[player] == 0
+            if not random_target:
+                draw, word_position = _random(mt, word_position)
+                random_target = draw < 0.1
+            if random_target:
+                choice, word_position = _randbelow(mt, word_position, n_players - 1)
+                target = choice + 1 if choice >= player else choice
+            else:
+                target = most_betrayed[player]
+
+            draw, word_position = _random(mt, word_position)
+            if round_num == 1:
+                betray = draw < betray_probabilities[player]
+            else:
+                betrayal_chance = betray_probabilities[player] * (
+                    q_values[player, target] - q_values[player, player]
+                )
+                if betrayal_chance < 0.1:
+                    betrayal_chance = 0.1
+                betray = draw < betrayal_chance
+
+            chosen_targets[index, player] = target
+            targets[index, player] = target if betray else -1
+
+            #Running history totals and most betrayed target (ties go to the older target).
+            if history_order[player, target] < 0:
+                history_order[player, target] = history_size[player]
+                history_size[player] += 1
+            if betray:
+                history_betrayals[player, target] += 1
+                betray_count[player] += 1
+            best = most_betrayed[player]
+            if best < 0:
+                most_betrayed[player] = target
+            elif target != best:
+                total = history_betrayals[player, target]
+                best_total = history_betrayals[player, best]
+                if total > best_total or (
+                    total == best_total and history_order[player, target] < history_order[player, best]
+                ):
+                    most_betrayed[player] = target
+
+        collapse_occurred = _resolve_turn(
+            targets[index], total_points, turn_points, times_betrayers, involved, collapsed, counts,
+            first_betrayer, n_resources, threshold, involved_code, effect_code, first_collapse_only,
+            reward_victim, penalty,
+        )
+
+        #new_state equals the stored state only when every total equals the starting resources.
+        same_state = True
+        for player in range(n_players):
+            if total_points[player] != resources[player]:
+                same_state = False
+
+        for player in range(n_players):
+            target = targets[index, player]
+            column = player if target < 0 else target
+            current_q = q_values[player, column]
+            max_future_q = q_values[player].max() if same_state else default_max_q[player]
+            q_values[player, column] = (1 - alpha[player]) * current_q + alpha[player] * (
+                turn_points[player] + gamma[player] * max_future_q
+            )
+
+        #Collapse bookkeeping of Game.play_round (targets betrayed by more than 2 players).
+        if collapse_occurred:
+            collapse_state[0] += 1
+            for player in range(n_players):
+                target = targets[index, player]
+                if target >= 0 and counts[target] > 2:
+                    collapse_contributions[player] += 1
+
+        points[index] = total_points
+        turn_points_out[index] = turn_points
+        collapses[index] = collapse_occurred
+
+    position[0] = word_position
+
+'''
+#Function to play n_rounds rounds with NumPy operations, used when numba is not available.
+    Takes the same arrays as _play_rounds_kernel plus the vectorized resolver of the rule. Only the
+    random draws are taken player by player, from the tempered words of the Mersenne Twister state.
+'''
+def _play_rounds_numpy(first_round, q_values, betray_probabilities, alpha, gamma, default_max_q,
+                       resources, history_betrayals, history_order, history_size, most_betrayed,
+                       betray_count, total_points, times_betrayers, collapse_state, collapse_contributions,
+                       mt, position, chosen_targets, targets, points, turn_points_out, collapses,
+                       n_resources, resolver):
+    n_rounds, n_players = targets.shape
+    players = np.arange(n_players)
+    words = _temper(mt).tolist()
+    word_index = int(position[0])
+
+    def next_word():
+        nonlocal words, word_index
+        if word_index >= _N:
+            _twist_numpy(mt)
+            words = _temper(mt).tolist()
+            word_index = 0
+        word_index += 1
+        return words[word_index - 1]
+
+    def next_random():
+        return ((next_word() >> 5) * 67108864.0 + (next_word() >> 6)) * (1.0 / 9007199254740992.0)
+
+    n_choices = n_players - 1
+    bits = 32 - n_choices.bit_length()
+
+    for index in range(n_rounds):
+        round_num = first_round + index
+
+        #The draws are sequential, so targets and action draws are taken player by player.
+        empty_history = (history_size == 0).tolist()
+        best_targets = most_betrayed.tolist()
+        chosen = chosen_targets[index]
+        draws = np.empty(n_players)
+        for player in range(n_players):
+            if empty_history[player] or next_random() < 0.1:
+                choice = next_word() >> bits
+                while choice >= n_choices:
+                    choice = next_word() >> bits
+                chosen[player] = choice + 1 if choice >= player else choice
+            else:
+                chosen[player] = best_targets[player]
+            draws[player] = next_random()
+
+        if round_num == 1:
+            betray = draws < betray_probabilities
+        else:
+            betrayal_chance = betray_probabilities * (
+                q_values[players, chosen] - q_values[players, players]
+            )
+            betray = draws < np.where(betrayal_chance < 0.1, 0.1, betrayal_chance)
+        actions = targets[index]
+        actions[:] = np.where(betray, chosen, -1)
+
+        #Running history totals and most betrayed target (ties go to the older target).
+        new_target = history_order[players, chosen] < 0
+        history_order[players[new_target], chosen[new_target]] = history_size[new_target]
+        history_size += new_target
+        history_betrayals[players, chosen] += betray
+        betray_count += betray
+        best = np.where(most_betrayed < 0, chosen, most_betrayed)
+        total = history_betrayals[players, chosen]
+        best_total = history_betrayals[players, best]
+        better = (total > best_total) | (
+            (total == best_total) & (history_order[players, chosen] < history_order[players, best])
+        )
+        most_betrayed[:] = np.where((most_betrayed < 0) | better, chosen, most_betrayed)
+
+        turn_points, _, counts, collapse_occurred = resolver(
+            actions, total_points, n_resources, times_betrayers=times_betrayers
+        )
+
+        column = np.where(betray, chosen, players)
+        current_q = q_values[players, column]
+        max_future_q = q_values.max(axis=1) if np.array_equal(total_points, resources) else default_max_q
+        q_values[players, column] = (1 - alpha) * current_q + alpha * (turn_points + gamma * max_future_q)
+
+        #Collapse bookkeeping of Game.play_round (targets betrayed by more than 2 players).
+        if collapse_occurred:
+            collapse_state[0] += 1
+            collapse_contributions += betray & (counts[np.where(betray, actions, 0)] > 2)
+
+        points[index] = total_points
+        turn_points_out[index] = turn_points
+        collapses[index] = collapse_occurred
+
+    position[0] = word_index
+
+#Function to copy the state of a Game into the flat arrays used by the kernels.
+def _load_game(game):
+    n_players = game.n_players
+    state = tuple(game.resources)
+    arrays = {
+        "q_values": np.empty((n_players, n_players)),
+        "betray_probabilities": np.empty(n_players),
+        "alpha": np.empty(n_players),
+        "gamma": np.empty(n_players),
+        "default_max_q": np.empty(n_players),
+        "resources": np.asarray(game.resources, dtype=np.int64).copy(),
+        "history_betrayals": np.zeros((n_players, n_players), dtype=np.int64),
+        "history_order": np.full((n_players, n_players), -1, dtype=np.int64),
+        "history_size": np.zeros(n_players, dtype=np.int64),
+        "most_betrayed": np.full(n_players, -1, dtype=np.int64),
+        "betray_count": np.zeros(n_players, dtype=np.int64),
+        "total_points": np.array([game.total_points[str(i)] for i in range(n_players)], dtype=np.int64),
+        "collapse_state": np.array([game.collapse_count], dtype=np.int64),
+        "collapse_contributions": np.array(
+            [game.collapse_contributions[str(i)] for i in range(n_players)], dtype=np.int64
+        ),
+    }
+
+    if game.population is not None:
+        raise ValueError("The round kernel does not support population strategies")
+
+    for i, player in enumerate(game.players):
+        if not isinstance(player.q_table, dict):
+            raise ValueError("The round kernel needs the dictionary Q-tables (compact_q_table=False)")
+        if player.history.default_factory().maxlen is not None:
+            raise ValueError("The round kernel does not support history_length")
+
+        values = player.q_table[state]
+        arrays["q_values"][i] = [values[None] if target == i else values[str(target)] for target in range(n_players)]
+        arrays["betray_probabilities"][i] = player.betray_probability
+        arrays["alpha"][i] = player.alpha
+        arrays["gamma"][i] = player.gamma
+        arrays["default_max_q"][i] = max(0.5, player.betray_probability * 1.0)
+
+        for target, order in player.history_order.items():
+            arrays["history_order"][i, int(target)] = order
+            arrays["history_betrayals"][i, int(target)] = player.history_betrayals[target]
+        arrays["history_size"][i] = len(player.history_order)
+        if player.most_betrayed_target is not None:
+            arrays["most_betrayed"][i] = int(player.most_betrayed_target)
+        arrays["betray_count"][i] = player.betray_count
+
+    return arrays
+
+'''
+#Function to write the flat arrays back into the Game after the kernel ran.
+    chosen_targets, targets: The (rounds, players) chosen targets and actions of the played rounds,
+    appended to the players' histories.
+'''
+def _store_game(game, arrays, chosen_targets, targets):
+    state = tuple(game.resources)
+
+    for i, player in enumerate(game.players):
+        values = player.q_table[state]
+        for target, value in enumerate(arrays["q_values"][i].tolist()):
+            values[None if target == i else str(target)] = value
+
+        #Histories grow in the order each target was first chosen, like update_history.
+        #A stable sort groups the rounds by target (int16 keys use NumPy's radix sort).
+        chosen = chosen_targets[:, i].astype(np.int16)
+        order = np.argsort(chosen, kind="stable")
+        betrayed = (targets[order, i] >= 0).astype(np.int64)
+        starts = np.flatnonzero(np.diff(chosen[order], prepend=-1))
+        ends = np.append(starts[1:], len(order))
+        for group in np.argsort(order[starts], kind="stable").tolist():
+            target = str(chosen[order[starts[group]]])
+            player.history[target].extend(betrayed[starts[group]:ends[group]].tolist())
+
+        history_targets = np.flatnonzero(arrays["history_order"][i] >= 0)
+        history_targets = history_targets[np.argsort(arrays["history_order"][i][history_targets])].tolist()
+        player.history_order = {str(target): order for order, target in enumerate(history_targets)}
+        player.history_betrayals = {
+            str(target): int(arrays["history_betrayals"][i, target]) for target in history_targets
+        }
+        best = int(arrays["most_betrayed"][i])
+        player.most_betrayed_target = None if best < 0 else str(best)
+        player.betray_count = int(arrays["betray_count"][i])
+
+    for i, points in enumerate(arrays["total_points"].tolist()):
+        game.total_points[str(i)] = points
+    for i, contributions in enumerate(arrays["collapse_contributions"].tolist()):
+        game.collapse_contributions[str(i)] = contributions
+    game.collapse_count = int(arrays["collapse_state"][0])
+
+'''
+#Function to play n_rounds rounds of a Game in one kernel call.
+    game: A simulation_game.Game with dictionary Q-tables and unbounded histories, whose play_turn_func
+        is a game2 rule, a resolver compiled by rules.compile_rule or a Sim5Rule.
+    n_rounds: Number of rounds to play.
+    first_round: Round number of the first played round (round 1 uses the betray probabilities directly).
+    backend: "numba" for the JIT compiled kernel, "numpy" for the NumPy rounds, or None for the fastest
+        available one.
+    The players, totals, collapse counters, rule history and the random module continue exactly as if
+    Game.play_round had been called for each round. The only difference is that the dictionary Q-tables
+    do not get the default rows that Game.play_round creates when it reads a state it never writes.
+    Returns a dictionary of (rounds, players) arrays: "targets" (betrayed player, -1 for cooperation),
+    "points" (total points after each round), "turn_points", and the "collapses" flags.
+'''
+def play_rounds(game, n_rounds, first_round=1, backend=None):
+    if backend is None:
+        backend = "numba" if HAS_NUMBA else "numpy"
+    if backend not in ("numba", "numpy"):
+        raise ValueError(f"Unknown backend: {backend}")
+    if backend == "numba" and not HAS_NUMBA:
+        raise ValueError("The numba backend needs numba to be installed")
+
+    n_players = game.n_players
+    spec, times_betrayers, store_times = game.rule_state()
+    arrays = _load_game(game)
+
+    #The kernel continues from the current state of the random module.
+    version, internal_state, gauss_next = random.getstate()
+    mt = np.array(internal_state[:-1], dtype=np.int64)
+    position = np.array([internal_state[-1]], dtype=np.int64)
+
+    chosen_targets = np.empty((n_rounds, n_players), dtype=np.int64)
+    targets = np.empty((n_rounds, n_players), dtype=np.int64)
+    points = np.empty((n_rounds, n_players), dtype=np.int64)
+    turn_points = np.empty((n_rounds, n_players), dtype=np.int64)
+    collapses = np.empty(n_rounds, dtype=bool)
+
+    arguments = (
+        first_round, arrays["q_values"], arrays["betray_probabilities"], arrays["alpha"], arrays["gamma"],
+        arrays["default_max_q"], arrays["resources"], arrays["history_betrayals"], arrays["history_order"],
+        arrays["history_size"], arrays["most_betrayed"], arrays["betray_count"], arrays["total_points"],
+        times_betrayers, arrays["collapse_state"], arrays["collapse_contributions"], mt, position,
+        chosen_targets, targets, points, turn_points, collapses, game.n_resources,
+    )
+    if backend == "numba":
+        threshold = game.n_resources if spec.threshold == "resources" else spec.threshold
+        _play_rounds_kernel(
+            *arguments, threshold, _INVOLVED_CODES[spec.involved], _EFFECT_CODES[spec.total_effect],
+            spec.first_collapse_only, spec.reward_victim,
+            -1 if spec.betrayer_penalty is None else spec.betrayer_penalty,
+        )
+    else:
+        _play_rounds_numpy(*arguments, compile_rule(spec, vectorized=True))
+
+    _store_game(game, arrays, chosen_targets, targets)
+    store_times(times_betrayers)
+    random.setstate((version, tuple(mt.tolist()) + (int(position[0]),), gauss_next))
+
+    return {"targets": targets, "points": points, "turn_points": turn_points, "collapses": collapses}
@@ -1,9 +1,23 @@
 #gaussian_filter1d: A function for applying a Gaussian filter to 1D data for smoothing.
+#ProcessPoolExecutor: Used to build and save figures in parallel worker processes.
+#hashlib, inspect, json: Used to fingerprint the inputs of each figure for incremental rendering.
+import hashlib
+import inspect
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
 from scipy.ndimage import gaussian_filter1d
 
+import profiling
+from evaluation import calculate_metrics_from_trajectory
+from round_recorder import RoundRecorder
+from trajectory_store import open_trajectory
+
 #Set the plotting style to "classic" for a traditional appearance.
 #Configure font settings to use "Times New Roman" for the plots.
 plt.style.use("classic")
@@ -31,64 +45,237 @@ def set_common_style(ax, title, xlabel, ylabel):
     ax.spines["top"].set_visible(False)
     ax.spines["right"].set_visible(False)
 
+#Names of the plot families, in the order generate_plots builds them.
+PLOT_NAMES = [
+    "overall_cooperation",
+    "overall_betrayal",
+    "cooperation_betrayal_per_player",
+    "best_vs_worst",
+    "trust_decay",
+    "collapse_impact",
+    "resources_over_time",
+    "overall_betrayal_probability_evolution",
+    "best_worst_betrayal_probability_evolution",
+]
+
 '''
 #Function to generate multiple plots based on game metrics.
     metrics: A dictionary of calculated metrics from the game.
     n_rounds: The total number of rounds in the game.
     game_instance: The current game instance.
     game_data: The raw game data used to create plots.
+    include: Optional list of plot names to generate (default: all of PLOT_NAMES).
 '''
-def generate_plots(metrics, n_rounds, game_instance, game_data):
-    #Initialize an empty dictionary to hold the generated plots.
+def generate_plots(metrics, n_rounds, game_instance, game_data, include=None):
+    #Build each selected plot from its (small) input data, timing each figure (see profiling.py).
+    profiler = profiling.current()
     plots = {}
+    for name, (function_name, args) in plot_specs(metrics, n_rounds, game_data, include).items():
+        with profiler.phase(f"plots.build.{name}"):
+            plots[name] = globals()[function_name](*args)
+    return plots
 
-    #Generate the plot for overall cooperation rate.
-    plots["overall_cooperation"] = plot_overall_cooperation(
-        metrics["overall_cooperation_rate"], n_rounds
-    )
-
-    #Generate the plot for overall betrayal rate.
-    plots["overall_betrayal"] = plot_overall_betrayal(
-        metrics["overall_betrayal_rate"], n_rounds
-    )
-
-    #Generate the plot for cooperation and betrayal per player.
-    plots["cooperation_betrayal_per_player"] = plot_cooperation_betrayal_per_player(
-        metrics["cooperation_per_player"], metrics["betrayal_per_player"]
-    )
-
-    #Generate a comparison plot for the best and worst players.
-    plots["best_vs_worst"] = plot_best_vs_worst_comparison(
-        metrics["best_player"],
-        metrics["worst_player"],
-        metrics["best_player_data"],
-        metrics["worst_player_data"],
-    )
+'''
+#Function to collect the plotting function and the input data of each selected plot.
+    Only metric values and per-round series are kept, so the specs are cheap to send to worker processes.
+    Returns a dictionary mapping each plot name to (function name, arguments).
+'''
+def plot_specs(metrics, n_rounds, game_data, include=None):
+    selected = PLOT_NAMES if include is None else [name for name in PLOT_NAMES if name in include]
+    specs = {}
+
+    for name in selected:
+        if name == "overall_cooperation":
+            #Plot for overall cooperation rate.
+            specs[name] = ("plot_overall_cooperation", (metrics["overall_cooperation_rate"], n_rounds))
+        elif name == "overall_betrayal":
+            #Plot for overall betrayal rate.
+            specs[name] = ("plot_overall_betrayal", (metrics["overall_betrayal_rate"], n_rounds))
+        elif name == "cooperation_betrayal_per_player":
+            #Plot for cooperation and betrayal per player.
+            specs[name] = (
+                "plot_cooperation_betrayal_per_player",
+                (metrics["cooperation_per_player"], metrics["betrayal_per_player"]),
+            )
+        elif name == "best_vs_worst":
+            #Comparison plot for the best and worst players.
+            specs[name] = (
+                "plot_best_vs_worst_comparison",
+                (
+                    metrics["best_player"],
+                    metrics["worst_player"],
+                    metrics["best_player_data"],
+                    metrics["worst_player_data"],
+                ),
+            )
+        elif name == "trust_decay":
+            #Plot for trust decay rate.
+            specs[name] = ("plot_trust_decay_rate", (metrics["trust_decay_rate"],))
+        elif name == "collapse_impact":
+            #Plot showing the impact of system collapse on cooperation rates.
+            specs[name] = (
+                "plot_pre_post_collapse_cooperation",
+                (metrics["pre_collapse_cooperation"], metrics["post_collapse_cooperation"]),
+            )
+        elif name == "resources_over_time":
+            #Plot showing how resources evolved over time.
+            specs[name] = ("plot_resources_over_time", (metrics["resources_over_time"], n_rounds))
+        elif name == "overall_betrayal_probability_evolution":
+            #Plot showing the evolution of betrayal probability over time (the per-round betrayal rate).
+            specs[name] = ("plot_betrayal_probability_evolution", (metrics["overall_betrayal_rate"],))
+        elif name == "best_worst_betrayal_probability_evolution":
+            #Comparison plot of betrayal probability evolution for the best and worst players.
+            specs[name] = (
+                "plot_best_worst_betrayal_series",
+                (
+                    betrayal_series(game_data, metrics["best_player"]),
+                    betrayal_series(game_data, metrics["worst_player"]),
+                    metrics["best_player"],
+                    metrics["worst_player"],
+                ),
+            )
 
-    #Generate the plot for trust decay rate.
-    plots["trust_decay"] = plot_trust_decay_rate(metrics["trust_decay_rate"])
+    return specs
 
-    #Generate the plot showing the impact of system collapse on cooperation rates.
-    plots["collapse_impact"] = plot_pre_post_collapse_cooperation(
-        metrics["pre_collapse_cooperation"], metrics["post_collapse_cooperation"]
-    )
+'''
+#Function to get, for each round, whether a player betrayed (1) or cooperated (0).
+    game_data: A RoundRecorder (read from its target column) or a list of round dictionaries.
+    player: The ID of the player.
+'''
+def betrayal_series(game_data, player):
+    if isinstance(game_data, RoundRecorder):
+        return (game_data.targets[: len(game_data), int(player)] >= 0).astype(int).tolist()
+    return [1 if round_data['actions'][str(player)] is not None else 0 for round_data in game_data]
 
-    #Generate the plot showing how resources evolved over time.
-    plots["resources_over_time"] = plot_resources_over_time(
-        metrics["resources_over_time"], n_rounds
-    )
+#Name of the manifest file, saved next to the plots, with the fingerprint of each rendered figure.
+MANIFEST_NAME = "plots_manifest.json"
 
-    #Generate the plot showing the evolution of betrayal probability over time.
-    plots['overall_betrayal_probability_evolution'] = plot_overall_betrayal_probability_evolution(game_data)
+'''
+#Function to fingerprint everything a figure depends on.
+    The fingerprint covers the plotting function and set_common_style source code, the style settings
+    (rcParams, except the backend), the input data and the resolution. Editing one plotting function only
+    changes the fingerprint of its own figures.
+'''
+def plot_fingerprint(function_name, args, dpi):
+    digest = hashlib.sha256()
+    digest.update(inspect.getsource(globals()[function_name]).encode())
+    digest.update(inspect.getsource(set_common_style).encode())
+    digest.update(repr(sorted((key, repr(value)) for key, value in plt.rcParams.items() if key != "backend")).encode())
+    _update_digest(digest, args)
+    digest.update(str(dpi).encode())
+    return digest.hexdigest()
+
+#Function to add a plot input to a fingerprint (NumPy arrays by content, since their repr is abbreviated).
+def _update_digest(digest, value):
+    if isinstance(value, np.ndarray):
+        digest.update(f"ndarray{value.dtype.str}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        digest.update(f"dict{len(value)}".encode())
+        for key in sorted(value, key=repr):
+            digest.update(repr(key).encode())
+            _update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _update_digest(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+#Function to read the manifest of a plot folder (empty if there is none).
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+#Function to write the manifest of a plot folder, through a temporary file.
+def _write_manifest(path, manifest):
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+#Function run once in each worker process to use the non-interactive Agg backend.
+def _init_render_worker():
+    plt.switch_backend("Agg")
 
-    #Generate a comparison plot of betrayal probability evolution for the best and worst players.
-    plots['best_worst_betrayal_probability_evolution'] = plot_best_worst_betrayal_probability_evolution(
-        game_data, metrics['best_player'], metrics['worst_player']
-    )
+'''
+#Function to build a single plot and save it as a PNG file (executed in a worker process).
+    Returns the clock times (time.perf_counter) at the start, after building the figure and after saving it.
+'''
+def _render_plot(function_name, args, path, dpi):
+    start = time.perf_counter()
+    fig = globals()[function_name](*args)
+    built = time.perf_counter()
+    fig.savefig(path, dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+    return start, built, time.perf_counter()
 
-    #Return the dictionary containing all generated plots.
-    return plots
+'''
+#Function to build and save the selected plots, spreading the figures across worker processes.
+    metrics, n_rounds, game_data: The same inputs as generate_plots (the game instance is not needed).
+    path: The folder where the plots are saved as <name>_plot.png (created if needed).
+    include: Optional list of plot names to render (default: all of PLOT_NAMES).
+    max_workers: Number of worker processes (1 renders in the current process).
+    dpi: Resolution of the saved PNG files.
+    force: Render every figure, even those whose fingerprint did not change.
+    A figure is skipped when its PNG exists and the manifest of the folder has the same fingerprint
+    (see plot_fingerprint), so only the figures whose inputs, code or style changed are rendered.
+    Returns a dictionary mapping each plot name to the saved file path.
+'''
+def render_plots(metrics, n_rounds, game_data, path, include=None, max_workers=None, dpi=300, force=False):
+    os.makedirs(path, exist_ok=True)
+    specs = plot_specs(metrics, n_rounds, game_data, include)
+    paths = {name: os.path.join(path, f"{name}_plot.png") for name in specs}
+
+    manifest = read_manifest(path)
+    fingerprints = {name: plot_fingerprint(function_name, args, dpi) for name, (function_name, args) in specs.items()}
+    pending = [
+        name for name in specs
+        if force or manifest.get(name) != fingerprints[name] or not os.path.exists(paths[name])
+    ]
+
+    #The build and save (PNG encoding) times of each figure go to the active profiler (see profiling.py).
+    profiler = profiling.current()
+    if max_workers == 1 or len(pending) <= 1:
+        for name in pending:
+            function_name, args = specs[name]
+            start, built, end = _render_plot(function_name, args, paths[name], dpi)
+            profiler.add(f"plots.build.{name}", start, built)
+            profiler.add(f"plots.save.{name}", built, end)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_render_worker) as executor:
+            futures = {
+                name: executor.submit(_render_plot, specs[name][0], specs[name][1], paths[name], dpi)
+                for name in pending
+            }
+            for name, future in futures.items():
+                #The worker clocks differ from this process, so only the durations are kept.
+                start, built, end = future.result()
+                profiler.add_duration(f"plots.build.{name}", built - start)
+                profiler.add_duration(f"plots.save.{name}", end - built)
+
+    if pending:
+        manifest.update({name: fingerprints[name] for name in pending})
+        _write_manifest(path, manifest)
+    return paths
 
+'''
+#Function to build and save the plots of a range of rounds stored in a trajectory file.
+    trajectory_path: A file written by trajectory_store.TrajectoryStore.
+    path: The folder where the plots are saved.
+    start, stop: Range of rounds, like a slice (default: the whole run). Only those rounds are read from disk.
+    include, max_workers, dpi, force: The same options as render_plots.
+    Returns a dictionary mapping each plot name to the saved file path.
+'''
+def render_trajectory_plots(trajectory_path, path, start=None, stop=None, include=None, max_workers=None, dpi=300,
+                            force=False):
+    metrics = calculate_metrics_from_trajectory(trajectory_path, start, stop)
+    with open_trajectory(trajectory_path) as store:
+        rounds = store.window(start, stop)
+        return render_plots(metrics, len(rounds), rounds, path, include, max_workers, dpi, force)
 
 '''
 #Function to plot the overall cooperation rate over time.
@@ -400,6 +587,16 @@ def plot_overall_betrayal_probability_evolution(game_data):
         avg_betrayal_probability = (betrayal_count / len(actions)) * 100
         avg_betrayal_probabilities.append(avg_betrayal_probability)
 
+    return plot_betrayal_probability_evolution(avg_betrayal_probabilities)
+
+'''
+#Function to plot the evolution of betrayal probability from the per-round betrayal percentages.
+    avg_betrayal_probabilities: The percentage of betrayal actions in each round.
+'''
+def plot_betrayal_probability_evolution(avg_betrayal_probabilities):
+    #Calculate the total number of rounds.
+    rounds = len(avg_betrayal_probabilities)
+
     #Apply Gaussian smoothing to the betrayal probabilities.
     smoothed_probabilities = gaussian_filter1d(avg_betrayal_probabilities, sigma=3)
 
@@ -439,8 +636,23 @@ def plot_overall_betrayal_probability_evolution(game_data):
     worst_player: The ID of the worst player.
 '''
 def plot_best_worst_betrayal_probability_evolution(game_data, best_player, worst_player):
+    return plot_best_worst_betrayal_series(
+        betrayal_series(game_data, best_player),
+        betrayal_series(game_data, worst_player),
+        best_player,
+        worst_player,
+    )
+
+'''
+#Function to compare the evolution of betrayal probability from the per-round betrayals of two players.
+    best_betrayals: 1 for each round the best player betrayed, 0 otherwise.
+    worst_betrayals: 1 for each round the worst player betrayed, 0 otherwise.
+    best_player: The ID of the best player.
+    worst_player: The ID of the worst player.
+'''
+def plot_best_worst_betrayal_series(best_betrayals, worst_betrayals, best_player, worst_player):
     #Calculate the total number of rounds.
-    rounds = len(game_data)
+    rounds = len(best_betrayals)
 
     #Initialize lists to store betrayal probabilities for the best and worst players.
     best_betrayal_probs = []
@@ -454,8 +666,8 @@ def plot_best_worst_betrayal_probability_evolution(game_data, best_player, worst
         start = max(0, i - window_size + 1)
 
         #Calculate the betrayal probability for the best player in the sliding window.
-        best_window = [1 if game_data[j]['actions'][str(best_player)] is not None else 0 for j in range(start, i + 1)]
-        worst_window = [1 if game_data[j]['actions'][str(worst_player)] is not None else 0 for j in range(start, i + 1)]
+        best_window = best_betrayals[start:i + 1]
+        worst_window = worst_betrayals[start:i + 1]
 
         #Append the calculated probabilities to the respective lists.
         best_betrayal_probs.append(sum(best_window) / len(best_window) * 100)
@@ -1,6 +1,19 @@
 import numpy as np
+import logging
 import random
+import time
 from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+#Logger of the game: per-round states are DEBUG records, game outcomes are INFO records.
+#Nothing is printed unless logging is configured (see configure_logging).
+logger = logging.getLogger(__name__)
+
+#Function to configure the output of the game logger: 0 shows warnings only, 1 the game outcomes, 2 every round.
+def configure_logging(verbosity=1):
+    level = {0: logging.WARNING, 1: logging.INFO}.get(verbosity, logging.DEBUG)
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(level)
 
 #Player class represents each player in the game
 class Player:
@@ -24,11 +37,13 @@ betray_probability: This represents the initial likelihood that the player will
         self.q_table = {}  #Q-table to store state-action values
         self.history = defaultdict(lambda: deque(maxlen=history_length))  #Track interactions with other players
         self.betray_probability = betray_probability  #Initial probability of betrayal
+        self.initial_betray_probability = betray_probability  #Restored when a new game starts
         self.total_resources = 0  #Total resources accumulated by the player
 
-    #Method to get the current state (the resources of all players)
+    #Method to get the current state (the resources of all players, relative to this player's)
     def get_state(self, resources):
-        relative_resources = tuple(res - resources[self.id] for res in resources)
+        resources = np.asarray(resources)
+        relative_resources = tuple((resources - resources[self.id]).tolist())
         return relative_resources
 
     #Method to choose an action (cooperate or betray) based on the state and target player
@@ -70,9 +85,94 @@ betray_probability: This represents the initial likelihood that the player will
         #Update the Q-value using the Q-learning formula
         self.q_table[state][action] += self.alpha * (q_target - q_predict)
 
+#Class tracking the highest resources of the players and how many players have them, so the winner check
+#(a single player with the highest resources) is O(1) and each resource change is O(1) amortized
+class LeaderTracker:
+    def __init__(self, resources):
+        self.reset(resources)
+
+    #Method to rebuild the tracker from the resources of every player
+    def reset(self, resources):
+        self.counts = defaultdict(int)  #Number of players with each resource value
+        for value in np.asarray(resources).tolist():
+            self.counts[value] += 1
+        self.top = max(self.counts) if self.counts else None  #Highest resources
+
+    #Method to move a player from old_value to new_value resources
+    def update(self, old_value, new_value):
+        if old_value == new_value:
+            return
+        self.counts[new_value] += 1
+        self.counts[old_value] -= 1
+        if self.counts[old_value] == 0:
+            del self.counts[old_value]
+        if new_value > self.top:
+            self.top = new_value
+        elif old_value == self.top and old_value not in self.counts:
+            #The leader lost resources: the new highest value is below the old one, within the change
+            while self.top not in self.counts:
+                self.top -= 1
+
+    #Method to check if a single player has the highest resources
+    def has_unique_leader(self):
+        return self.counts[self.top] == 1
+
+'''
+#Class interning the state tuples into integer IDs, shared by the players of a game and across games.
+The Q-tables of the players are then keyed by IDs: a state tuple is stored once, and the relative state of
+a player is found from the resource pattern (resources minus their minimum, interned once per change of the
+resources) and the player's offset in it, so a round only builds the tuples of the states never seen before.
+'''
+class StateInterner:
+    def __init__(self):
+        self.ids = {}  #State tuple -> ID
+        self.states = []  #ID -> state tuple
+        self.patterns = {}  #Resource pattern tuple -> pattern ID
+        self.relative_ids = {}  #(pattern ID, offset) -> ID of the relative state
+
+    def __len__(self):
+        return len(self.states)
+
+    #Method to get the ID of a state tuple, adding it if it is new
+    def intern(self, state):
+        state_id = self.ids.get(state)
+        if state_id is None:
+            state_id = self.ids[state] = len(self.states)
+            self.states.append(state)
+        return state_id
+
+    #Method to intern the pattern of the resources, returning its ID and the offset of every player in it
+    def pattern(self, resources):
+        offsets = (resources - resources.min()).tolist()
+        pattern_key = tuple(offsets)
+        pattern_id = self.patterns.get(pattern_key)
+        if pattern_id is None:
+            pattern_id = self.patterns[pattern_key] = len(self.patterns)
+        return pattern_id, offsets
+
+    #Method to get the ID of the relative state (see Player.get_state) of a player from a pattern
+    def relative_state(self, pattern, player_id):
+        pattern_id, offsets = pattern
+        offset = offsets[player_id]
+        state_id = self.relative_ids.get((pattern_id, offset))
+        if state_id is None:
+            state = tuple(value - offset for value in offsets)
+            state_id = self.relative_ids[(pattern_id, offset)] = self.intern(state)
+        return state_id
+
+    #Method to get the ID of the relative state of every player
+    def relative_states(self, resources):
+        pattern = self.pattern(resources)
+        return [self.relative_state(pattern, player_id) for player_id in range(len(resources))]
+
 #Game class represents the overall game logic
 class Game:
-    def __init__(self, n_players, n_resources, n_rounds, betray_probabilities):
+    '''
+    #Constructor of the game.
+        interner: Optional StateInterner. With it, the Q-tables of the players are keyed by state IDs (see
+            q_table_states) instead of state tuples, with the same learned values.
+    '''
+    def __init__(self, n_players, n_resources, n_rounds, betray_probabilities, interner=None):
         self.n_players = n_players  #Number of players
         self.n_resources = n_resources  #Initial resources for each player
         self.n_rounds = n_rounds  #Number of rounds to play initially
@@ -83,95 +183,157 @@ class Game:
         ]
         self.resources = np.full(n_players, n_resources)  #Initialize resources for all players
         self.betrayal_log = []  #Log to track betrayals in each game
+        self.leaders = LeaderTracker(self.resources)  #Highest resources, for the winner check
+        self.rounds_played = 0  #Number of rounds played in the current game
+        self.stop_reason = None  #Why the last game ended: "winner", "max_rounds" or "max_seconds"
+        self.interner = interner  #Shared state IDs of the Q-tables, if any
 
-    #Method to reset the game for a new round
+    #Method to reset the game for a new game, keeping what the players learned (Q-tables and histories)
     def reset(self):
         self.resources = np.full(self.n_players, self.n_resources)  #Reset resources for all players
         self.betrayal_log = []  #Reset betrayal log for a new game
+        self.leaders.reset(self.resources)
+        self.rounds_played = 0
+        self.stop_reason = None
+        for player in self.players:
+            player.betray_probability = player.initial_betray_probability  #Undo the intensity increases
+
+    #Method to get the Q-table of a player keyed by state tuples (translating the state IDs if interned)
+    def q_table_states(self, player):
+        if self.interner is None:
+            return player.q_table
+        return {self.interner.states[state_id]: values for state_id, values in player.q_table.items()}
 
-    #Method to check if there is a clear winner
+    #Method to check if there is a clear winner (kept up to date by play_round, see LeaderTracker)
     def has_winner(self):
-        max_resources = max(self.resources)
-        return list(self.resources).count(max_resources) == 1
+        return self.leaders.has_unique_leader()
 
     #Method to play one round of the game
+    #The round is resolved on a target index array: targets[i] is the player targeted by player i and
+    #betray[i] tells whether player i betrayed it, so the cost grows linearly with the number of players.
     def play_round(self, round_num):
         state = tuple(self.resources)  #Get the current state (resources of all players)
-        actions = []
-        round_betrayals = []  #Track betrayals in this round
-        player_betrayed_counts = defaultdict(int)  #Count how many times each player is betrayed
+        targets = np.empty(self.n_players, dtype=np.int64)  #Target of each player
+        actions = []  #Action of each player
         
-        print(f"Match Round State: {state}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Match Round State: {state}", extra={"round": round_num, "state": state})
+
+        #With interned states, the Q-tables use the IDs of the states
+        if self.interner is not None:
+            state = self.interner.intern(tuple(self.resources.tolist()))
+            relative_states = self.interner.relative_states(self.resources)
+
         for player in self.players:
-            #Each player selects another player to target
-            target_player = random.choice([i for i in range(self.n_players) if i != player.id])
+            #Each player selects another player to target (the same draw as a random.choice over the
+            #other players, without building their list)
+            target_player = random.randrange(self.n_players - 1)
+            if target_player >= player.id:
+                target_player += 1
             #Player chooses an action (cooperate or betray)
-            relative_state = player.get_state(self.resources)
+            if self.interner is None:
+                relative_state = player.get_state(self.resources)
+            else:
+                relative_state = relative_states[player.id]
             action = player.choose_action(relative_state, target_player, round_num)
-            actions.append((player.id, target_player, action))
+            targets[player.id] = target_player
+            actions.append(action)
             #Update history of interactions for the player
             player.update_history(target_player, action)
-            #Log the betrayal if it happens
-            if action == 'betray':
-                round_betrayals.append((player.id, target_player))
-                player_betrayed_counts[target_player] += 1
-        
-        #Handle complex cases of multiple betrayals
-        everyone_gets_zero = False
-        for player_id, count in player_betrayed_counts.items():
-            if count > 2:
-                #If a player is betrayed by more than 2 others, all players get 0 resources
-                everyone_gets_zero = True
-                break
+
+        #Betrayers and their targets, in player order
+        betray = np.array([action == 'betray' for action in actions], dtype=bool)
+        betrayers = np.flatnonzero(betray)
+        betrayed = targets[betrayers]
+        round_betrayals = list(zip(betrayers.tolist(), betrayed.tolist()))  #Track betrayals in this round
+
+        #If a player is betrayed by more than 2 others, all players get 0 resources
+        everyone_gets_zero = bool(len(betrayed)) and np.bincount(betrayed).max() > 2
 
         rewards = np.zeros(self.n_players)  #Initialize rewards for this round
 
         if not everyone_gets_zero:
-            for (player_id, target_player, action) in actions:
-                if action == 'betray':
-                    if (target_player, player_id, 'betray') in actions:  
-                        #Both betray each other
-                        rewards[player_id] -= 1
-                        rewards[target_player] -= 1
-                    else:  
-                        #One betrays the other
-                        rewards[player_id] += 1
-                        rewards[target_player] -= 1
-        #If a player was betrayed more than twice, set rewards to zero for everyone
-        else:
-            rewards.fill(0)
+            #Both betray each other when the target of a betrayer also betrays it back
+            mutual = betray[betrayed] & (targets[betrayed] == betrayers)
+            #A mutual betrayal costs both players a point, otherwise the betrayer takes the point of its target
+            np.add.at(rewards, betrayers, np.where(mutual, -1, 1))
+            np.add.at(rewards, betrayed, -1)
         
         #Update resources and Q-table for each player
+        #The new state of a player includes the rewards of the players before it, but not of those after it
+        pattern = None  #Interned resource pattern, recomputed when a reward changes the resources
         for i, player in enumerate(self.players):
+            old_resources = int(self.resources[i])
             self.resources[i] += rewards[i]
+            self.leaders.update(old_resources, int(self.resources[i]))
             player.total_resources += rewards[i]  #Accumulate the player's resources
-            new_state = player.get_state(self.resources)
-            player.update_q_table(state, actions[i][2], rewards[i], new_state)
+            if self.interner is None:
+                new_state = player.get_state(self.resources)
+            else:
+                if pattern is None or rewards[i]:
+                    pattern = self.interner.pattern(self.resources)
+                new_state = self.interner.relative_state(pattern, i)
+            player.update_q_table(state, actions[i], rewards[i], new_state)
         
         #Log the betrayals for this round
         self.betrayal_log.append(round_betrayals)
+        self.rounds_played = round_num
 
-    #Method to play the initial fixed rounds of the game
-    def play_initial_rounds(self):
+    '''
+    #Method to play the initial fixed rounds of the game.
+        deadline: time.monotonic() value after which no new round is started (default no limit).
+    Returns False if the deadline stopped the initial rounds (and sets stop_reason), True otherwise.
+    '''
+    def play_initial_rounds(self, deadline=None):
         for round_num in range(1, self.n_rounds + 1):
+            if deadline is not None and time.monotonic() >= deadline:
+                self.stop_reason = "max_seconds"
+                return False
             self.play_round(round_num)
+        return True
     
-    #Method to continue the game until a clear winner is found
-    def play_until_winner(self):
+    '''
+    #Method to continue the game until a clear winner is found, or until a budget runs out.
+        max_rounds: Maximum total number of rounds of the game, initial rounds included (default no limit).
+        deadline: time.monotonic() value after which no new round is started (default no limit).
+    Returns True if there is a winner, and sets stop_reason.
+    '''
+    def play_until_winner(self, max_rounds=None, deadline=None):
         round_num = self.n_rounds
-        while not self.has_winner():
+        winner = self.has_winner()
+        while not winner:
+            if max_rounds is not None and round_num >= max_rounds:
+                self.stop_reason = "max_rounds"
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                self.stop_reason = "max_seconds"
+                break
             round_num += 1
             self.play_round(round_num)
-            if not self.has_winner():
+            winner = self.has_winner()
+            if not winner:
                 #Increase intensity if no winner
                 for player in self.players:
                     player.increase_intensity()
+        if winner:
+            self.stop_reason = "winner"
+        return winner
 
-    #Method to play the entire game
-    def play_game(self):
-        self.play_initial_rounds()
-        if not self.has_winner():
-            self.play_until_winner()
+    '''
+    #Method to play the entire game.
+        max_rounds: Maximum total number of rounds when there is no winner after the initial rounds
+            (default no limit).
+        max_seconds: Wall-time budget of the game in seconds, initial rounds included (default no limit).
+    Returns the total resources of each player.
+    '''
+    def play_game(self, max_rounds=None, max_seconds=None):
+        deadline = None if max_seconds is None else time.monotonic() + max_seconds
+        if self.play_initial_rounds(deadline):
+            self.play_until_winner(max_rounds, deadline)
+        logger.info(
+            f"Game ended after {self.rounds_played} rounds ({self.stop_reason})",
+            extra={"rounds": self.rounds_played, "stop_reason": self.stop_reason},
+        )
         #Return total resources after the game
         return [player.total_resources for player in self.players]  
 
@@ -198,6 +360,183 @@ class Game:
             else:
                 print(f"Player {player_id} finished with {resource} resources")
 
+'''
+#Function to play many games and summarize how many rounds they needed to find a winner.
+    n_games: Number of games to play, each with new players.
+    max_rounds, max_seconds: Budget of each game (see Game.play_game).
+    seed: Optional seed of the random module.
+Returns a dictionary with the number of games, of games with a winner and of games stopped by each budget,
+and the mean, median, 90th percentile and longest number of rounds of the games with a winner.
+'''
+def rounds_to_winner_stats(n_games, n_players, n_resources, n_rounds, betray_probabilities, max_rounds=None,
+                           max_seconds=None, seed=None):
+    if seed is not None:
+        random.seed(seed)
+    rounds = []
+    stop_reasons = defaultdict(int)
+    for _ in range(n_games):
+        game = Game(n_players, n_resources, n_rounds, betray_probabilities)
+        game.play_game(max_rounds, max_seconds)
+        stop_reasons[game.stop_reason] += 1
+        if game.stop_reason == "winner":
+            rounds.append(game.rounds_played)
+
+    rounds = np.array(rounds)
+    stats = {
+        "games": n_games,
+        "winners": len(rounds),
+        "max_rounds_reached": stop_reasons["max_rounds"],
+        "max_seconds_reached": stop_reasons["max_seconds"],
+    }
+    if len(rounds):
+        stats["mean_rounds"] = float(rounds.mean())
+        stats["median_rounds"] = float(np.median(rounds))
+        stats["p90_rounds"] = float(np.percentile(rounds, 90))
+        stats["longest_rounds"] = int(rounds.max())
+    return stats
+
+#Function to summarize how a game ended: (rounds played, stop reason, winner ID or None)
+def _game_outcome(game):
+    winner = int(np.argmax(game.resources)) if game.stop_reason == "winner" else None
+    return game.rounds_played, game.stop_reason, winner
+
+'''
+#Function to play games in a worker process from a copy of the Q-tables (one actor of train).
+    q_tables: The Q-tables of the players, keyed by state tuples.
+Returns the Q-table entries changed by the actor (keyed by state tuples), the outcome of each game and
+the resources accumulated by each player.
+'''
+def _play_actor_games(n_players, n_resources, n_rounds, betray_probabilities, max_rounds, max_seconds, q_tables,
+                      n_games, seed):
+    random.seed(seed)
+    game = Game(n_players, n_resources, n_rounds, betray_probabilities, interner=StateInterner())
+    for player, q_table in zip(game.players, q_tables):
+        player.q_table = {game.interner.intern(state): dict(values) for state, values in q_table.items()}
+
+    outcomes = []
+    for _ in range(n_games):
+        game.reset()
+        game.play_game(max_rounds, max_seconds)
+        outcomes.append(_game_outcome(game))
+
+    changes = [
+        {state: values for state, values in game.q_table_states(player).items() if q_table.get(state) != values}
+        for player, q_table in zip(game.players, q_tables)
+    ]
+    return changes, outcomes, [player.total_resources for player in game.players]
+
+'''
+#Function to train persistent learners over many games of the n-people game.
+    n_games: Number of games to play. The players keep their Q-tables (keyed by interned states, see
+        StateInterner) and histories across games, while the resources and betrayal probabilities are reset
+        at the start of every game.
+    max_rounds, max_seconds: Budget of each game (see Game.play_game).
+    n_actors: Number of worker processes playing games in parallel. Each actor plays merge_every games from a
+        copy of the Q-tables, then the Q-value changes of each state are averaged over the actors that changed
+        it and added to the shared tables (the histories of the players are only kept with a single actor). The tables are copied to the actors
+        at every merge, so merge_every should grow with the size of the tables.
+    progress_every: Number of games summarized by each progress entry, also logged at INFO level (the last
+        entry summarizes the remaining games).
+    seed: Optional seed (each parallel actor gets its own child of numpy.random.SeedSequence(seed)).
+Returns the trained Game and the list of progress entries, with the number of games played, the mean rounds
+per game, the share of games with a winner, the wins of each player, the number of stored Q-values and
+the seconds since the start of the training.
+'''
+def train(n_games, n_players, n_resources, n_rounds, betray_probabilities, max_rounds=None, max_seconds=None,
+          n_actors=1, merge_every=100, progress_every=100, seed=None):
+    game = Game(n_players, n_resources, n_rounds, betray_probabilities, interner=StateInterner())
+    progress = []
+    window = []
+    games_summarized = 0
+    start = time.perf_counter()
+
+    #Summarize the games of the progress window into a progress entry.
+    def flush():
+        nonlocal games_summarized
+        if not window:
+            return
+        games_summarized += len(window)
+        rounds = [rounds_played for rounds_played, _, _ in window]
+        wins = defaultdict(int)
+        for _, _, winner in window:
+            if winner is not None:
+                wins[winner] += 1
+        entry = {
+            "games": games_summarized,
+            "mean_rounds": float(np.mean(rounds)),
+            "winner_rate": sum(1 for _, stop_reason, _ in window if stop_reason == "winner") / len(window),
+            "wins": dict(wins),
+            "q_values": sum(len(player.q_table) for player in game.players),
+            "interned_states": len(game.interner),
+            "seconds": time.perf_counter() - start,
+        }
+        progress.append(entry)
+        logger.info(
+            f"Games {entry['games']}: {entry['mean_rounds']:.1f} rounds per game, "
+            f"{entry['winner_rate']:.0%} with a winner, {entry['q_values']} Q-values",
+            extra=entry,
+        )
+        window.clear()
+
+    #Add the outcome of a game to the progress window, summarizing the window when it is full.
+    def record(outcome):
+        window.append(outcome)
+        if len(window) == progress_every:
+            flush()
+
+    if n_actors == 1:
+        if seed is not None:
+            random.seed(seed)
+        for _ in range(n_games):
+            game.reset()
+            game.play_game(max_rounds, max_seconds)
+            record(_game_outcome(game))
+        flush()
+        return game, progress
+
+    seed_sequence = np.random.SeedSequence(seed)
+    with ProcessPoolExecutor(max_workers=n_actors) as executor:
+        played = 0
+        while played < n_games:
+            #Each actor plays up to merge_every games from the current Q-tables.
+            n_period = min(n_games - played, merge_every * n_actors)
+            counts = [n_period // n_actors + (actor < n_period % n_actors) for actor in range(n_actors)]
+            counts = [count for count in counts if count]
+            q_tables = [game.q_table_states(player) for player in game.players]
+            futures = [
+                executor.submit(
+                    _play_actor_games, n_players, n_resources, n_rounds, betray_probabilities, max_rounds,
+                    max_seconds, q_tables, count, int(child.generate_state(1, np.uint64)[0]),
+                )
+                for count, child in zip(counts, seed_sequence.spawn(len(counts)))
+            ]
+            results = [future.result() for future in futures]
+
+            #Average the changes of the actors into the shared Q-tables, over the actors that changed each state.
+            for i, player in enumerate(game.players):
+                deltas = defaultdict(lambda: {'cooperate': 0.0, 'betray': 0.0})
+                n_changed = defaultdict(int)
+                for changes, _, _ in results:
+                    for state, values in changes[i].items():
+                        base = q_tables[i].get(state, {'cooperate': 0, 'betray': 0})
+                        for action in ('cooperate', 'betray'):
+                            deltas[state][action] += values[action] - base[action]
+                        n_changed[state] += 1
+                for state, delta in deltas.items():
+                    base = q_tables[i].get(state, {'cooperate': 0, 'betray': 0})
+                    player.q_table[game.interner.intern(state)] = {
+                        action: base[action] + delta[action] / n_changed[state] for action in ('cooperate', 'betray')
+                    }
+
+            for _, outcomes, total_resources in results:
+                for player, resources in zip(game.players, total_resources):
+                    player.total_resources += resources
+                for outcome in outcomes:
+                    record(outcome)
+            played += n_period
+    flush()
+    return game, progress
+
 if __name__ == "__main__":
     n_players = 4  #Number of players
     n_resources = 2  #Initial resources per player
@@ -207,11 +546,18 @@ if __name__ == "__main__":
     #Define betrayal probabilities for each player (0 = never betray, 1 = always betray)
     betray_probabilities = [0.0, 0.0, 0.0, 0.0]  #Example values for 4 players
 
+    #Output of the game: 0 is quiet, 1 shows how each game ended, 2 also shows the state of every round
+    configure_logging(verbosity=1)
+
+    #Budget of a game without a winner after the initial rounds
+    max_rounds = 10000  #Maximum total number of rounds
+    max_seconds = 60  #Maximum wall time in seconds
+
     #Initialize the game
     game = Game(n_players, n_resources, n_rounds, betray_probabilities)  
 
     #Play the game
-    game.play_game()
+    game.play_game(max_rounds, max_seconds)
 
     #Display the betrayal log
     game.display_betrayal_log()
@@ -228,3 +574,14 @@ if __name__ == "__main__":
 
     #Display the final results and winner
     game.display_final_results()
+
+    #Rounds needed to find a winner across many games (without the outcome of each game)
+    configure_logging(verbosity=0)
+    if n_games > 1:
+        #Learn over many games with persistent Q-tables, logging the progress every 100 games
+        logger.setLevel(logging.INFO)
+        trained_game, progress = train(n_games, n_players, n_resources, n_rounds, betray_probabilities,
+                                       max_rounds, max_seconds)
+        logger.setLevel(logging.WARNING)
+    stats = rounds_to_winner_stats(100, n_players, n_resources, n_rounds, betray_probabilities, max_rounds, max_seconds)
+    print(f"\nRounds to winner over {stats['games']} games: {stats}")
@@ -0,0 +1,217 @@
+#Opt-in profiling of the hot paths of a run.
+#Game.play_round, evaluation.calculate_metrics and graphic_generation (generate_plots, render_plots) report
+#the wall time of their phases to the active Profiler. Profiling is disabled by default: the instrumented
+#code only checks that `active` is None, so the overhead is a few comparisons per round.
+#
+#    with profile(trace=True, sample_every=100, track_memory=True) as profiler:
+#        run_simulation(...)
+#    print(profiler.format_summary())
+#    profiler.save_chrome_trace("trace.json")
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+#Profiler receiving the timings, or None when profiling is disabled.
+active = None
+
+'''
+#Class accumulating the wall time and call count of each phase.
+    trace: Also keep every timed interval, to export a Chrome trace (see chrome_trace).
+    sample_every: Record the Q-table size (and the traced memory) every sample_every rounds of Game.play_round.
+    Phases are named "<area>.<phase>", e.g. "play_round.choose_target" or "metrics.trust_decay_rate".
+'''
+class Profiler:
+    def __init__(self, trace=False, sample_every=None):
+        self.trace = trace
+        self.sample_every = sample_every
+        self.phases = {}
+        self.events = []
+        self.samples = []
+        self.origin = time.perf_counter()
+
+    #Method to read the clock used for the phases.
+    def clock(self):
+        return time.perf_counter()
+
+    #Method to add a timed interval to a phase.
+    def add(self, name, start, end):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = [0.0, 0]
+        phase[0] += end - start
+        phase[1] += 1
+        if self.trace:
+            self.events.append((name, start, end))
+
+    '''
+    #Method to add a duration measured elsewhere (e.g. in a worker process) to a phase.
+        It counts in the summary but not in the trace, whose clock is local to this process.
+    '''
+    def add_duration(self, name, seconds, calls=1):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = [0.0, 0]
+        phase[0] += seconds
+        phase[1] += calls
+
+    '''
+    #Method to close a phase started at `start` and start the next one.
+        Returns the current time, to be passed as the start of the next phase.
+    '''
+    def lap(self, name, start):
+        now = time.perf_counter()
+        self.add(name, start, now)
+        return now
+
+    #Context manager timing the enclosed block as one call of a phase.
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+
+    '''
+    #Method to record the Q-table size of a game and the traced memory (if tracemalloc is running).
+        game: A simulation_game.Game.
+        round_num: The round just played.
+    '''
+    def sample(self, game, round_num):
+        stats = game.q_table_stats()
+        self.samples.append({
+            "time": time.perf_counter(),
+            "round": round_num,
+            "q_table_states": stats["states"],
+            "memory_bytes": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+        })
+
+    '''
+    #Method to summarize the phases, the slowest first.
+        Returns a list of dictionaries with the phase name, calls, total and mean seconds, and the share of
+        the total time of its area (the part of the name before the first dot).
+    '''
+    def summary(self):
+        area_totals = {}
+        for name, (seconds, _) in self.phases.items():
+            area = name.split(".", 1)[0]
+            area_totals[area] = area_totals.get(area, 0.0) + seconds
+
+        rows = []
+        for name, (seconds, calls) in self.phases.items():
+            area_total = area_totals[name.split(".", 1)[0]]
+            rows.append({
+                "phase": name,
+                "calls": calls,
+                "total_seconds": seconds,
+                "mean_seconds": seconds / calls if calls else 0.0,
+                "share": seconds / area_total if area_total else 0.0,
+            })
+        rows.sort(key=lambda row: row["total_seconds"], reverse=True)
+        return rows
+
+    #Method to format the summary as a text table.
+    def format_summary(self):
+        lines = [f"{'phase':<48} {'calls':>10} {'total (s)':>12} {'mean (us)':>12} {'share':>7}"]
+        for row in self.summary():
+            lines.append(
+                f"{row['phase']:<48} {row['calls']:>10} {row['total_seconds']:>12.4f} "
+                f"{row['mean_seconds'] * 1e6:>12.2f} {row['share']:>7.1%}"
+            )
+        for sample in self.samples[-1:]:
+            memory = sample["memory_bytes"]
+            lines.append(
+                f"Q-table states at round {sample['round']}: {sample['q_table_states']}"
+                + ("" if memory is None else f", traced memory: {memory / (1 << 20):.1f} MiB")
+            )
+        return "\n".join(lines)
+
+    '''
+    #Method to export the timed intervals and the samples in the Chrome trace event format.
+        The JSON can be opened in chrome://tracing or https://ui.perfetto.dev. Intervals are complete ("X")
+        events and the samples are counter ("C") events, with timestamps in microseconds.
+    '''
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "cat": name.split(".", 1)[0],
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": 0,
+            }
+            for name, start, end in self.events
+        ]
+        for sample in self.samples:
+            values = {"q_table_states": sample["q_table_states"]}
+            if sample["memory_bytes"] is not None:
+                values["memory_bytes"] = sample["memory_bytes"]
+            events.append({
+                "name": "play_round.samples",
+                "ph": "C",
+                "ts": (sample["time"] - self.origin) * 1e6,
+                "pid": pid,
+                "args": values,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    #Method to save the Chrome trace to a JSON file.
+    def save_chrome_trace(self, path):
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+'''
+#Class with the Profiler methods used by the instrumented code, doing nothing.
+    Returned by current() when profiling is disabled, for code paths where a method call per phase is
+    negligible (metrics, figures). The per-player loop of Game.play_round checks `active` instead.
+'''
+class _NullProfiler:
+    def clock(self):
+        return None
+
+    def add(self, name, start, end):
+        pass
+
+    def add_duration(self, name, seconds, calls=1):
+        pass
+
+    def lap(self, name, start):
+        return None
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+_NULL_PROFILER = _NullProfiler()
+
+#Function to get the active Profiler, or a profiler doing nothing when profiling is disabled.
+def current():
+    return _NULL_PROFILER if active is None else active
+
+'''
+#Context manager enabling profiling for the enclosed block.
+    trace, sample_every: See Profiler.
+    track_memory: Run tracemalloc during the block, so the samples include the traced memory.
+        tracemalloc slows down every allocation, so the timings are less accurate with it.
+    Yields the Profiler, which keeps its results after the block.
+'''
+@contextmanager
+def profile(trace=False, sample_every=None, track_memory=False):
+    global active
+    previous = active
+    profiler = Profiler(trace, sample_every)
+    start_tracing = track_memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    active = profiler
+    try:
+        yield profiler
+    finally:
+        active = previous
+        if start_tracing:
+            tracemalloc.stop()
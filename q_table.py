@@ -0,0 +1,212 @@
+#Compact Q-table stores for simulation_game.Player.
+from collections import OrderedDict
+
+import numpy as np
+
+'''
+#Class storing Q-values as a contiguous (n_states, n_players) matrix.
+    Each state is interned into an integer row index the first time it is written. Column `player_id`
+    (the player's own column, never a betrayal target) holds the Q-value of cooperation, and every other
+    column holds the Q-value of betraying that player. States that were never written are not stored,
+    reading them returns the default row.
+'''
+class ArrayQTable:
+    '''
+    #Constructor for initializing the store.
+        player_id: ID of the player owning the table (its column stores cooperation).
+        n_players: Total number of players in the game.
+        betray_probability: Default Q-value for betrayal actions (cooperation defaults to 0.5).
+        initial_capacity: Number of rows allocated before the first growth.
+        dtype: Floating point type of the value matrix (default float32).
+        state_abstraction: Optional function mapping a raw state tuple to the key actually stored,
+            e.g. rank_abstraction or quantile_abstraction(n_buckets).
+    '''
+    def __init__(self, player_id, n_players, betray_probability, initial_capacity=64, dtype=np.float32,
+                 state_abstraction=None):
+        self.player_id = player_id
+        self.n_players = n_players
+        self.state_abstraction = state_abstraction
+
+        #Default row, matching the defaults of the dictionary Q-table.
+        self.default_row = np.full(n_players, betray_probability, dtype=dtype)
+        self.default_row[player_id] = 0.5
+        self.default_max = float(self.default_row.max())
+
+        #State interning index and value matrix, grown geometrically.
+        self.index = {}
+        self.values = np.empty((initial_capacity, n_players), dtype=dtype)
+
+        #Lookup statistics.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    #Size in bytes of the allocated value matrix.
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    #Fraction of lookups that found their state in the table.
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    #Method returning the size and lookup statistics of the table.
+    def stats(self):
+        return {
+            "states": len(self.index),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+    #Method to map an action (None for cooperation, str(target) for betrayal) to its column.
+    def column(self, action):
+        return self.player_id if action is None else int(action)
+
+    #Method to map a raw state to its stored key.
+    def key(self, state):
+        return state if self.state_abstraction is None else self.state_abstraction(state)
+
+    #Method to find the row of a key, recording a hit or a miss.
+    def _find(self, key):
+        row = self.index.get(key)
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._touch(key, row)
+        return row
+
+    #Hook called on every hit, used by eviction policies.
+    def _touch(self, key, row):
+        pass
+
+    #Method to reserve a row for a new key, doubling the capacity of the matrix when full.
+    def _allocate(self, key):
+        row = len(self.index)
+        if row == len(self.values):
+            grown = np.empty((2 * len(self.values), self.n_players), dtype=self.values.dtype)
+            grown[:row] = self.values
+            self.values = grown
+        return row
+
+    '''
+    #Method to get the row index of a state, interning it if needed.
+        New rows are initialized with the default Q-values.
+    '''
+    def intern(self, state):
+        key = self.key(state)
+        row = self._find(key)
+        if row is None:
+            row = self._allocate(key)
+            self.values[row] = self.default_row
+            self.index[key] = row
+        return row
+
+    #Method to get the Q-values of a state without interning it.
+    def row(self, state):
+        row = self._find(self.key(state))
+        return self.default_row if row is None else self.values[row]
+
+    #Method to get the highest Q-value of a state without interning it.
+    def max_value(self, state):
+        row = self._find(self.key(state))
+        return self.default_max if row is None else float(self.values[row].max())
+
+    #Method to convert a row of values into the dictionary format of the dictionary Q-table.
+    def _as_dict(self, values):
+        return {
+            None: float(values[self.player_id]),
+            **{str(target): float(values[target]) for target in range(self.n_players) if target != self.player_id},
+        }
+
+    '''
+    #Method returning the Q-values of a state as a dictionary, like the dictionary Q-table.
+        Keeps graphic_generation.get_betrayal_probability and Q-table dumps working.
+    '''
+    def __getitem__(self, state):
+        row = self.index.get(self.key(state))
+        return self._as_dict(self.default_row if row is None else self.values[row])
+
+    def __contains__(self, state):
+        return self.key(state) in self.index
+
+    #Iterate over the stored keys and their Q-values as dictionaries.
+    def items(self):
+        return ((key, self._as_dict(self.values[row])) for key, row in self.index.items())
+
+'''
+#Class storing at most `capacity` states, evicting the least recently (LRU) or least frequently (LFU)
+#used state when a new one is written. The value matrix is allocated once, so memory stays flat.
+'''
+class BoundedQTable(ArrayQTable):
+    '''
+    #Constructor for initializing the store.
+        capacity: Maximum number of stored states.
+        policy: Eviction policy, "lru" or "lfu".
+        The other arguments are the same as ArrayQTable.
+    '''
+    def __init__(self, player_id, n_players, betray_probability, capacity=1024, policy="lru",
+                 dtype=np.float32, state_abstraction=None):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+
+        super().__init__(
+            player_id, n_players, betray_probability,
+            initial_capacity=capacity, dtype=dtype, state_abstraction=state_abstraction,
+        )
+        self.capacity = capacity
+        self.policy = policy
+
+        #Keys in recency order (LRU), and per row key and use count (LFU).
+        self.index = OrderedDict()
+        self.row_keys = [None] * capacity
+        self.frequency = np.zeros(capacity, dtype=np.int64)
+
+    def _touch(self, key, row):
+        if self.policy == "lru":
+            self.index.move_to_end(key)
+        else:
+            self.frequency[row] += 1
+
+    #Method to reserve a row for a new key, evicting a stored state when the table is full.
+    def _allocate(self, key):
+        if len(self.index) < self.capacity:
+            row = len(self.index)
+        elif self.policy == "lru":
+            _, row = self.index.popitem(last=False)
+            self.evictions += 1
+        else:
+            row = int(np.argmin(self.frequency))
+            del self.index[self.row_keys[row]]
+            self.evictions += 1
+
+        self.row_keys[row] = key
+        self.frequency[row] = 1
+        return row
+
+'''
+#State abstraction keeping only the rank order of the players' points (ties share a rank).
+'''
+def rank_abstraction(state):
+    return tuple(np.unique(np.asarray(state), return_inverse=True)[1].tolist())
+
+'''
+#Function to build a state abstraction that buckets each player's points into n_buckets quantiles
+#of the points in the same state.
+'''
+def quantile_abstraction(n_buckets):
+    inner_quantiles = np.linspace(0, 1, n_buckets + 1)[1:-1]
+
+    def abstraction(state):
+        values = np.asarray(state)
+        edges = np.quantile(values, inner_quantiles)
+        return tuple(np.searchsorted(edges, values, side="right").tolist())
+
+    return abstraction
@@ -0,0 +1,230 @@
+#Content-addressed on-disk cache of simulation results.
+#An entry is keyed by a hash of the simulation parameters, the seed and the code version of the rule and
+#game engine, and holds the computed metrics and the recorded rounds. Re-running the same cell of a sweep
+#or the same article figure then only reads the cached results. The cache is bounded in size: the least
+#recently used entries are evicted first.
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import random
+import shutil
+import uuid
+
+import numpy as np
+
+from round_recorder import RoundRecorder
+from rules import get_rule, scenario_rule
+
+#Version of the entry layout, part of every key.
+CACHE_VERSION = 1
+
+#Modules whose code produces the cached values: the game engine and its backends, the rules and the metrics.
+ENGINE_MODULES = (
+    "simulation_game", "rules", "game2", "game2_vectorized", "betrayal_graph", "q_table", "strategies",
+    "game_kernel", "round_recorder", "evaluation", "evaluation_vectorized", "run_simulation_and_analysis",
+)
+
+#Hash of the sources of ENGINE_MODULES, computed once per process.
+_engine_version = None
+
+#Files of a cache entry.
+_PARAMS_FILE = "params.json"
+_METRICS_FILE = "metrics.pkl"
+_TRAJECTORY_FILE = "trajectory.npz"
+
+'''
+#Function to hash the sources of ENGINE_MODULES.
+    The files are read next to this module instead of imported, since run_simulation_and_analysis
+    loads matplotlib.
+'''
+def engine_version():
+    global _engine_version
+    if _engine_version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in ENGINE_MODULES:
+            with open(os.path.join(directory, f"{name}.py"), "rb") as file:
+                digest.update(name.encode())
+                digest.update(file.read())
+        _engine_version = digest.hexdigest()
+    return _engine_version
+
+'''
+#Function to compute the code version of a rule, as a hash of the code that produces the results.
+    play_turn_func: A rule function, a resolver built by rules.compile_rule or a rule object.
+    The hash covers the rule (its RuleSpec for compiled rules, its source otherwise) and the modules that
+    compute the cached values (see ENGINE_MODULES), so editing any of them invalidates the cached results.
+'''
+def code_version(play_turn_func):
+    spec = getattr(play_turn_func, "rule_spec", None)
+    if spec is not None:
+        rule_code = repr(spec)
+    elif inspect.isfunction(play_turn_func):
+        rule_code = inspect.getsource(play_turn_func)
+    else:
+        rule_code = inspect.getsource(type(play_turn_func))
+
+    digest = hashlib.sha256()
+    digest.update(rule_code.encode())
+    digest.update(engine_version().encode())
+    return digest.hexdigest()
+
+'''
+#Class managing the cache folder.
+    directory: Folder of the cache (created if needed). Each entry is a sub folder named by its key.
+    max_bytes: Maximum total size of the entries, enforced after every put (default 1 GiB).
+'''
+class ResultsCache:
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    '''
+    #Method to compute the key of a simulation.
+        params: Dictionary of JSON serializable parameters (n_players, n_resources, ...).
+        seed: Seed of the random module for the run.
+        play_turn_func: The rule of the game, whose code version is part of the key.
+    '''
+    def key(self, params, seed, play_turn_func):
+        content = json.dumps(
+            {"version": CACHE_VERSION, "params": params, "seed": seed, "code": code_version(play_turn_func)},
+            sort_keys=True,
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    #Method to get the folder of an entry.
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._path(key), _PARAMS_FILE))
+
+    '''
+    #Method to read an entry.
+        Returns (game_data, metrics), with game_data a RoundRecorder of the recorded rounds, or None on a miss.
+    '''
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, _METRICS_FILE), "rb") as file:
+                metrics = pickle.load(file)
+            with np.load(os.path.join(path, _TRAJECTORY_FILE)) as archive:
+                game_data = RoundRecorder.from_columns(
+                    archive["targets"], archive["points"], archive["turn_points"], archive["collapses"]
+                )
+            #The modification time of the parameters file orders the entries for eviction.
+            os.utime(os.path.join(path, _PARAMS_FILE))
+        except FileNotFoundError:
+            return None
+        return game_data, metrics
+
+    '''
+    #Method to write an entry, then evict entries until the cache fits in max_bytes.
+        The entry is written to a temporary folder and renamed, so readers never see a partial entry.
+    '''
+    def put(self, key, params, game_data, metrics):
+        temporary_path = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(temporary_path)
+
+        n_recorded = len(game_data)
+        np.savez_compressed(
+            os.path.join(temporary_path, _TRAJECTORY_FILE),
+            targets=game_data.targets[:n_recorded],
+            points=game_data.points[:n_recorded],
+            turn_points=game_data.turn_points[:n_recorded],
+            collapses=game_data.collapses[:n_recorded],
+        )
+        with open(os.path.join(temporary_path, _METRICS_FILE), "wb") as file:
+            pickle.dump(metrics, file)
+        with open(os.path.join(temporary_path, _PARAMS_FILE), "w") as file:
+            json.dump(params, file, sort_keys=True)
+
+        path = self._path(key)
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(temporary_path, path)
+        except OSError:
+            #Another process stored the same entry first.
+            shutil.rmtree(temporary_path, ignore_errors=True)
+        self.evict()
+
+    '''
+    #Method to list the entries with their size in bytes and last use time, oldest first.
+    '''
+    def entries(self):
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                last_use = os.stat(os.path.join(path, _PARAMS_FILE)).st_mtime
+            except FileNotFoundError:
+                continue
+            entries.append((last_use, key, size))
+        entries.sort()
+        return [(key, size, last_use) for last_use, key, size in entries]
+
+    #Total size in bytes of the entries.
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    #Method to remove the least recently used entries until the cache fits in max_bytes.
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+
+    #Method to remove every entry.
+    def clear(self):
+        for key, _, _ in self.entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+'''
+#Function to run a simulation through the cache.
+    cache: A ResultsCache, or None to always simulate.
+    seed: Seed of the random module for the run. Without a seed the run is not reproducible, so the
+        cache is not used.
+    The other arguments are the same as run_simulation_and_analysis.run_simulation.
+    Returns (game_data, metrics, hit), where hit tells whether the results came from the cache.
+'''
+def cached_run_simulation(cache, n_players, n_resources, n_rounds, betray_probabilities, simulation_type,
+                          seed, backend="python"):
+    #Imported here because run_simulation_and_analysis loads matplotlib.
+    from run_simulation_and_analysis import run_simulation
+
+    params = {
+        "n_players": n_players,
+        "n_resources": n_resources,
+        "n_rounds": n_rounds,
+        "betray_probabilities": [float(probability) for probability in betray_probabilities],
+        "simulation_type": simulation_type,
+        "backend": backend,
+    }
+    if seed is None:
+        cache = None
+    key = None
+    if cache is not None:
+        key = cache.key(params, seed, get_rule(scenario_rule(simulation_type)))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+    #Without a seed the run continues from the current state of the random module, like run_simulation
+    if seed is not None:
+        random.seed(seed)
+    game_data, metrics, _ = run_simulation(
+        n_players, n_resources, n_rounds, betray_probabilities, simulation_type, backend=backend
+    )
+    if cache is not None:
+        cache.put(key, params, game_data, metrics)
+    return game_data, metrics, False
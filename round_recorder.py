@@ -0,0 +1,168 @@
+#Columnar recorder for the rounds of a game, replacing the list of per-round dictionaries.
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+from betrayal_graph import BetrayalGraph
+
+#Value stored in the target matrix for cooperation.
+COOPERATE = -1
+
+#Function to build the dtype of one round stored as a fixed-width record (one field per column).
+def record_dtype(n_players):
+    return np.dtype([
+        ("targets", "<i2", (n_players,)),
+        ("points", "<i8", (n_players,)),
+        ("turn_points", "<i8", (n_players,)),
+        ("collapse", "?"),
+    ])
+
+'''
+#Class giving read-only dictionary access to one recorded round.
+    The "actions", "resources", "betrayals", "turn_points" and "collapse" entries are built from the
+    recorder columns only when accessed, in the same format as the round dictionaries of
+    run_simulation_and_analysis ("betrayals" is a betrayal_graph.BetrayalGraph, a read-only Mapping).
+'''
+class RoundView(Mapping):
+    _keys = ("round_num", "actions", "resources", "betrayals", "turn_points", "collapse")
+
+    def __init__(self, recorder, index):
+        self._recorder = recorder
+        self._index = index
+
+    def __getitem__(self, key):
+        recorder, index = self._recorder, self._index
+        if key == "round_num":
+            return index + 1
+        if key == "actions":
+            return {
+                str(player): None if target == COOPERATE else str(target)
+                for player, target in enumerate(recorder.targets[index].tolist())
+            }
+        if key == "resources":
+            return {str(player): points for player, points in enumerate(recorder.points[index].tolist())}
+        if key == "turn_points":
+            return {str(player): points for player, points in enumerate(recorder.turn_points[index].tolist())}
+        if key == "betrayals":
+            return BetrayalGraph.from_targets(recorder.targets[index])
+        if key == "collapse":
+            return bool(recorder.collapses[index])
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+'''
+#Class recording the rounds of a game in preallocated NumPy columns.
+    targets: int16 (rounds, players) matrix with the betrayed player of each player (-1 for cooperation).
+    points: int64 (rounds, players) matrix with the total points after each round.
+    turn_points: int64 (rounds, players) matrix with the points gained in each round.
+    collapses: bool vector flagging the rounds with a system collapse.
+    The recorder behaves like the list of round dictionaries (len, indexing, iteration).
+'''
+class RoundRecorder(Sequence):
+    '''
+    #Constructor to preallocate the columns.
+        n_rounds: Number of rounds to preallocate (the columns double if more rounds are recorded).
+        n_players: Total number of players in the game (at most 32767).
+    '''
+    def __init__(self, n_rounds, n_players):
+        self.n_players = n_players
+        self.targets = np.full((n_rounds, n_players), COOPERATE, dtype=np.int16)
+        self.points = np.zeros((n_rounds, n_players), dtype=np.int64)
+        self.turn_points = np.zeros((n_rounds, n_players), dtype=np.int64)
+        self.collapses = np.zeros(n_rounds, dtype=bool)
+        self.n_recorded = 0
+
+    '''
+    #Method to build a recorder over existing columns without copying them, e.g. a range of rounds
+    #of a trajectory_store.TrajectoryStore. Every given round counts as recorded.
+    '''
+    @classmethod
+    def from_columns(cls, targets, points, turn_points, collapses):
+        recorder = cls.__new__(cls)
+        recorder.n_players = targets.shape[1]
+        recorder.targets = targets
+        recorder.points = points
+        recorder.turn_points = turn_points
+        recorder.collapses = collapses
+        recorder.n_recorded = len(collapses)
+        return recorder
+
+    #Method to double the capacity of every column.
+    def _grow(self):
+        capacity = max(1, 2 * len(self.collapses))
+        for name in ("targets", "points", "turn_points", "collapses"):
+            column = getattr(self, name)
+            grown = np.full((capacity,) + column.shape[1:], COOPERATE if name == "targets" else 0, dtype=column.dtype)
+            grown[: len(column)] = column
+            setattr(self, name, grown)
+
+    '''
+    #Method to record a round from arrays.
+        targets: The betrayed player of each player (-1 for cooperation).
+        points: The total points after the round (copied, so later changes do not alias).
+        turn_points: The points gained in the round.
+        collapse: Whether a system collapse occurred.
+    '''
+    def record_arrays(self, targets, points, turn_points, collapse):
+        if self.n_recorded == len(self.collapses):
+            self._grow()
+        index = self.n_recorded
+        self.targets[index] = targets
+        self.points[index] = points
+        self.turn_points[index] = turn_points
+        self.collapses[index] = collapse
+        self.n_recorded += 1
+
+    '''
+    #Method to record a block of rounds from (rounds, players) arrays, e.g. the output of
+    #game_kernel.play_rounds.
+    '''
+    def record_rounds(self, targets, points, turn_points, collapses):
+        n_rounds = len(collapses)
+        while self.n_recorded + n_rounds > len(self.collapses):
+            self._grow()
+        block = slice(self.n_recorded, self.n_recorded + n_rounds)
+        self.targets[block] = targets
+        self.points[block] = points
+        self.turn_points[block] = turn_points
+        self.collapses[block] = collapses
+        self.n_recorded += n_rounds
+
+    '''
+    #Method to record a round returned by simulation_game.Game.play_round.
+        round_result: The dictionary with the actions, resources, turn points and collapse flag of the round.
+    '''
+    def record(self, round_result):
+        self.record_arrays(
+            [COOPERATE if action is None else int(action) for action in round_result["actions"].values()],
+            list(round_result["resources"].values()),
+            list(round_result["turn_points"].values()),
+            round_result["collapse"],
+        )
+
+    def __len__(self):
+        return self.n_recorded
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.n_recorded))]
+        if index < 0:
+            index += self.n_recorded
+        if not 0 <= index < self.n_recorded:
+            raise IndexError("round index out of range")
+        return RoundView(self, index)
+
+    #Method returning the total points of each player at every round, keyed by player ID.
+    def resources_over_time(self):
+        points = self.points[: self.n_recorded]
+        return {str(player): points[:, player].tolist() for player in range(self.n_players)}
+
+    #Size in bytes of the recorded columns.
+    @property
+    def nbytes(self):
+        return self.targets.nbytes + self.points.nbytes + self.turn_points.nbytes + self.collapses.nbytes
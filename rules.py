@@ -0,0 +1,419 @@
+#Registry of declarative rule specs for the game2 rule variants.
+#Every play_turn* function of game2 is the same skeleton with a few differences, described by a RuleSpec.
+#A spec is compiled once into a resolver, either scalar (game2 dictionary interface) or vectorized
+#(game2_vectorized array interface), so new scenarios only need a new spec.
+from collections import defaultdict
+
+import numpy as np
+
+import game2
+from betrayal_graph import BetrayalGraph
+from game2_vectorized import (
+    COOPERATE,
+    Sim5Rule,
+    _as_flag,
+    _exchange_points,
+    _first_collapse_masks,
+    _gather,
+    betrayal_counts,
+)
+
+'''
+#Class describing a rule variant.
+    threshold: A player betrayed more than threshold times collapses the system, either a number
+        or "resources" to use the resources of the turn.
+    involved: Who is affected by a collapse: "everyone", "betrayers" or "target_and_betrayers".
+    total_effect: What happens to the total points of the involved players: "keep", "halve" or "zero".
+    first_collapse_only: Only the first collapsed target (in betrayal order) is resolved (the `break`).
+    reward_victim: The collapsed target gains resources times its number of betrayers.
+    betrayer_penalty: Points lost per past collapse by a betrayer (None for no betrayer history).
+    default_resources: Default resources of the turn.
+'''
+class RuleSpec:
+    def __init__(self, threshold, involved, total_effect, first_collapse_only=True, reward_victim=False,
+                 betrayer_penalty=None, default_resources=2):
+        if involved not in ("everyone", "betrayers", "target_and_betrayers"):
+            raise ValueError(f"Unknown involved players: {involved}")
+        if total_effect not in ("keep", "halve", "zero"):
+            raise ValueError(f"Unknown total effect: {total_effect}")
+
+        self.threshold = threshold
+        self.involved = involved
+        self.total_effect = total_effect
+        self.first_collapse_only = first_collapse_only
+        self.reward_victim = reward_victim
+        self.betrayer_penalty = betrayer_penalty
+        self.default_resources = default_resources
+
+    def __repr__(self):
+        return (
+            f"RuleSpec(threshold={self.threshold!r}, involved={self.involved!r}, "
+            f"total_effect={self.total_effect!r}, first_collapse_only={self.first_collapse_only}, "
+            f"reward_victim={self.reward_victim}, betrayer_penalty={self.betrayer_penalty}, "
+            f"default_resources={self.default_resources})"
+        )
+
+#Specs of the game2 rule functions, keyed by function name.
+RULE_SPECS = {
+    "play_turn": RuleSpec(2, "everyone", "halve"),
+    "play_turn_sim2": RuleSpec(2, "target_and_betrayers", "keep"),
+    "play_turn_sim3": RuleSpec(2, "betrayers", "halve"),
+    "play_turn_sim4": RuleSpec(2, "target_and_betrayers", "keep", reward_victim=True),
+    "play_turn_sim5": RuleSpec(
+        2, "target_and_betrayers", "keep", reward_victim=True, betrayer_penalty=5, default_resources=10
+    ),
+    "play_turn_v2": RuleSpec("resources", "everyone", "zero", default_resources=1),
+    "play_turn_sim2_v2": RuleSpec(
+        "resources", "betrayers", "zero", first_collapse_only=False, default_resources=1
+    ),
+}
+
+#Rule used by each simulation_type of run_simulation_and_analysis.
+SCENARIOS = {
+    1: "play_turn_v2",
+    2: "play_turn_sim2_v2",
+}
+
+#Compiled resolvers, keyed by (rule name, vectorized, sparse).
+_compiled = {}
+
+#Functions applying the total effect of a collapse to a single total.
+_SCALAR_EFFECTS = {
+    "keep": lambda total: total,
+    "halve": lambda total: max(0, total // 2),
+    "zero": lambda total: 0,
+}
+
+#Functions applying the total effect of a collapse to the totals of the involved players.
+def _keep_totals(total_points, involved):
+    pass
+
+def _halve_totals(total_points, involved):
+    total_points[involved] = np.maximum(total_points[involved] // 2, 0)
+
+def _zero_totals(total_points, involved):
+    total_points[involved] = 0
+
+_VECTOR_EFFECTS = {"keep": _keep_totals, "halve": _halve_totals, "zero": _zero_totals}
+
+'''
+#Function to compile a spec into a resolver with the game2 dictionary interface:
+#    (player_actions, total_points=None, resources, betrayer_counts=None) -> (result, total_points, betrayals, collapse_occurred)
+    betrayer_counts is the betrayer history of the game ({player: collapses}, updated in place), required by
+    specs with a betrayer_penalty. get_rule wraps those resolvers in a PenaltyRule holding its own history.
+'''
+def _compile_scalar(spec):
+    apply_effect = _SCALAR_EFFECTS[spec.total_effect]
+    everyone = spec.involved == "everyone"
+    include_target = spec.involved == "target_and_betrayers"
+    penalty = spec.betrayer_penalty
+
+    def resolve(player_actions, total_points=None, resources=spec.default_resources, betrayer_counts=None):
+        if total_points is None:
+            total_points = {player: 0 for player in player_actions.keys()}
+        if penalty is not None and betrayer_counts is None:
+            raise ValueError("A rule with a betrayer penalty needs the betrayer_counts of the game")
+
+        if penalty is None:
+            turn_points = {player: resources for player in player_actions.keys()}
+        else:
+            turn_points = {
+                player: max(resources - betrayer_counts.get(player, 0) * penalty, 0)
+                for player in player_actions.keys()
+            }
+
+        betrayals = defaultdict(list)
+        for player, action in player_actions.items():
+            if action is not None:
+                betrayals[action].append(player)
+
+        #Find the collapsed targets, in betrayal order.
+        threshold = resources if spec.threshold == "resources" else spec.threshold
+        collapsed = []
+        for player, betrayers in betrayals.items():
+            if len(betrayers) > threshold:
+                collapsed.append(player)
+                if spec.first_collapse_only:
+                    break
+        collapse_occurred = bool(collapsed)
+
+        #Players involved in the collapse.
+        involved = set()
+        if everyone and collapse_occurred:
+            involved.update(turn_points)
+        for target in collapsed:
+            if penalty is not None:
+                for betrayer in betrayals[target]:
+                    betrayer_counts[betrayer] = betrayer_counts.get(betrayer, 0) + 1
+            if not everyone:
+                involved.update(betrayals[target])
+                if include_target:
+                    involved.add(target)
+
+        #Involved players gain nothing, the others exchange points as usual.
+        for player, action in player_actions.items():
+            if player in involved:
+                turn_points[player] = 0
+                total_points[player] = apply_effect(total_points[player])
+                continue
+
+            if action is None:
+                continue
+
+            turn_points[player] += 1
+            if action not in involved:
+                turn_points[action] -= 1
+
+        if spec.reward_victim:
+            for target in collapsed:
+                turn_points[target] = resources * len(betrayals[target])
+
+        for player in turn_points:
+            total_points[player] += turn_points[player]
+
+        result = {
+            player: (player_actions[player], turn_points[player], total_points[player])
+            for player in player_actions.keys()
+        }
+
+        return result, total_points, betrayals, collapse_occurred
+
+    return resolve
+
+'''
+#Function to compile a spec into a resolver with the game2_vectorized array interface:
+#    (targets, total_points=None, resources, times_betrayers=None) -> (turn_points, total_points, counts, collapse_occurred)
+    Works on (n_players,) and (n_games, n_players) arrays. times_betrayers is only used by specs with a
+    betrayer_penalty and is updated in place (zeros if not provided).
+'''
+def _compile_vectorized(spec):
+    apply_effect = _VECTOR_EFFECTS[spec.total_effect]
+    involved_kind = spec.involved
+    penalty = spec.betrayer_penalty
+
+    #Collapsed targets and their betrayers, for the first collapse or for all of them.
+    if spec.first_collapse_only:
+        def find_collapses(targets, counts, threshold):
+            _, collapsed, betrayers = _first_collapse_masks(targets, counts, threshold)
+            return collapsed, betrayers
+    else:
+        def find_collapses(targets, counts, threshold):
+            collapsed = counts > threshold
+            return collapsed, _gather(collapsed, targets) & (targets >= 0)
+
+    def resolve(targets, total_points=None, resources=spec.default_resources, times_betrayers=None):
+        if total_points is None:
+            total_points = np.zeros(targets.shape, dtype=np.int64)
+
+        threshold = resources if spec.threshold == "resources" else spec.threshold
+        counts = betrayal_counts(targets)
+        collapsed, betrayers = find_collapses(targets, counts, threshold)
+        collapse_occurred = collapsed.any(axis=-1)
+
+        if penalty is None:
+            turn_points = np.full(targets.shape, resources, dtype=np.int64)
+        else:
+            if times_betrayers is None:
+                times_betrayers = np.zeros(targets.shape, dtype=np.int64)
+            turn_points = np.maximum(resources - times_betrayers * penalty, 0).astype(np.int64)
+            times_betrayers += betrayers
+
+        if involved_kind == "everyone":
+            involved = np.broadcast_to(collapse_occurred[..., None], targets.shape).copy()
+        elif involved_kind == "betrayers":
+            involved = betrayers
+        else:
+            involved = betrayers | collapsed
+
+        turn_points = _exchange_points(targets, turn_points, involved)
+        turn_points[involved] = 0
+        apply_effect(total_points, involved)
+
+        if spec.reward_victim:
+            turn_points[collapsed] = resources * counts[collapsed]
+
+        total_points += turn_points
+        return turn_points, total_points, counts, _as_flag(collapse_occurred)
+
+    return resolve
+
+'''
+#Function to compile a spec into a resolver working on the sparse betrayal graph of a turn:
+#    (graph, total_points=None, resources, times_betrayers=None) -> (turn_points, total_points, in_degree, collapse_occurred)
+    graph: A betrayal_graph.BetrayalGraph (or a target array, converted to one).
+    Collapses are found with the in-degree counters and the exchange only visits the betrayals, so apart
+    from filling the (n_players,) point arrays the cost scales with the number of betrayals.
+    Gives the same results as the vectorized resolver on a single game.
+'''
+def _compile_sparse(spec):
+    apply_effect = _VECTOR_EFFECTS[spec.total_effect]
+    involved_kind = spec.involved
+    penalty = spec.betrayer_penalty
+
+    def resolve(graph, total_points=None, resources=spec.default_resources, times_betrayers=None):
+        if not isinstance(graph, BetrayalGraph):
+            graph = BetrayalGraph.from_targets(graph)
+        n_players = graph.n_players
+        if total_points is None:
+            total_points = np.zeros(n_players, dtype=np.int64)
+
+        #Edges of the collapsed targets.
+        threshold = resources if spec.threshold == "resources" else spec.threshold
+        if spec.first_collapse_only:
+            collapsed_target = graph.first_collapsed(threshold)
+            collapse_edges = graph.targets == collapsed_target
+            collapsed_targets = [] if collapsed_target < 0 else [collapsed_target]
+        else:
+            collapse_edges = graph.in_degree[graph.targets] > threshold
+            collapsed_targets = np.flatnonzero(graph.in_degree > threshold)
+        collapse_occurred = len(collapsed_targets) > 0
+        collapse_betrayers = graph.betrayers[collapse_edges]
+
+        if penalty is None:
+            turn_points = np.full(n_players, resources, dtype=np.int64)
+        else:
+            if times_betrayers is None:
+                times_betrayers = np.zeros(n_players, dtype=np.int64)
+            turn_points = np.maximum(resources - times_betrayers * penalty, 0).astype(np.int64)
+            times_betrayers[collapse_betrayers] += 1
+
+        involved = np.full(n_players, involved_kind == "everyone" and collapse_occurred)
+        if involved_kind != "everyone":
+            involved[collapse_betrayers] = True
+            if involved_kind == "target_and_betrayers":
+                involved[collapsed_targets] = True
+
+        #Betrayers not involved gain a point, taken from their target unless it is involved.
+        active = ~involved[graph.betrayers]
+        turn_points[graph.betrayers[active]] += 1
+        losing = graph.targets[active & ~involved[graph.targets]]
+        np.subtract.at(turn_points, losing, 1)
+        turn_points[involved] = 0
+        apply_effect(total_points, involved)
+
+        if spec.reward_victim:
+            turn_points[collapsed_targets] = resources * graph.in_degree[collapsed_targets]
+
+        total_points += turn_points
+        return turn_points, total_points, graph.in_degree, collapse_occurred
+
+    return resolve
+
+'''
+#Class giving a scalar resolver with a betrayer penalty its own betrayer history, so every game (or
+#thread) using its own instance is independent of the others and of game2.times_betrayers.
+    spec: The RuleSpec of the rule.
+    resolver: The scalar resolver compiled from spec.
+    It has the game2 dictionary interface, so an instance can be used as the play_turn_func of a Game.
+'''
+class PenaltyRule:
+    def __init__(self, spec, resolver):
+        self.rule_spec = spec
+        self.resolver = resolver
+        self.betrayer_counts = {}
+
+    def __call__(self, player_actions, total_points=None, resources=None, betrayer_counts=None):
+        if resources is None:
+            resources = self.rule_spec.default_resources
+        if betrayer_counts is None:
+            betrayer_counts = self.betrayer_counts
+        return self.resolver(player_actions, total_points, resources, betrayer_counts)
+
+    def __repr__(self):
+        return f"PenaltyRule({self.rule_spec!r})"
+
+'''
+#Function to compile a spec into a resolver.
+    spec: The RuleSpec to compile.
+    vectorized: Build the array resolver instead of the dictionary one.
+    sparse: Build the betrayal graph resolver (see _compile_sparse) instead of the dictionary one.
+'''
+def compile_rule(spec, vectorized=False, sparse=False):
+    if vectorized and sparse:
+        raise ValueError("A resolver is either vectorized or sparse")
+    if sparse:
+        resolver = _compile_sparse(spec)
+    else:
+        resolver = _compile_vectorized(spec) if vectorized else _compile_scalar(spec)
+
+    #The spec stays attached to the resolver, so other backends (see game_kernel) can rebuild the rule.
+    resolver.rule_spec = spec
+    return resolver
+
+'''
+#Function to add a rule variant to the registry.
+    name: Name of the rule.
+    spec: Its RuleSpec.
+'''
+def register_rule(name, spec):
+    RULE_SPECS[name] = spec
+    for key in [key for key in _compiled if key[0] == name]:
+        del _compiled[key]
+
+'''
+#Function to get the compiled resolver of a registered rule (compiled once and cached).
+    name: Name of the rule in RULE_SPECS.
+    vectorized: Return the array resolver instead of the dictionary one.
+    sparse: Return the betrayal graph resolver instead of the dictionary one.
+    The dictionary resolver of a rule with a betrayer penalty is returned in a new PenaltyRule at every call,
+    so each game gets its own betrayer history (the array resolvers take it as an argument).
+'''
+def get_rule(name, vectorized=False, sparse=False):
+    if name not in RULE_SPECS:
+        raise ValueError(f"Unknown rule: {name}")
+    key = (name, vectorized, sparse)
+    if key not in _compiled:
+        _compiled[key] = compile_rule(RULE_SPECS[name], vectorized, sparse)
+    if RULE_SPECS[name].betrayer_penalty is not None and not vectorized and not sparse:
+        return PenaltyRule(RULE_SPECS[name], _compiled[key])
+    return _compiled[key]
+
+#Function to get the rule name of a simulation_type.
+def scenario_rule(simulation_type):
+    if simulation_type not in SCENARIOS:
+        raise ValueError(f"Unknown simulation type: {simulation_type}")
+    return SCENARIOS[simulation_type]
+
+'''
+#Function to build a batch-ready rule for BatchGame.
+    Rules with a betrayer history get a Sim5Rule holding the (n_games, n_players) state.
+'''
+def batch_rule(name, n_games, n_players):
+    spec = RULE_SPECS[name]
+    resolver = get_rule(name, vectorized=True)
+    if spec.betrayer_penalty is None:
+        return resolver
+    return Sim5Rule((n_games, n_players), multiplier=spec.betrayer_penalty, resolver=resolver)
+
+'''
+#Function to find the RuleSpec and betrayer history of the play_turn_func of a Game.
+    Accepts the game2 rules, resolvers built by compile_rule, PenaltyRule and Sim5Rule instances.
+    Returns the spec, the betrayer history array and a function writing that array back.
+'''
+def rule_state(play_turn_func, n_players):
+    if isinstance(play_turn_func, Sim5Rule):
+        spec = getattr(play_turn_func.resolver, "rule_spec", None)
+        if spec is None:
+            spec = RuleSpec(
+                2, "target_and_betrayers", "keep", reward_victim=True,
+                betrayer_penalty=play_turn_func.multiplier, default_resources=10,
+            )
+        return spec, play_turn_func.times_betrayers, lambda times_betrayers: None
+
+    spec = getattr(play_turn_func, "rule_spec", None)
+    name = getattr(play_turn_func, "__name__", None)
+    if spec is None and getattr(game2, str(name), None) is play_turn_func:
+        spec = RULE_SPECS.get(name)
+    if spec is None:
+        raise ValueError(f"Unknown rule: {play_turn_func!r}")
+
+    #PenaltyRule instances keep their own betrayer history, the game2 rules keep it in game2.times_betrayers.
+    counts = getattr(play_turn_func, "betrayer_counts", game2.times_betrayers)
+    times_betrayers = np.array([counts.get(str(i), 0) for i in range(n_players)], dtype=np.int64)
+
+    def store(times_betrayers):
+        for i, times in enumerate(times_betrayers.tolist()):
+            if times or str(i) in counts:
+                counts[str(i)] = times
+
+    return spec, times_betrayers, store
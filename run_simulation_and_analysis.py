@@ -1,50 +1,112 @@
 import numpy as np
 from simulation_game import Game
-from game2 import play_turn_v2, play_turn_sim2_v2, play_turn, play_turn_sim2
-from evaluation import calculate_metrics
-from graphic_generation import generate_plots
+from rules import get_rule, scenario_rule
+from evaluation import MetricsAccumulator
+from evaluation_vectorized import calculate_metrics_from_arrays
+from game_kernel import play_rounds
+from checkpoint import load_checkpoint, save_checkpoint
+from round_recorder import RoundRecorder
+from trajectory_store import TrajectoryStore
+from results_cache import ResultsCache, cached_run_simulation
+from graphic_generation import generate_plots, render_plots
+import profiling
 import matplotlib.pyplot as plt
 import os
 
-def run_simulation_and_analysis(
-    n_players, n_resources, n_rounds, betray_probabilities, simulation_type
-):
-    #Choose the appropriate play_turn function based on simulation_type
-    if simulation_type == 1:
-        play_turn_func = play_turn_v2
-    elif simulation_type == 2:
-        play_turn_func = play_turn_sim2_v2
-
-    #Run simulation
+'''
+#Function to run a simulation and calculate its metrics, without generating plots.
+    backend: "python" plays the rounds with Game.play_round, "kernel" plays them with
+        game_kernel.play_rounds (same results for the same seed, computed with the vectorized metrics).
+    checkpoint_path: Optional .npz file used to resume and checkpoint the run (see checkpoint.py).
+        If it exists, the run continues from the saved round with the saved random state.
+    checkpoint_every: Save a checkpoint every checkpoint_every rounds (default: only at the end).
+    trajectory_path: Optional file where the rounds are streamed (see trajectory_store.py) instead of
+        being kept in memory. The returned game data is then the open TrajectoryStore.
+    Returns the game data, the metrics and the game instance.
+'''
+def run_simulation(n_players, n_resources, n_rounds, betray_probabilities, simulation_type, backend="python",
+                   checkpoint_path=None, checkpoint_every=None, trajectory_path=None):
+    if backend not in ("python", "kernel"):
+        raise ValueError(f"Unknown backend: {backend}")
+
+    #Choose the appropriate play_turn function based on simulation_type (see rules.SCENARIOS)
+    play_turn_func = get_rule(scenario_rule(simulation_type))
+
+    #Run simulation, recording every round in preallocated columns
     game_instance = Game(n_players, n_resources, betray_probabilities, play_turn_func)
-    game_data = []
-    resources_over_time = {str(i): [] for i in range(n_players)}
-
-    for round_num in range(1, n_rounds + 1):
-        round_result = game_instance.play_round(round_num)
-        game_data.append(
-            {
-                "round_num": round_num,
-                "actions": round_result["actions"],
-                "resources": round_result["resources"],
-                "betrayals": round_result["betrayals"],
-            }
-        )
+    resume = checkpoint_path is not None and os.path.exists(checkpoint_path)
+    if trajectory_path is None:
+        game_data = RoundRecorder(n_rounds, n_players)
+    elif resume:
+        game_data = TrajectoryStore(trajectory_path, "a")
+    else:
+        #Rounds are streamed to a memory-mapped file, with the parameters of the run in its header
+        game_data = TrajectoryStore(trajectory_path, "w", n_players, metadata={
+            "n_players": n_players,
+            "n_resources": n_resources,
+            "n_rounds": n_rounds,
+            "betray_probabilities": [float(probability) for probability in betray_probabilities],
+            "simulation_type": simulation_type,
+        })
+
+    #Resume from the checkpoint if there is one. A trajectory file already holds the saved rounds,
+    #and may hold rounds played after the checkpoint, which are dropped.
+    first_round = 1
+    if resume and trajectory_path is None:
+        first_round = load_checkpoint(checkpoint_path, game_instance, game_data)
+    elif resume:
+        first_round = load_checkpoint(checkpoint_path, game_instance)
+        game_data.truncate(first_round - 1)
+
+    #Metrics are accumulated online while the rounds are played, except for checkpointed runs, which
+    #compute them from the recorded rounds so a resumed run gives the same metrics as an uninterrupted one
+    accumulator = MetricsAccumulator() if backend == "python" and checkpoint_path is None else None
+
+    #The rounds are played in blocks that end on a checkpoint (or on a growth of the trajectory file)
+    block_size = checkpoint_every or (n_rounds if trajectory_path is None else game_data.chunk_rounds)
+    round_num = first_round
+    while round_num <= n_rounds:
+        last_round = min(n_rounds, (round_num - 1) // block_size * block_size + block_size)
+
+        if backend == "kernel":
+            #The whole block is played over flat arrays
+            with profiling.current().phase("play_round.kernel"):
+                rounds = play_rounds(game_instance, last_round - round_num + 1, round_num)
+            game_data.record_rounds(rounds["targets"], rounds["points"], rounds["turn_points"], rounds["collapses"])
+        else:
+            for block_round in range(round_num, last_round + 1):
+                round_result = game_instance.play_round(block_round)
+                game_data.record(round_result)
+                if accumulator is not None:
+                    accumulator.update(round_result)
+
+        if trajectory_path is not None:
+            game_data.flush()
+        if checkpoint_path is not None:
+            save_checkpoint(
+                checkpoint_path, game_instance, last_round + 1, game_data if trajectory_path is None else None
+            )
+        round_num = last_round + 1
 
-        #Collect resources for each player at every round
-        for player_id, resources in round_result["resources"].items():
-            resources_over_time[player_id].append(resources)
+    #Calculate metrics (the accumulator times each metric itself)
+    if accumulator is not None:
+        metrics = accumulator.finalize()
+    else:
+        with profiling.current().phase("metrics.finalize"):
+            n_recorded = len(game_data)
+            metrics = calculate_metrics_from_arrays(game_data.targets[:n_recorded], game_data.points[:n_recorded])
 
-    #Calculate metrics
-    metrics = calculate_metrics(game_data)
-    metrics["resources_over_time"] = resources_over_time
+    #Collect resources for each player at every round
+    metrics["resources_over_time"] = game_data.resources_over_time()
 
-    #Debug print statements
-    print("Debug: Metrics after calculation:")
-    print(f"Best player: {metrics['best_player']}")
-    print(f"Worst player: {metrics['worst_player']}")
-    print(f"Best player data: {metrics['best_player_data']}")
-    print(f"Worst player data: {metrics['worst_player_data']}")
+    return game_data, metrics, game_instance
+
+def run_simulation_and_analysis(
+    n_players, n_resources, n_rounds, betray_probabilities, simulation_type
+):
+    game_data, metrics, game_instance = run_simulation(
+        n_players, n_resources, n_rounds, betray_probabilities, simulation_type
+    )
 
     #Generate plots
     plots = generate_plots(metrics, n_rounds, game_instance, game_data)
@@ -52,6 +114,22 @@ def run_simulation_and_analysis(
     #Add resources_over_time to the returned values
     return game_data, metrics, plots
 
+'''
+#Function to save the generated plots as PNG files.
+    plots: A dictionary of figures keyed by plot name.
+    path: The folder where the plots are saved (created if needed).
+'''
+def save_plots(plots, path):
+    os.makedirs(path, exist_ok=True)
+
+    for name, fig in plots.items():
+        fig.savefig(
+            os.path.join(path, f"{name}_plot.png"),
+            dpi=300,
+            bbox_inches="tight",
+        )
+        plt.close(fig)  #Close the figure to free up memory
+
 if __name__ == "__main__":
     #Set simulation parameters
     n_players = 6
@@ -64,9 +142,15 @@ if __name__ == "__main__":
     #betray_probabilities = [1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
     scenarios = [1, 2]
 
+    #Seed of the runs. With a seed, the results are cached and reused while the parameters and code do not change
+    seed = None
+
     #Get the current script directory
     current_dir = os.path.dirname(os.path.abspath(__file__))
 
+    #Results cache next to the script
+    cache = ResultsCache(os.path.join(current_dir, ".results_cache"))
+
     #Define the folder name for saving graphics
     graphics_folder = os.path.join(current_dir, 'images')
 
@@ -74,23 +158,15 @@ if __name__ == "__main__":
     os.makedirs(graphics_folder, exist_ok=True)
 
     for scenario in scenarios:
-        #Run simulation and analysis
-        game_data, metrics, plots = run_simulation_and_analysis(
-            n_players, n_resources, n_rounds, betray_probabilities, scenario
+        #Run simulation and analysis (read from the cache when the same run was already done)
+        game_data, metrics, _ = cached_run_simulation(
+            cache, n_players, n_resources, n_rounds, betray_probabilities, scenario, seed
         )
 
         scenario_path = os.path.join(graphics_folder, f"scenario_{scenario}")
 
-        os.makedirs(scenario_path, exist_ok=True)
-
-        #Save plots
-        for name, fig in plots.items():
-            fig.savefig(
-                os.path.join(scenario_path, f"{name}_plot.png"),
-                dpi=300,
-                bbox_inches="tight",
-            )
-            plt.close(fig)  #Close the figure to free up memory
+        #Build and save the plots in parallel worker processes
+        render_plots(metrics, n_rounds, game_data, scenario_path)
 
         print(f"\nPlots have been saved in: {scenario_path}")
 
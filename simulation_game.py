@@ -3,7 +3,13 @@
 #deque: Used to efficiently append and pop from both ends of a collection.
 import numpy as np
 import random
+import time
 from collections import defaultdict, deque
+from q_table import ArrayQTable
+from betrayal_graph import BetrayalGraph
+from strategies import Population, StrategyInputs
+from rules import compile_rule, rule_state
+import profiling
 
 #Class representing a Player in the game.
 class Player:
@@ -14,8 +20,13 @@ class Player:
         betray_probability: Probability of betraying another player.
         alpha: Learning rate for Q-learning algorithm (default 1.0).
         gamma: Discount factor for future rewards in Q-learning (default 0.01).
+        compact_q_table: Store Q-values in an ArrayQTable instead of a dictionary (default False).
+        q_table_factory: Optional function (id, n_players, betray_probability) -> Q-table store,
+            e.g. functools.partial(BoundedQTable, capacity=256, policy="lfu"). Overrides compact_q_table.
+        history_length: Number of past interactions remembered per target (default None, unbounded).
     '''
-    def __init__(self, id, n_players, betray_probability, alpha=1.0, gamma=0.01):
+    def __init__(self, id, n_players, betray_probability, alpha=1.0, gamma=0.01, compact_q_table=False,
+                 q_table_factory=None, history_length=None):
         #Assign unique player ID and number of players in the game.
         self.id = id
         self.n_players = n_players
@@ -29,19 +40,35 @@ class Player:
             The state is represented as a dictionary with keys being player IDs (actions) and values being Q-values.
             Default Q-value for cooperation (None) is set to 0.5, and for betrayal, it's based on betray_probability.
         '''
-        self.q_table = defaultdict(
-            lambda: {
-                None: 0.5,
-                **{
-                    str(target): betray_probability * 1.0
-                    for target in range(n_players)
-                    if target != self.id
-                },
-            }
-        )
+        if q_table_factory is not None:
+            self.q_table = q_table_factory(id, n_players, betray_probability)
+        elif compact_q_table:
+            #Interned states and a float32 value matrix, see q_table.ArrayQTable.
+            self.q_table = ArrayQTable(id, n_players, betray_probability)
+        else:
+            self.q_table = defaultdict(
+                lambda: {
+                    None: 0.5,
+                    **{
+                        str(target): betray_probability * 1.0
+                        for target in range(n_players)
+                        if target != self.id
+                    },
+                }
+            )
         
         #History of player actions, stored using a deque to efficiently track past actions.
-        self.history = defaultdict(lambda: deque())
+        #With history_length, only the most recent interactions with each target are kept.
+        self.history = defaultdict(lambda: deque(maxlen=history_length))
+
+        #Running number of betrayals in the history of each target, in history insertion order.
+        self.history_betrayals = {}
+
+        #Position of each target in the history, used to break ties like max() over the history.
+        self.history_order = {}
+
+        #Target with the most betrayals in the history (None while the history is empty).
+        self.most_betrayed_target = None
         
         #Probability with which this player will betray others.
         self.betray_probability = betray_probability
@@ -66,10 +93,15 @@ class Player:
                 return None
         else:
             #Q-values for cooperation and betrayal actions are fetched from the Q-table.
-            q_value_cooperate = self.q_table[state].get(None, 0.5)
-            q_value_betray = self.q_table[state].get(
-                str(target_player), self.betray_probability
-            )
+            if isinstance(self.q_table, ArrayQTable):
+                values = self.q_table.row(state)
+                q_value_cooperate = float(values[self.id])
+                q_value_betray = float(values[int(target_player)])
+            else:
+                q_value_cooperate = self.q_table[state].get(None, 0.5)
+                q_value_betray = self.q_table[state].get(
+                    str(target_player), self.betray_probability
+                )
             
             #Calculate the chance of betrayal based on the Q-values and betray_probability.
             betrayal_chance = self.betray_probability * (
@@ -92,12 +124,44 @@ class Player:
     '''
     def update_history(self, target_player, action):
         #Record the action (1 for betrayal, 0 for cooperation) in the target player's history.
-        self.history[target_player].append(1 if action is not None else 0)
+        history = self.history[target_player]
+        betrayed = 1 if action is not None else 0
+        forgotten = history[0] if len(history) == history.maxlen else 0
+        history.append(betrayed)
         
         #If the action was betrayal, increment the betrayal count for this player.
         if action is not None:
             self.betray_count += 1
 
+        #Keep the running betrayal total of the target and the most betrayed target up to date.
+        if target_player not in self.history_betrayals:
+            self.history_order[target_player] = len(self.history_order)
+            self.history_betrayals[target_player] = 0
+        self.history_betrayals[target_player] += betrayed - forgotten
+        self.update_most_betrayed_target(target_player, betrayed - forgotten)
+
+    '''
+    #Method to update the target with the most betrayals after the total of one target changed.
+        target_player: The target whose betrayal total changed.
+        change: The change of its betrayal total.
+        Ties go to the target that entered the history first, like max() over the history.
+    '''
+    def update_most_betrayed_target(self, target_player, change):
+        best = self.most_betrayed_target
+        if best is None:
+            self.most_betrayed_target = target_player
+        elif target_player == best:
+            #Only a sliding window can lower the total of the best target, then all targets are scanned.
+            if change < 0:
+                self.most_betrayed_target = max(self.history_betrayals, key=self.history_betrayals.get)
+        else:
+            total = self.history_betrayals[target_player]
+            best_total = self.history_betrayals[best]
+            if total > best_total or (
+                total == best_total and self.history_order[target_player] < self.history_order[best]
+            ):
+                self.most_betrayed_target = target_player
+
     '''
     #Method to update the Q-table using the Q-learning algorithm.
         state: The state before the action was taken.
@@ -106,6 +170,16 @@ class Player:
         new_state: The state after the action was taken.
     '''
     def update_q_table(self, state, action, reward, new_state):
+        if isinstance(self.q_table, ArrayQTable):
+            #Same update as below, using the interned row and the action column.
+            row = self.q_table.intern(state)
+            column = self.q_table.column(action)
+            current_q = float(self.q_table.values[row, column])
+            max_future_q = self.q_table.max_value(new_state)
+            new_q = (1 - self.alpha) * current_q + self.alpha * (reward + self.gamma * max_future_q)
+            self.q_table.values[row, column] = new_q
+            return
+
         #Fetch the current Q-value for the state-action pair.
         current_q = self.q_table[state][action]
         
@@ -125,15 +199,30 @@ class Game:
         n_players: Total number of players in the game.
         n_resources: Number of resources each player starts with.
         betray_probabilities: List of betrayal probabilities for each player.
-        play_turn_func: The function that simulates a turn in the game.
+        play_turn_func: The function that simulates a turn in the game. Rules with a RuleSpec (the game2 rules,
+            resolvers built by rules.compile_rule and Sim5Rule instances) are resolved on the betrayal graph
+            of the round (see rules._compile_sparse). Other functions are called with the actions dictionary.
+        compact_q_table: Give every player an ArrayQTable instead of a dictionary Q-table (default False).
+        q_table_factory: Optional factory of the players' Q-table stores (see Player).
+        history_length: Optional sliding window of the players' histories (see Player).
+        strategies: Optional strategies of the players (see strategies.Population), deciding the actions of
+            the whole population at once instead of Player.choose_action.
     '''
-    def __init__(self, n_players, n_resources, betray_probabilities, play_turn_func):
+    def __init__(self, n_players, n_resources, betray_probabilities, play_turn_func, compact_q_table=False,
+                 q_table_factory=None, history_length=None, strategies=None):
         self.n_players = n_players
         self.n_resources = n_resources
         
         #Create a list of Player objects, each with a unique ID and betrayal probability.
         self.players = [
-            Player(i, n_players, betray_probability=betray_probabilities[i])
+            Player(
+                i,
+                n_players,
+                betray_probability=betray_probabilities[i],
+                compact_q_table=compact_q_table,
+                q_table_factory=q_table_factory,
+                history_length=history_length,
+            )
             for i in range(n_players)
         ]
         
@@ -155,6 +244,47 @@ class Game:
         #Function used to simulate each turn.
         self.play_turn_func = play_turn_func
 
+        #Sparse resolver of the rule and its betrayer history, or None for the dictionary (legacy) path.
+        #The history starts from the one of the rule and is then kept by the game.
+        try:
+            spec, self.times_betrayers, _ = rule_state(play_turn_func, n_players)
+        except ValueError:
+            spec, self.times_betrayers = None, None
+        self.sparse_rule = None if spec is None else compile_rule(spec, sparse=True)
+
+        #Strategies of the players, with the last move and grudge of every target towards every player.
+        self.population = None if strategies is None else Population(strategies, n_players)
+        if self.population is not None:
+            self.last_moves = np.full((n_players, n_players), -1, dtype=np.int8)
+            self.grudges = np.zeros((n_players, n_players), dtype=bool)
+
+    '''
+    #Method to sum the lookup statistics of the players' array Q-tables.
+        Returns the total stored states, hits, misses, evictions and the overall hit rate.
+    '''
+    def q_table_stats(self):
+        totals = {"states": 0, "hits": 0, "misses": 0, "evictions": 0}
+        for player in self.players:
+            if isinstance(player.q_table, ArrayQTable):
+                stats = player.q_table.stats()
+                for key in totals:
+                    totals[key] += stats[key]
+            else:
+                totals["states"] += len(player.q_table)
+        lookups = totals["hits"] + totals["misses"]
+        totals["hit_rate"] = totals["hits"] / lookups if lookups else 0.0
+        return totals
+
+    '''
+    #Method to find the RuleSpec and betrayer history of the rule of the game (see rules.rule_state).
+        Returns the spec, the betrayer history array and a function writing that array back.
+    '''
+    def rule_state(self):
+        if self.sparse_rule is None:
+            return rule_state(self.play_turn_func, self.n_players)
+        #The sparse path updates the history array of the game in place.
+        return self.sparse_rule.rule_spec, self.times_betrayers, lambda times_betrayers: None
+
     '''
     #Method to select a target player for a given player.
         player: The player who is choosing a target.
@@ -165,59 +295,170 @@ class Game:
             return random.choice([i for i in range(self.n_players) if i != player.id])
         else:
             #Otherwise, choose the target with whom this player has had the most interaction (betrayal or cooperation).
-            return max(player.history, key=lambda t: sum(player.history[t]))
+            #The running totals kept by update_history make this O(1) instead of summing every history.
+            return player.most_betrayed_target
+
+    '''
+    #Method to get the Q-values read by the strategies for every player and its chosen target.
+        state: Current state of the game.
+        target_players: int array with the chosen target of each player.
+        Returns the arrays of cooperation Q-values, Q-values of betraying the target and best betrayal Q-values.
+    '''
+    def q_value_arrays(self, state, target_players):
+        q_cooperate = np.empty(self.n_players)
+        q_betray = np.empty(self.n_players)
+        q_betray_max = np.empty(self.n_players)
+        for player, target_player in zip(self.players, target_players.tolist()):
+            if isinstance(player.q_table, ArrayQTable):
+                values = player.q_table.row(state)
+                q_cooperate[player.id] = values[player.id]
+                q_betray[player.id] = values[target_player]
+                q_betray_max[player.id] = np.delete(values, player.id).max()
+            else:
+                q_values = player.q_table[state]
+                q_cooperate[player.id] = q_values.get(None, 0.5)
+                q_betray[player.id] = q_values.get(str(target_player), player.betray_probability)
+                q_betray_max[player.id] = max(value for action, value in q_values.items() if action is not None)
+        return q_cooperate, q_betray, q_betray_max
+
+    '''
+    #Method to choose the targets and actions of every player with the strategies of the population.
+        Every player chooses its target and draws the random number of its action in turn, in the same order
+        as the loop of play_round, so a population of QAdvantage strategies plays like the default Game.
+        Every strategy then decides the actions of its players with one call.
+        Returns the actions dictionary and the betrayers and betrayed players, like the loop of play_round.
+    '''
+    def choose_population_actions(self, state, round_num):
+        profiler = profiling.active
+        if profiler is not None:
+            start = time.perf_counter()
+
+        target_players = np.empty(self.n_players, dtype=np.intp)
+        draws = np.empty(self.n_players)
+        for player in self.players:
+            target_players[player.id] = self.choose_target(player)
+            draws[player.id] = random.random()
+        if profiler is not None:
+            start = profiler.lap("play_round.choose_target", start)
+
+        players = np.arange(self.n_players)
+        inputs = StrategyInputs(
+            round_num,
+            np.array([player.betray_probability for player in self.players]),
+            last_moves=self.last_moves[players, target_players],
+            grudges=self.grudges[players, target_players],
+        )
+        if self.population.needs_q_values:
+            inputs.q_cooperate, inputs.q_betray, inputs.q_betray_max = self.q_value_arrays(state, target_players)
+        betray = self.population.choose(inputs, draws)
+        if profiler is not None:
+            start = profiler.lap("play_round.choose_action", start)
+
+        #The targets remember the move of each player towards them, for the reciprocating strategies.
+        self.last_moves[target_players, players] = betray
+        self.grudges[target_players, players] |= betray
+
+        actions = {}
+        for player, target_player, betrays in zip(self.players, target_players.tolist(), betray.tolist()):
+            action = str(target_player) if betrays else None
+            actions[str(player.id)] = action
+            player.update_history(str(target_player), action)
+        betrayers = np.flatnonzero(betray)
+        if profiler is not None:
+            profiler.lap("play_round.update_history", start)
+        return actions, betrayers, target_players[betrayers]
 
     '''
     #Method to simulate a round of the game.
         round_num: The current round number in the game.
     '''
     def play_round(self, round_num):
+        #Profiler of the run (see profiling.py). When profiling is disabled, the phases are not timed.
+        profiler = profiling.active
+        if profiler is not None:
+            start = time.perf_counter()
+
         #Capture the current state of resources.
         state = tuple(self.resources)
         
         #Dictionary to store the actions chosen by each player.
         actions = {}
         
-        #Dictionary to store betrayals for each player.
-        betrayals = defaultdict(list)
+        #Edges of the betrayal graph of the round: each betrayer and its target.
+        betrayers = []
+        betrayed = []
 
         #Each player chooses a target and decides whether to betray or cooperate.
-        for player in self.players:
-            target_player = self.choose_target(player)
-            action = player.choose_action(state, target_player, round_num)
-            actions[str(player.id)] = action
+        if self.population is not None:
+            actions, betrayers, betrayed = self.choose_population_actions(state, round_num)
+            if profiler is not None:
+                start = time.perf_counter()
+        else:
+            for player in self.players:
+                target_player = self.choose_target(player)
+                if profiler is not None:
+                    start = profiler.lap("play_round.choose_target", start)
+                action = player.choose_action(state, target_player, round_num)
+                if profiler is not None:
+                    start = profiler.lap("play_round.choose_action", start)
+                actions[str(player.id)] = action
             
-            #If the player betrays the target, record the betrayal.
-            if action is not None:
-                betrayals[action].append(str(player.id))
+                #If the player betrays the target, record the betrayal.
+                if action is not None:
+                    betrayers.append(player.id)
+                    betrayed.append(int(action))
                 
-            #Update the player's history after the action is taken.
-            player.update_history(str(target_player), action)
+                #Update the player's history after the action is taken.
+                player.update_history(str(target_player), action)
+                if profiler is not None:
+                    start = profiler.lap("play_round.update_history", start)
+
+        #Sparse betrayal graph of the round, with the in-degree counters used for collapse detection.
+        betrayals = BetrayalGraph(betrayers, betrayed, self.n_players)
 
         #Simulate the turn and update total points, checking for a system collapse.
-        results, self.total_points, _, collapse_occurred = self.play_turn_func(
-            actions, self.total_points, self.n_resources
-        )
+        if self.sparse_rule is not None:
+            #The rule reads the betrayal graph and its in-degree counters directly.
+            total_points = np.fromiter(self.total_points.values(), dtype=np.int64, count=self.n_players)
+            turn_points, total_points, _, collapse_occurred = self.sparse_rule(
+                betrayals, total_points, self.n_resources, self.times_betrayers
+            )
+            turn_points = dict(zip(self.total_points, turn_points.tolist()))
+            self.total_points = dict(zip(self.total_points, total_points.tolist()))
+        else:
+            results, self.total_points, _, collapse_occurred = self.play_turn_func(
+                actions, self.total_points, self.n_resources
+            )
+            turn_points = {player_id: result[1] for player_id, result in results.items()}
+        if profiler is not None:
+            start = profiler.lap("play_round.resolve_turn", start)
 
         #Capture the new state after the round.
         new_state = tuple(self.total_points.values())
 
         #Update each player's Q-table based on the results of the round.
         for player in self.players:
-            reward = results[str(player.id)][1]  # Assuming this is the reward for the round.
+            reward = turn_points[str(player.id)]  #The points of the player in this round.
             player.update_q_table(state, actions[str(player.id)], reward, new_state)
+        if profiler is not None:
+            start = profiler.lap("play_round.update_q_table", start)
 
         #If a system collapse occurred, increment the collapse count and record the players involved.
         if collapse_occurred:
             self.collapse_count += 1
-            for betrayed, betrayers in betrayals.items():
-                if len(betrayers) > 2:
-                    for betrayer in betrayers:
-                        self.collapse_contributions[betrayer] += 1
+            for betrayer in betrayals.collapse_betrayers(2).tolist():
+                self.collapse_contributions[str(betrayer)] += 1
+
+        if profiler is not None:
+            profiler.lap("play_round.collapses", start)
+            if profiler.sample_every and round_num % profiler.sample_every == 0:
+                profiler.sample(self, round_num)
 
-        #Return the actions, updated resources, and betrayal details for this round.
+        #Return the actions, updated resources, betrayal details, turn points and collapse flag for this round.
         return {
             "actions": actions,
             "resources": self.total_points,
-            "betrayals": dict(betrayals),
+            "betrayals": betrayals,
+            "turn_points": turn_points,
+            "collapse": collapse_occurred,
         }
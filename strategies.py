@@ -0,0 +1,181 @@
+#Library of betrayal strategies deciding the actions of a whole population at once.
+#A strategy turns arrays describing the players (one entry per player, any shape such as (n_players,) or
+#(n_games, n_players)) into a betrayal chance per player, and a Population draws the actions of every
+#player with a single call per strategy. Mixed populations (different probabilities or Q-values per player)
+#are evaluated from the arrays, without a Python call per player.
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+'''
+#Class holding the arrays read by the strategies, with one entry per player.
+    round_num: The current round number.
+    betray_probabilities: Betrayal probability of each player.
+    q_cooperate, q_betray: Q-values of cooperating and of betraying the chosen target in the current state.
+    q_betray_max: Highest Q-value of the betrayal actions in the current state.
+    last_moves: Last move of the chosen target towards the player: 1 betrayal, 0 cooperation, -1 none yet.
+    grudges: Whether the chosen target ever betrayed the player.
+    The Q-values are only needed by strategies with needs_q_values, and can be left to None otherwise.
+'''
+class StrategyInputs:
+    def __init__(self, round_num, betray_probabilities, q_cooperate=None, q_betray=None, q_betray_max=None,
+                 last_moves=None, grudges=None):
+        self.round_num = round_num
+        self.betray_probabilities = betray_probabilities
+        self.q_cooperate = q_cooperate
+        self.q_betray = q_betray
+        self.q_betray_max = q_betray_max
+        self.last_moves = last_moves
+        self.grudges = grudges
+
+    #Method to select some players (an index on the last axis) of every array.
+    def subset(self, index):
+        fields = ("betray_probabilities", "q_cooperate", "q_betray", "q_betray_max", "last_moves", "grudges")
+        values = {
+            name: None if getattr(self, name) is None else getattr(self, name)[..., index]
+            for name in fields
+        }
+        return StrategyInputs(self.round_num, **values)
+
+'''
+#Base class of the strategies.
+    betrayal_chance returns, for every player of the inputs, the probability of betraying its chosen target.
+    needs_q_values tells the engines to fill the Q-values of the inputs.
+'''
+class Strategy(ABC):
+    needs_q_values = False
+
+    @abstractmethod
+    def betrayal_chance(self, inputs):
+        pass
+
+    def __repr__(self):
+        params = ", ".join(f"{name}={value!r}" for name, value in vars(self).items())
+        return f"{type(self).__name__}({params})"
+
+#Strategy betraying with the fixed betrayal probability of each player.
+class FixedProbability(Strategy):
+    def betrayal_chance(self, inputs):
+        return inputs.betray_probabilities
+
+'''
+#Strategy of simulation_game.Player.choose_action: the betrayal probability on the first round, then the
+#betrayal probability times the advantage of betraying over cooperating, at least `floor` (exploration).
+'''
+class QAdvantage(Strategy):
+    needs_q_values = True
+
+    def __init__(self, floor=0.1):
+        self.floor = floor
+
+    def betrayal_chance(self, inputs):
+        if inputs.round_num == 1:
+            return inputs.betray_probabilities
+        chance = inputs.betray_probabilities * (inputs.q_betray - inputs.q_cooperate)
+        return np.maximum(chance, self.floor)
+
+'''
+#Strategy betraying when betraying the chosen target has the higher Q-value (cooperating on ties), and
+#choosing a random action with probability epsilon.
+'''
+class EpsilonGreedyQ(Strategy):
+    needs_q_values = True
+
+    def __init__(self, epsilon=0.1):
+        self.epsilon = epsilon
+
+    def betrayal_chance(self, inputs):
+        return np.where(inputs.q_betray > inputs.q_cooperate, 1 - self.epsilon / 2, self.epsilon / 2)
+
+'''
+#Strategy betraying with the softmax probability of graphic_generation.get_betrayal_probability:
+#the best betrayal Q-value of the state against the cooperation Q-value.
+    temperature: Controls the balance between exploration and exploitation.
+'''
+class SoftmaxQ(Strategy):
+    needs_q_values = True
+
+    def __init__(self, temperature=1.0):
+        self.temperature = temperature
+
+    def betrayal_chance(self, inputs):
+        exp_betray = np.exp(inputs.q_betray_max / self.temperature)
+        exp_cooperate = np.exp(inputs.q_cooperate / self.temperature)
+        return exp_betray / (exp_betray + exp_cooperate)
+
+#Strategy repeating the last move of the chosen target towards the player (cooperating the first time).
+class TitForTat(Strategy):
+    def betrayal_chance(self, inputs):
+        return (inputs.last_moves == 1).astype(np.float64)
+
+#Strategy cooperating until the chosen target betrays the player once, then always betraying it.
+class GrimTrigger(Strategy):
+    def betrayal_chance(self, inputs):
+        return np.asarray(inputs.grudges, dtype=np.float64)
+
+#Strategies by name, for populations described in configuration files or on the command line.
+STRATEGIES = {
+    "fixed": FixedProbability,
+    "q_advantage": QAdvantage,
+    "epsilon_greedy": EpsilonGreedyQ,
+    "softmax": SoftmaxQ,
+    "tit_for_tat": TitForTat,
+    "grim_trigger": GrimTrigger,
+}
+
+#Function to build a strategy from its name and parameters.
+def make_strategy(name, **params):
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown strategy: {name}")
+    return STRATEGIES[name](**params)
+
+'''
+#Class assigning a strategy to every player and deciding the actions of the population.
+    strategies: One Strategy (or strategy name) for every player, or a list with one per player.
+    n_players: Total number of players (required when a single strategy is given for everyone).
+    Players sharing a strategy object are decided together by a single call.
+'''
+class Population:
+    def __init__(self, strategies, n_players=None):
+        if isinstance(strategies, (Strategy, str)):
+            strategies = [strategies] * n_players if n_players is not None else [strategies]
+        #Players sharing a strategy name share its strategy object.
+        named = {}
+        for strategy in strategies:
+            if isinstance(strategy, str) and strategy not in named:
+                named[strategy] = make_strategy(strategy)
+        strategies = [named[strategy] if isinstance(strategy, str) else strategy for strategy in strategies]
+        if n_players is not None and len(strategies) != n_players:
+            raise ValueError(f"Expected {n_players} strategies, got {len(strategies)}")
+
+        self.strategies = strategies
+        self.n_players = len(strategies)
+
+        #Players of each strategy object, in order of first appearance.
+        groups = {}
+        for i, strategy in enumerate(strategies):
+            groups.setdefault(id(strategy), (strategy, []))[1].append(i)
+        self.groups = [(strategy, np.array(players)) for strategy, players in groups.values()]
+        self.needs_q_values = any(strategy.needs_q_values for strategy, _ in self.groups)
+
+    '''
+    #Method to compute the betrayal chance of every player.
+        inputs: StrategyInputs whose last axis is the players of the population.
+    '''
+    def betrayal_chance(self, inputs):
+        if len(self.groups) == 1:
+            strategy, _ = self.groups[0]
+            return np.broadcast_to(strategy.betrayal_chance(inputs), np.shape(inputs.betray_probabilities))
+
+        chance = np.empty(np.shape(inputs.betray_probabilities))
+        for strategy, players in self.groups:
+            chance[..., players] = strategy.betrayal_chance(inputs.subset(players))
+        return chance
+
+    '''
+    #Method to decide the actions of every player.
+        draws: Uniform random numbers in [0, 1), one per player.
+        Returns a bool array, True where the player betrays its chosen target.
+    '''
+    def choose(self, inputs, draws):
+        return draws < self.betrayal_chance(inputs)
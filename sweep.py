@@ -0,0 +1,221 @@
+#Parallel runner for parameter sweeps over scenarios, betrayal profiles, players, rounds and replicates.
+#Each task receives its own child of a numpy SeedSequence, so results do not depend on the number of workers.
+import argparse
+import contextlib
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import profiling
+
+#Betrayal profiles used for the figures in images_to_article.
+ARTICLE_PROFILES = {
+    "all_0": [0.0],
+    "all_50": [0.5],
+    "all_100": [1.0],
+    "mixed": [0.2, 0.8],
+}
+
+'''
+#Function to expand a betrayal profile to the number of players.
+    profile: A single probability or a list of probabilities, repeated until n_players values are available.
+    n_players: Total number of players in the game.
+'''
+def expand_profile(profile, n_players):
+    profile = [profile] if np.isscalar(profile) else list(profile)
+    return [profile[i % len(profile)] for i in range(n_players)]
+
+'''
+#Function to build the list of tasks of a sweep.
+    The grid is the cartesian product scenario x profile x n_players x n_rounds x replicate,
+    and every task gets its own child of SeedSequence(seed), in grid order.
+'''
+def build_tasks(scenarios, profiles, n_players_list, n_rounds_list, n_replicates, n_resources=1, seed=0):
+    grid = list(itertools.product(
+        scenarios, profiles.items(), n_players_list, n_rounds_list, range(n_replicates)
+    ))
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
+
+    tasks = []
+    for (scenario, (profile_name, profile), n_players, n_rounds, replicate), task_seed in zip(grid, seeds):
+        tasks.append({
+            "scenario": scenario,
+            "profile": profile_name,
+            "betray_probabilities": expand_profile(profile, n_players),
+            "n_players": n_players,
+            "n_resources": n_resources,
+            "n_rounds": n_rounds,
+            "replicate": replicate,
+            "seed": task_seed,
+        })
+    return tasks
+
+'''
+#Function to build the folder where the plots of a task are saved.
+    Follows the images_to_article layout (scenario_<n>/<profile>) and only adds a sub folder
+    for the axes of the grid that have more than one value.
+'''
+def task_output_path(output_dir, task, multi_players, multi_rounds, multi_replicates):
+    path = os.path.join(output_dir, f"scenario_{task['scenario']}", task["profile"])
+    parts = []
+    if multi_players:
+        parts.append(f"n{task['n_players']}")
+    if multi_rounds:
+        parts.append(f"r{task['n_rounds']}")
+    if multi_replicates:
+        parts.append(f"rep{task['replicate']}")
+    if parts:
+        path = os.path.join(path, "_".join(parts))
+    return path
+
+'''
+#Function to run a single task of the sweep (executed in a worker process).
+    task: A task dictionary created by build_tasks.
+    output_path: The folder where the plots are saved, or None to skip plotting.
+    plots: Optional list of plot names to render (default: all of graphic_generation.PLOT_NAMES).
+    cache_dir: Optional folder of a results_cache.ResultsCache, so finished cells are not simulated again.
+    cache_bytes: Maximum size of the cache in bytes.
+    Returns the task parameters together with the calculated metrics.
+'''
+def run_task(task, output_path=None, plots=None, cache_dir=None, cache_bytes=1 << 30):
+    #Imported here so the workers only load matplotlib when they need it.
+    from graphic_generation import render_plots
+    from results_cache import ResultsCache, cached_run_simulation
+
+    cache = None if cache_dir is None else ResultsCache(cache_dir, cache_bytes)
+
+    #The simulation uses the random module, which is seeded from the task's own SeedSequence.
+    game_data, metrics, _ = cached_run_simulation(
+        cache,
+        task["n_players"],
+        task["n_resources"],
+        task["n_rounds"],
+        task["betray_probabilities"],
+        task["scenario"],
+        int(task["seed"].generate_state(1, np.uint64)[0]),
+    )
+
+    if output_path is not None:
+        #The task already runs in a worker, so its figures are rendered in the same process.
+        render_plots(metrics, task["n_rounds"], game_data, output_path, include=plots, max_workers=1)
+
+    result = {key: value for key, value in task.items() if key != "seed"}
+    result["metrics"] = metrics
+    return result
+
+'''
+#Function to run a sweep across a pool of worker processes.
+    scenarios: List of scenario numbers (see run_simulation).
+    profiles: Dictionary of named betrayal profiles.
+    n_players_list, n_rounds_list: Lists of player counts and round counts.
+    n_replicates: Number of replicates per grid cell.
+    n_resources: Number of resources each player starts with.
+    seed: Root seed of the sweep.
+    max_workers: Number of worker processes (1 runs the tasks in the current process).
+    output_dir: Folder where the plots are saved, or None to skip plotting.
+    plots: Optional list of plot names to render, e.g. ["resources_over_time", "collapse_impact"].
+    cache_dir: Optional folder of a results cache shared by the workers (see run_task).
+    cache_bytes: Maximum size of the cache in bytes.
+    Returns the results in grid order.
+'''
+def run_sweep(scenarios, profiles, n_players_list, n_rounds_list, n_replicates=1,
+              n_resources=1, seed=0, max_workers=None, output_dir=None, plots=None,
+              cache_dir=None, cache_bytes=1 << 30):
+    tasks = build_tasks(scenarios, profiles, n_players_list, n_rounds_list, n_replicates, n_resources, seed)
+
+    output_paths = [
+        None if output_dir is None else task_output_path(
+            output_dir, task, len(n_players_list) > 1, len(n_rounds_list) > 1, n_replicates > 1
+        )
+        for task in tasks
+    ]
+
+    plot_selections = [plots] * len(tasks)
+    cache_dirs = [cache_dir] * len(tasks)
+    cache_sizes = [cache_bytes] * len(tasks)
+
+    if max_workers == 1:
+        return [run_task(task, path, plots, cache_dir, cache_bytes) for task, path in zip(tasks, output_paths)]
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_sweep_worker) as executor:
+        return list(executor.map(run_task, tasks, output_paths, plot_selections, cache_dirs, cache_sizes))
+
+#Function run once in each worker process to render figures with the non-interactive Agg backend.
+def _init_sweep_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+'''
+#Function to parse a profile given on the command line as name=p1,p2,...
+'''
+def parse_profile(text):
+    name, _, values = text.partition("=")
+    if not values:
+        raise argparse.ArgumentTypeError(f"profile must be name=p1,p2,... (got {text!r})")
+    return name, [float(value) for value in values.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of the dilemma game.")
+    parser.add_argument("--scenarios", type=int, nargs="+", default=[1, 2])
+    parser.add_argument(
+        "--profiles", type=parse_profile, nargs="+",
+        help="Betrayal profiles as name=p1,p2,... (default: the images_to_article profiles)",
+    )
+    parser.add_argument("--n-players", type=int, nargs="+", default=[6])
+    parser.add_argument("--n-rounds", type=int, nargs="+", default=[100])
+    parser.add_argument("--replicates", type=int, default=1)
+    parser.add_argument("--n-resources", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Folder where the plots are saved")
+    parser.add_argument("--plots", nargs="+", default=None, help="Plot names to render (default: all)")
+    parser.add_argument("--cache", default=None, help="Folder of the results cache (default: no cache)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Maximum size of the cache in MiB")
+    parser.add_argument(
+        "--trace", default=None,
+        help="Time the phases of the sweep (in this process) and save a Chrome trace JSON to this file",
+    )
+    parser.add_argument("--sample-every", type=int, default=100, help="Rounds between Q-table samples of --trace")
+    parser.add_argument("--track-memory", action="store_true", help="Add the traced memory to the --trace samples")
+    args = parser.parse_args()
+
+    profiles = dict(args.profiles) if args.profiles else ARTICLE_PROFILES
+
+    #The profiler only sees the current process, so a traced sweep runs its tasks without workers.
+    if args.trace:
+        timing = profiling.profile(trace=True, sample_every=args.sample_every, track_memory=args.track_memory)
+    else:
+        timing = contextlib.nullcontext()
+    with timing as profiler:
+        results = run_sweep(
+            args.scenarios,
+            profiles,
+            args.n_players,
+            args.n_rounds,
+            args.replicates,
+            args.n_resources,
+            args.seed,
+            1 if args.trace else args.workers,
+            args.output,
+            args.plots,
+            args.cache,
+            args.cache_size << 20,
+        )
+
+    if args.trace:
+        print(profiler.format_summary())
+        profiler.save_chrome_trace(args.trace)
+
+    #Print a summary line per task.
+    for result in results:
+        metrics = result["metrics"]
+        print(
+            f"scenario={result['scenario']} profile={result['profile']} "
+            f"n_players={result['n_players']} n_rounds={result['n_rounds']} "
+            f"replicate={result['replicate']}: "
+            f"cooperation={np.mean(metrics['overall_cooperation_rate']):.2f}% "
+            f"collapses={metrics['impact_of_system_collapse']['total_collapses']} "
+            f"best={metrics['best_player']}"
+        )
@@ -0,0 +1,14 @@
+import random
+
+import profiling
+from run_simulation_and_analysis import run_simulation
+
+#Test that the default run times the metrics accumulated while the rounds are played.
+def test_default_run_times_the_metrics():
+    random.seed(0)
+    with profiling.profile() as profiler:
+        run_simulation(4, 2, 20, [0.3, 0.5, 0.7, 0.9], 2)
+    phases = profiler.phases
+    assert phases["metrics.player_stats"][1] == 21
+    assert phases["metrics.overall_cooperation_rate"][1] == 21
+    assert phases["metrics.reciprocity_index"][1] == 1
@@ -0,0 +1,28 @@
+import random
+
+import numpy as np
+
+from results_cache import ResultsCache, cached_run_simulation
+from run_simulation_and_analysis import run_simulation
+
+ARGS = (4, 2, 30, [0.2, 0.4, 0.6, 0.8], 2)
+
+#Test that an unseeded run continues from the random state of the caller and is not cached.
+def test_unseeded_run_keeps_random_state(tmp_path):
+    cache = ResultsCache(tmp_path)
+    random.seed(7)
+    expected, _, _ = run_simulation(*ARGS)
+    random.seed(7)
+    game_data, _, hit = cached_run_simulation(cache, *ARGS, seed=None)
+    assert not hit
+    assert np.array_equal(game_data.points[:30], expected.points[:30])
+    assert list(cache.entries()) == []
+
+#Test that a seeded run is stored and then read back from the cache.
+def test_seeded_run_is_cached(tmp_path):
+    cache = ResultsCache(tmp_path)
+    first, _, hit = cached_run_simulation(cache, *ARGS, seed=3)
+    assert not hit
+    second, _, hit = cached_run_simulation(cache, *ARGS, seed=3)
+    assert hit
+    assert np.array_equal(first.points[:30], second.points[:30])
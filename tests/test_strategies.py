@@ -0,0 +1,30 @@
+import random
+
+import pytest
+
+import game2
+from simulation_game import Game
+from strategies import QAdvantage, Strategy
+
+#Function to play a game and return the actions and points of every round and the final Q-tables.
+def _play(n_rounds, seed, **kwargs):
+    random.seed(seed)
+    game = Game(6, 1, [0.2, 0.8, 0.5, 0.1, 0.9, 0.3], game2.play_turn_v2, **kwargs)
+    rounds = [game.play_round(round_num) for round_num in range(1, n_rounds + 1)]
+    return (
+        [(dict(result["actions"]), dict(result["resources"])) for result in rounds],
+        [dict(player.q_table.items()) for player in game.players],
+    )
+
+#Test that a population of QAdvantage strategies reproduces the default Game for the same seed.
+@pytest.mark.parametrize("compact_q_table", [False, True])
+def test_q_advantage_population_matches_default_game(compact_q_table):
+    default_rounds, default_q_tables = _play(150, 3, compact_q_table=compact_q_table)
+    population_rounds, population_q_tables = _play(150, 3, compact_q_table=compact_q_table, strategies=QAdvantage())
+    assert population_rounds == default_rounds
+    assert population_q_tables == default_q_tables
+
+#Test that a strategy must implement betrayal_chance.
+def test_strategy_is_abstract():
+    with pytest.raises(TypeError):
+        Strategy()
@@ -0,0 +1,41 @@
+import random
+
+import numpy as np
+
+from run_simulation_and_analysis import run_simulation
+from trajectory_store import HEADER_ALIGNMENT, TrajectoryStore, open_trajectory
+
+#Test that the parameters of a few hundred players fit in the header of a trajectory file.
+def test_run_simulation_with_hundreds_of_players(tmp_path):
+    n_players, n_rounds = 300, 5
+    probabilities = [i / n_players for i in range(n_players)]
+
+    random.seed(0)
+    in_memory, _, _ = run_simulation(n_players, 2, n_rounds, probabilities, 2)
+    random.seed(0)
+    store, _, _ = run_simulation(n_players, 2, n_rounds, probabilities, 2, trajectory_path=tmp_path / "run.traj")
+    store.close()
+
+    header = TrajectoryStore.read_header(tmp_path / "run.traj")
+    assert header["header_size"] > HEADER_ALIGNMENT
+    assert header["header_size"] % HEADER_ALIGNMENT == 0
+    with open_trajectory(tmp_path / "run.traj") as stored:
+        assert stored.metadata["betray_probabilities"] == probabilities
+        assert len(stored) == n_rounds
+        assert np.array_equal(stored.targets[:n_rounds], in_memory.targets[:n_rounds])
+        assert np.array_equal(stored.points[:n_rounds], in_memory.points[:n_rounds])
+        assert np.array_equal(stored.turn_points[:n_rounds], in_memory.turn_points[:n_rounds])
+
+#Test that appending to a file with a large header keeps the rounds already stored.
+def test_append_with_large_metadata(tmp_path):
+    path = tmp_path / "large.traj"
+    metadata = {"betray_probabilities": [0.5] * 2000}
+    with TrajectoryStore(path, "w", 3, metadata=metadata, chunk_rounds=2) as store:
+        store.record_arrays([1, -1, 0], [1, 2, 3], [1, 0, 1], False)
+    with TrajectoryStore(path, "a", chunk_rounds=2) as store:
+        store.record_rounds(np.full((3, 3), -1), np.full((3, 3), 7), np.zeros((3, 3)), [False, True, False])
+    with open_trajectory(path) as store:
+        assert store.metadata == metadata
+        assert store.targets[:4].tolist() == [[1, -1, 0], [-1, -1, -1], [-1, -1, -1], [-1, -1, -1]]
+        assert store.points[0].tolist() == [1, 2, 3]
+        assert store.collapses[:4].tolist() == [False, False, True, False]
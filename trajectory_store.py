@@ -0,0 +1,183 @@
+#On-disk trajectory store for long runs.
+#Rounds are streamed into fixed-width records of a memory-mapped file, so a run of millions of rounds
+#only keeps the pages being written in memory, and can be re-analyzed later without re-simulating.
+#
+#File layout: an index header (magic, the header size as a little-endian uint64, then a JSON index padded
+#with spaces to the header size), followed by one record per round with the fields targets (int16 per
+#player, -1 for cooperation), points and turn_points (int64 per player) and collapse (bool).
+#The header size is a multiple of HEADER_ALIGNMENT chosen when the file is created, so the metadata of the
+#run (e.g. the betrayal probability of every player) can be of any size.
+import json
+import os
+
+import numpy as np
+
+from round_recorder import RoundRecorder, record_dtype
+
+#Magic bytes at the start of every trajectory file.
+MAGIC = b"DLMTRAJ\x00"
+
+#Size in bytes of the header size field following the magic bytes.
+SIZE_FIELD = 8
+
+#The header size is a multiple of HEADER_ALIGNMENT (records start right after the header).
+HEADER_ALIGNMENT = 4096
+
+#Bytes left free in the header for the index to grow (only n_recorded changes after the file is created).
+HEADER_SLACK = 64
+
+#Version of the file layout.
+VERSION = 1
+
+'''
+#Class storing the rounds of a game in a memory-mapped file.
+    It is a RoundRecorder whose columns are views of the mapped records, so it can be used wherever a
+    RoundRecorder is (run_simulation, evaluation, graphic_generation) and slicing a column only reads
+    the pages of the requested rounds.
+'''
+class TrajectoryStore(RoundRecorder):
+    '''
+    #Constructor to open or create a trajectory file.
+        path: The trajectory file.
+        mode: "r" to read, "a" to append to an existing file, "w" to create (or overwrite) a file.
+        n_players: Total number of players in the game (only for mode "w").
+        metadata: Optional JSON serializable dictionary saved in the header (only for mode "w"),
+            e.g. the parameters of the run.
+        chunk_rounds: Number of rounds the file grows by when it is full.
+    '''
+    def __init__(self, path, mode="r", n_players=None, metadata=None, chunk_rounds=65536):
+        if mode not in ("r", "a", "w"):
+            raise ValueError(f"Unknown mode: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self.chunk_rounds = chunk_rounds
+
+        if mode == "w":
+            if n_players is None:
+                raise ValueError("n_players is required to create a trajectory file")
+            self.n_players = n_players
+            self.metadata = dict(metadata or {})
+            self.n_recorded = 0
+            self.header_size = None
+            with open(path, "wb") as file:
+                file.write(self._header())
+            self._map(chunk_rounds)
+        else:
+            header = self.read_header(path)
+            self.n_players = header["n_players"]
+            self.metadata = header["metadata"]
+            self.n_recorded = header["n_recorded"]
+            self.header_size = header["header_size"]
+            capacity = (os.path.getsize(path) - self.header_size) // record_dtype(self.n_players).itemsize
+            self._map(max(capacity, self.n_recorded))
+
+    '''
+    #Function to read the index header of a trajectory file.
+        Returns a dictionary with the version, n_players, n_recorded, the record fields, the metadata
+        and the header size.
+    '''
+    @staticmethod
+    def read_header(path):
+        with open(path, "rb") as file:
+            prefix = file.read(len(MAGIC) + SIZE_FIELD)
+            if len(prefix) < len(MAGIC) + SIZE_FIELD or not prefix.startswith(MAGIC):
+                raise ValueError(f"{path} is not a trajectory file")
+            header_size = int.from_bytes(prefix[len(MAGIC):], "little")
+            index = json.loads(file.read(header_size - len(prefix)).decode("ascii"))
+        if index["version"] != VERSION:
+            raise ValueError(f"Unsupported trajectory version: {index['version']}")
+        index["header_size"] = header_size
+        return index
+
+    '''
+    #Method to build the index header of the file.
+        The header size is chosen on the first call (when the file is created) and kept afterwards.
+    '''
+    def _header(self):
+        dtype = record_dtype(self.n_players)
+        index = json.dumps({
+            "version": VERSION,
+            "n_players": self.n_players,
+            "n_recorded": self.n_recorded,
+            "record_size": dtype.itemsize,
+            "fields": {name: [str(dtype.fields[name][0]), dtype.fields[name][1]] for name in dtype.names},
+            "metadata": self.metadata,
+        }).encode("ascii")
+        prefix_size = len(MAGIC) + SIZE_FIELD
+        if self.header_size is None:
+            needed = prefix_size + len(index) + HEADER_SLACK
+            self.header_size = -(-needed // HEADER_ALIGNMENT) * HEADER_ALIGNMENT
+        if prefix_size + len(index) > self.header_size:
+            raise ValueError("The trajectory index does not fit in the header")
+        return MAGIC + self.header_size.to_bytes(SIZE_FIELD, "little") + index.ljust(self.header_size - prefix_size)
+
+    #Method to map `capacity` records of the file and point the columns at them.
+    def _map(self, capacity):
+        if capacity == 0:
+            self._records = np.zeros(0, dtype=record_dtype(self.n_players))
+        else:
+            self._records = np.memmap(
+                self.path, dtype=record_dtype(self.n_players), mode="r" if self.mode == "r" else "r+",
+                offset=self.header_size, shape=(capacity,),
+            )
+        self.targets = self._records["targets"]
+        self.points = self._records["points"]
+        self.turn_points = self._records["turn_points"]
+        self.collapses = self._records["collapse"]
+
+    #Method to grow the file by chunk_rounds records.
+    def _grow(self):
+        if self.mode == "r":
+            raise ValueError("The trajectory file is open for reading")
+        self.flush()
+        self._map(len(self._records) + self.chunk_rounds)
+
+    #Method to write the number of recorded rounds to the header and the records to disk.
+    def flush(self):
+        if self.mode == "r":
+            return
+        if isinstance(self._records, np.memmap):
+            self._records.flush()
+        with open(self.path, "r+b") as file:
+            file.write(self._header())
+
+    #Method to forget the rounds after the first n_rounds, e.g. before resuming from a checkpoint.
+    def truncate(self, n_rounds):
+        self.n_recorded = min(self.n_recorded, n_rounds)
+        self.flush()
+
+    '''
+    #Method to close the file, dropping the unused preallocated records.
+    '''
+    def close(self):
+        if self.mode == "r":
+            self._records = None
+            return
+        self.flush()
+        self._records = None
+        self.targets = self.points = self.turn_points = self.collapses = None
+        with open(self.path, "r+b") as file:
+            file.truncate(self.header_size + self.n_recorded * record_dtype(self.n_players).itemsize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    '''
+    #Method to get a range of rounds as a RoundRecorder over views of the mapped records.
+        start, stop: Round indices, like a slice (default: every recorded round).
+    '''
+    def window(self, start=None, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.n_recorded)
+        stop = max(start, stop)
+        return RoundRecorder.from_columns(
+            self.targets[start:stop], self.points[start:stop], self.turn_points[start:stop],
+            self.collapses[start:stop],
+        )
+
+#Function to open a trajectory file for reading.
+def open_trajectory(path):
+    return TrajectoryStore(path, "r")